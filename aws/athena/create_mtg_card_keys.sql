@@ -0,0 +1,9 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS mtg.mtg_card_keys (
+     card_key INT
+    ,id STRING
+    ,set STRING
+    )
+ROW FORMAT DELIMITED FIELDS TERMINATED BY ','
+STORED AS TEXTFILE
+LOCATION 's3://${MTG_PRIMARY_BUCKET}/mtg_card_keys/'
+TBLPROPERTIES ('skip.header.line.count' = '1');
@@ -1,5 +1,5 @@
 CREATE TABLE IF NOT EXISTS mtg.mtg_prices_iceberg (
-	 id STRING
+	 card_key INT
 	,usd DECIMAL(10, 2)
 	,usd_foil DECIMAL(10, 2)
 	,pull_date DATE
@@ -9,4 +9,7 @@ LOCATION 's3://${MTG_PRIMARY_BUCKET}/mtg_prices_iceberg'
 TBLPROPERTIES (
 	 'table_type'='iceberg'
 	,'format'='parquet'
+	,'write_target_data_file_size_bytes'='134217728'
+	,'vacuum_min_snapshots_to_keep'='7'
+	,'vacuum_max_snapshot_age_seconds'='1209600'
 	);
\ No newline at end of file
@@ -1,5 +1,5 @@
 CREATE EXTERNAL TABLE IF NOT EXISTS mtg.mtg_prices_parquet (
-     id STRING
+     card_key INT
     ,usd DOUBLE
     ,usd_foil DOUBLE
     ,pull_date STRING
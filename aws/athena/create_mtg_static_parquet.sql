@@ -1,5 +1,6 @@
 CREATE EXTERNAL TABLE IF NOT EXISTS mtg.mtg_static_parquet (
      id STRING
+    ,card_key INT
     ,oracle_id STRING
     ,mtgo_id DOUBLE
     ,mtgo_foil_id DOUBLE
@@ -13,6 +14,7 @@ CREATE EXTERNAL TABLE IF NOT EXISTS mtg.mtg_static_parquet (
     ,set_type STRING
     ,rarity STRING
     ,pull_date STRING
+    ,row_hash BIGINT
     )
 STORED AS PARQUET
 LOCATION 's3://${MTG_PRIMARY_BUCKET}/mtg_static_parquet/year=2024/month=08/day=09/'
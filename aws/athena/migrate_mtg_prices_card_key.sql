@@ -0,0 +1,52 @@
+-- One-time move of the price tables from the UUID id to the integer card_key.
+-- Run after the first json_to_parquet run that writes mtg_card_keys/card_keys.csv.gz,
+-- and before deploying the lambdas that join on card_key.
+
+-- Daily Parquet partitions written from now on carry card_key instead of id.
+-- REPLACE COLUMNS only changes the table schema: files already in older partitions keep
+-- id and no card_key, so those partitions read card_key as NULL and can no longer be
+-- told apart by card. Nothing reads them by card after this migration. The history lives
+-- in mtg_prices_iceberg, keyed below, and athena_add_partitions_all skips NULL card_key
+-- rows if an old day is re-merged. To make an old partition queryable by card again,
+-- replay the day with backfill.py while its raw JSON is still retained.
+ALTER TABLE mtg.mtg_prices_parquet REPLACE COLUMNS (
+     card_key INT
+    ,usd DOUBLE
+    ,usd_foil DOUBLE
+    ,pull_date STRING
+    );
+
+ALTER TABLE mtg.mtg_static_parquet REPLACE COLUMNS (
+     id STRING
+    ,card_key INT
+    ,oracle_id STRING
+    ,mtgo_id DOUBLE
+    ,mtgo_foil_id DOUBLE
+    ,tcgplayer_id DOUBLE
+    ,cardmarket_id DOUBLE
+    ,name STRING
+    ,lang STRING
+    ,released_at STRING
+    ,set_name STRING
+    ,set STRING
+    ,set_type STRING
+    ,rarity STRING
+    ,pull_date STRING
+    );
+
+-- Key the Iceberg history
+ALTER TABLE mtg.mtg_prices_iceberg ADD COLUMNS (card_key INT);
+
+MERGE INTO mtg.mtg_prices_iceberg AS price
+USING mtg.mtg_card_keys AS keys
+ON price.id = keys.id
+WHEN MATCHED THEN UPDATE SET card_key = keys.card_key;
+
+-- Must return 0 before dropping id
+SELECT count(*) AS unkeyed_rows FROM mtg.mtg_prices_iceberg WHERE card_key IS NULL;
+
+ALTER TABLE mtg.mtg_prices_iceberg DROP COLUMN id;
+
+-- The MERGE left delete files against every data file; compacting rewrites them
+-- with card_key applied and without the dropped id column
+OPTIMIZE mtg.mtg_prices_iceberg REWRITE DATA USING BIN_PACK;
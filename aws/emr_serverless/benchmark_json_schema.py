@@ -0,0 +1,111 @@
+"""
+Compare json_to_parquet's bulk read with an inferred schema and with BULK_SCHEMA.
+
+Runs Spark locally on a synthetic bulk file (local/synthetic_scryfall.py), for example:
+    python aws/emr_serverless/benchmark_json_schema.py --scale 90k --repeats 3
+
+Both reads take the multiline JSON array, so only the schema differs:
+    inferred   spark.read.option("multiline", "true").json(path), as the job read before
+               SCHEMA_VERSION 1: a full pass to infer every field, all of them cached
+    declared   the same read with BULK_SCHEMA, so only the projected fields are parsed
+               and cached
+For each it reports the best-of-N time to fill the cache, the cached size from Spark's
+storage status, and the time to compute the daily and static projections. The projected
+rows must be identical both ways.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(HERE)), 'local'))
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, dense_rank, sum as spark_sum, xxhash64
+from json_to_parquet import BULK_SCHEMA, process_daily_prices, process_static_fields
+from synthetic_scryfall import SCALE_FACTORS, write_bulk_file
+
+MB = 1024 * 1024
+PULL_DATE = '2025-06-01'
+
+def cached_bytes(spark):
+    """Memory and disk used by every cached RDD"""
+    return sum(info.memSize() + info.diskSize() for info in spark.sparkContext._jsc.sc().getRDDStorageInfo())
+
+def fingerprint(df):
+    """(rows, sum of row hashes), equal for two DataFrames holding the same rows in any order"""
+    row = df.select(xxhash64(*df.columns).alias("row")).agg(spark_sum(col("row").cast("decimal(38,0)"))).collect()[0]
+    return df.count(), row[0]
+
+def run(spark, path, mode):
+    reader = spark.read.option("multiline", "true")
+    if mode == 'declared':
+        reader = reader.schema(BULK_SCHEMA) \
+            .option("mode", "PERMISSIVE") \
+            .option("columnNameOfCorruptRecord", "_corrupt_record")
+
+    start = time.perf_counter()
+    df_raw = reader.json(path)
+    df_raw.cache()
+    rows = df_raw.count()
+    read_seconds = time.perf_counter() - start
+    cached = cached_bytes(spark)
+
+    # Dense keys by id stand in for the card_keys dictionary, identical in both modes
+    df_keys = df_raw.select("id").distinct() \
+        .withColumn("card_key", (dense_rank().over(Window.orderBy("id")) - 1).cast("int"))
+    df_daily = process_daily_prices(df_raw, df_keys, PULL_DATE)
+    df_static = process_static_fields(df_raw, df_keys, PULL_DATE)
+
+    start = time.perf_counter()
+    df_daily.write.format("noop").mode("overwrite").save()
+    df_static.write.format("noop").mode("overwrite").save()
+    project_seconds = time.perf_counter() - start
+
+    fingerprints = (fingerprint(df_daily), fingerprint(df_static))
+    df_raw.unpersist(blocking=True)
+    return {'rows': rows, 'read': read_seconds, 'project': project_seconds, 'cached': cached,
+            'fields': len(df_raw.columns), 'fingerprints': fingerprints}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bulk JSON read with and without a declared schema')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='90k')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cores', type=int, default=os.cpu_count())
+    parser.add_argument('--driver-memory', default='6g')
+    args = parser.parse_args()
+
+    spark = SparkSession.builder \
+        .master(f"local[{args.cores}]") \
+        .config("spark.driver.memory", args.driver_memory) \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .getOrCreate()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'all_cards.json')
+        size, cards = write_bulk_file(path, SCALE_FACTORS[args.scale], PULL_DATE, args.seed)
+        print(f"Synthetic bulk file: {cards} cards, {size / MB:.1f}MB")
+
+        results = {}
+        for mode in ['inferred', 'declared']:
+            runs = [run(spark, path, mode) for _ in range(args.repeats)]
+            results[mode] = dict(runs[-1], read=min(r['read'] for r in runs), project=min(r['project'] for r in runs))
+
+    spark.stop()
+
+    print(f"\nBulk JSON read on local[{args.cores}], {cards} cards, best of {args.repeats}")
+    print(f"{'mode':<10}{'fields':>8}{'read s':>9}{'cached MB':>11}{'project s':>11}{'total s':>9}")
+    for mode, result in results.items():
+        print(f"{mode:<10}{result['fields']:>8}{result['read']:>9.2f}{result['cached'] / MB:>11.1f}"
+              f"{result['project']:>11.2f}{result['read'] + result['project']:>9.2f}")
+
+    if results['inferred']['fingerprints'] != results['declared']['fingerprints']:
+        print("Projected rows differ between the inferred and declared reads")
+        sys.exit(1)
+    print("Projected rows identical in both modes")
+
+if __name__ == "__main__":
+    main()
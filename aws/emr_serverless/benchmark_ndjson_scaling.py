@@ -0,0 +1,130 @@
+"""
+Show that json_to_parquet's read scales with cores once the bulk array is NDJSON shards.
+
+Runs Spark locally on a synthetic bulk file (local/synthetic_scryfall.py), for example:
+    python aws/emr_serverless/benchmark_ndjson_scaling.py --scale 500k --cores 1 2 4 8
+
+The file is transcoded with data_pull.transcode_to_ndjson against moto, exactly as the
+Lambda does it, and the shards are copied to local disk. For each core count a fresh
+local[N] session reads, with BULK_SCHEMA, either
+    multiline  the single JSON array, which Spark cannot split, so it is one task
+    ndjson     the shards, one or more tasks each
+and computes the daily and static projections. It reports the best-of-N time, the input
+tasks and the speedup over the first core count. The ndjson time should fall as cores
+are added while the multiline time stays flat. The projected rows must be identical.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(HERE))
+sys.path[:0] = [os.path.join(REPO_ROOT, 'local'), os.path.join(REPO_ROOT, 'aws', 'lambda')]
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, dense_rank, sum as spark_sum, xxhash64
+from json_to_parquet import BULK_SCHEMA, process_daily_prices, process_static_fields
+from synthetic_scryfall import SCALE_FACTORS, write_bulk_file
+
+MB = 1024 * 1024
+PULL_DATE = '2025-06-01'
+BUCKET = 'mtg-benchmark-primary'
+
+def write_shards(bulk_path, shard_dir, shard_bytes):
+    """Transcode the bulk file with data_pull against moto and copy the shards to shard_dir"""
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        os.environ.setdefault(name, value)
+    os.environ.pop('AWS_ENDPOINT_URL', None)
+
+    from moto import mock_aws
+    with mock_aws():
+        import data_pull
+        data_pull.s3.create_bucket(Bucket=BUCKET)
+        data_pull.s3.upload_file(bulk_path, BUCKET, 'mtg_temp_json/all_cards.json')
+        shard_count, records = data_pull.transcode_to_ndjson(BUCKET, 'mtg_temp_json/all_cards.json',
+                                                             'mtg_temp_json/shards/', shard_bytes=shard_bytes)
+        for page in data_pull.s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET, Prefix='mtg_temp_json/shards/'):
+            for item in page.get('Contents', []):
+                data_pull.s3.download_file(BUCKET, item['Key'], os.path.join(shard_dir, os.path.basename(item['Key'])))
+    return shard_count, records
+
+def fingerprint(df):
+    """(rows, sum of row hashes), equal for two DataFrames holding the same rows in any order"""
+    row = df.select(xxhash64(*df.columns).alias("row")).agg(spark_sum(col("row").cast("decimal(38,0)"))).collect()[0]
+    return df.count(), row[0]
+
+def run(spark, path, mode):
+    reader = spark.read.schema(BULK_SCHEMA) \
+        .option("mode", "PERMISSIVE") \
+        .option("columnNameOfCorruptRecord", "_corrupt_record")
+    if mode == 'multiline':
+        reader = reader.option("multiline", "true")
+
+    start = time.perf_counter()
+    df_raw = reader.json(path)
+    df_raw.cache()
+    df_raw.count()
+    tasks = df_raw.rdd.getNumPartitions()
+
+    # Dense keys by id stand in for the card_keys dictionary, identical in both modes
+    df_keys = df_raw.select("id").distinct() \
+        .withColumn("card_key", (dense_rank().over(Window.orderBy("id")) - 1).cast("int"))
+    df_daily = process_daily_prices(df_raw, df_keys, PULL_DATE)
+    df_static = process_static_fields(df_raw, df_keys, PULL_DATE)
+    df_daily.write.format("noop").mode("overwrite").save()
+    df_static.write.format("noop").mode("overwrite").save()
+    seconds = time.perf_counter() - start
+
+    fingerprints = (fingerprint(df_daily), fingerprint(df_static))
+    df_raw.unpersist(blocking=True)
+    return {'seconds': seconds, 'tasks': tasks, 'fingerprints': fingerprints}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bulk JSON read across local core counts')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='500k')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cores', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--shard-mb', type=int, default=16,
+                        help='Shard size; smaller than the Lambda default so a local file makes enough shards')
+    parser.add_argument('--driver-memory', default='6g')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        bulk_path = os.path.join(work_dir, 'all_cards.json')
+        shard_dir = os.path.join(work_dir, 'shards')
+        os.makedirs(shard_dir)
+        size, cards = write_bulk_file(bulk_path, SCALE_FACTORS[args.scale], PULL_DATE, args.seed)
+        shard_count, records = write_shards(bulk_path, shard_dir, args.shard_mb * MB)
+        if records != cards:
+            raise RuntimeError(f"Transcoded {records} records, expected {cards}")
+        print(f"Synthetic bulk file: {cards} cards, {size / MB:.1f}MB, {shard_count} NDJSON shards")
+
+        results = {}
+        for cores in args.cores:
+            spark = SparkSession.builder \
+                .master(f"local[{cores}]") \
+                .config("spark.driver.memory", args.driver_memory) \
+                .config("spark.sql.adaptive.enabled", "true") \
+                .getOrCreate()
+            for mode, path in [('multiline', bulk_path), ('ndjson', shard_dir)]:
+                runs = [run(spark, path, mode) for _ in range(args.repeats)]
+                results[(mode, cores)] = dict(runs[-1], seconds=min(r['seconds'] for r in runs))
+            spark.stop()
+
+    print(f"\nBulk JSON read and projection, {cards} cards, best of {args.repeats}")
+    print(f"{'mode':<11}{'cores':>6}{'tasks':>7}{'seconds':>10}{'speedup':>9}")
+    for (mode, cores), result in results.items():
+        speedup = results[(mode, args.cores[0])]['seconds'] / result['seconds']
+        print(f"{mode:<11}{cores:>6}{result['tasks']:>7}{result['seconds']:>10.2f}{speedup:>8.2f}x")
+
+    if len({result['fingerprints'] for result in results.values()}) != 1:
+        print("Projected rows differ between runs")
+        sys.exit(1)
+    print("Projected rows identical in every run")
+
+if __name__ == "__main__":
+    main()
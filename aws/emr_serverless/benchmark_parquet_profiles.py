@@ -0,0 +1,99 @@
+"""
+Compare the json_to_parquet WRITER_PROFILES on synthetic daily prices.
+
+Runs Spark locally and reads the results back with DuckDB, for example:
+    python aws/emr_serverless/benchmark_parquet_profiles.py --cards 90000
+
+For each profile it reports file size, the bytes Athena would scan for a full price scan
+and for a single card lookup (column chunks in row groups whose card_key statistics can't
+be skipped, which is what Athena bills), and the best-of-N DuckDB decode time.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import bround, col, exp, lit, rand, randn, when
+from json_to_parquet import WRITER_PROFILES, write_parquet
+
+def synthetic_prices(spark, cards, seed):
+    """Daily price rows in arbitrary order, shaped like process_daily_prices output"""
+    return spark.range(cards) \
+        .select(col("id").cast("int").alias("card_key")) \
+        .withColumn("usd", bround(exp(randn(seed) * 1.5), 2)) \
+        .withColumn("usd_foil", when(rand(seed + 1) < 0.4, bround(exp(randn(seed + 2) * 1.7 + 0.5), 2))) \
+        .withColumn("pull_date", lit("2025-06-01")) \
+        .orderBy(rand(seed + 3))
+
+def scanned_bytes(duckdb, path, columns, card_key=None):
+    """Compressed bytes of the column chunks a reader has to fetch"""
+    column_list = ", ".join(f"'{column}'" for column in columns)
+    row_groups = ""
+    if card_key is not None:
+        row_groups = f"""
+        AND (file_name, row_group_id) IN (
+            SELECT file_name, row_group_id
+            FROM parquet_metadata('{path}/*.parquet')
+            WHERE path_in_schema = 'card_key'
+              AND CAST(stats_min_value AS INTEGER) <= {card_key}
+              AND CAST(stats_max_value AS INTEGER) >= {card_key}
+        )"""
+    query = f"""
+        SELECT coalesce(sum(total_compressed_size), 0)
+        FROM parquet_metadata('{path}/*.parquet')
+        WHERE path_in_schema IN ({column_list}){row_groups}
+    """
+    return duckdb.sql(query).fetchone()[0]
+
+def decode_seconds(duckdb, path, repeats):
+    query = f"SELECT sum(usd), count(usd_foil), max(card_key) FROM read_parquet('{path}/*.parquet')"
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        duckdb.sql(query).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Parquet writer profiles')
+    parser.add_argument('--cards', type=int, default=90000)
+    parser.add_argument('--files', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import duckdb
+
+    spark = SparkSession.builder.master("local[*]").appName("parquet-profile-benchmark").getOrCreate()
+    df = synthetic_prices(spark, args.cards, args.seed).cache()
+    df.count()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, profile in WRITER_PROFILES.items():
+            path = os.path.join(output_dir, name)
+            start = time.perf_counter()
+            write_parquet(name, df, path, profile, args.files)
+            write_seconds = time.perf_counter() - start
+
+            results[name] = {
+                'file_bytes': sum(
+                    os.path.getsize(os.path.join(path, file)) for file in os.listdir(path) if file.endswith('.parquet')
+                ),
+                'row_groups': duckdb.sql(
+                    f"SELECT count(DISTINCT (file_name, row_group_id)) FROM parquet_metadata('{path}/*.parquet')"
+                ).fetchone()[0],
+                'scan_bytes_all_prices': scanned_bytes(duckdb, path, ['card_key', 'usd', 'usd_foil']),
+                'scan_bytes_one_card': scanned_bytes(duckdb, path, ['card_key', 'usd', 'usd_foil'], args.cards // 2),
+                'write_seconds': round(write_seconds, 3),
+                'decode_seconds': round(decode_seconds(duckdb, path, args.repeats), 4)
+            }
+            print(f"{name}: {json.dumps(results[name])}")
+
+    spark.stop()
+    print(json.dumps(results, indent=4))
+
+if __name__ == "__main__":
+    main()
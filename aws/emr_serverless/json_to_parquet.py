@@ -1,15 +1,143 @@
 
-import sys
+import argparse
+import builtins
+import math
 import boto3
 import json
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pyspark.sql import SparkSession
+from time import perf_counter
+from urllib.request import urlopen
+from pyspark.sql import SparkSession, Observation
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
+# Shipped from aws/lambda with --py-files, together with mtg_runtime.py
+from card_keys import CARD_KEYS_KEY, read_card_keys, save_card_keys
 
 ssm = boto3.client('ssm', region_name='us-west-2')
+s3 = boto3.client('s3', region_name='us-west-2')
+
+# Declared input schema, limited to the Scryfall fields the job projects.
+# Bump SCHEMA_VERSION whenever a field is added or its type changes.
+SCHEMA_VERSION = 1
+BULK_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("oracle_id", StringType()),
+    StructField("mtgo_id", LongType()),
+    StructField("mtgo_foil_id", LongType()),
+    StructField("tcgplayer_id", LongType()),
+    StructField("cardmarket_id", LongType()),
+    StructField("name", StringType()),
+    StructField("lang", StringType()),
+    StructField("released_at", StringType()),
+    StructField("set_name", StringType()),
+    StructField("set", StringType()),
+    StructField("set_type", StringType()),
+    StructField("rarity", StringType()),
+    StructField("prices", StructType([
+        StructField("usd", StringType()),
+        StructField("usd_foil", StringType())
+    ])),
+    # Records that don't fit the schema land here instead of failing the job
+    StructField("_corrupt_record", StringType())
+])
+
+# JSON type names the sampled records must have for each projected field
+EXPECTED_JSON_TYPES = {
+    "id": "str", "oracle_id": "str", "mtgo_id": "int", "mtgo_foil_id": "int",
+    "tcgplayer_id": "int", "cardmarket_id": "int", "name": "str", "lang": "str",
+    "released_at": "str", "set_name": "str", "set": "str", "set_type": "str",
+    "rarity": "str", "prices": "dict"
+}
+
+# Output files are sized by target bytes instead of always coalesce(1).
+# --target-file-mb overrides the target.
+TARGET_FILE_BYTES = 128 * 1024 * 1024
+
+# Rough uncompressed bytes per output row, used to turn a row count into a file count
+DAILY_BYTES_PER_ROW = 32
+STATIC_BYTES_PER_ROW = 256
+
+# Fields seen in the previous run's sample, used to report additions and removals
+SCHEMA_FINGERPRINT_KEY = 'mtg_manifest/scryfall_fields.json'
+SCHEMA_SAMPLE_BYTES = 4 * 1024 * 1024
+
+# Rows written per output, one file per day, checked against the Parquet footers by
+# the confirm_parquet_created lambda
+ROW_COUNTS_PREFIX = 'mtg_manifest/row_counts/'
+
+# Parquet writer profiles for the outputs, chosen with --writer-profile.
+# 'storage' sorts rows by card_key so each row group's min/max statistics cover a narrow
+# key range readers can skip on, keeps dictionary encoding and uses Snappy, which every
+# reader downstream (Athena, Snowpipe, pyarrow) handles. 'compact' adds ZSTD and
+# BYTE_STREAM_SPLIT for the price doubles; only switch to it once all readers support both.
+# 'legacy' is the original unsorted, uncompressed layout, kept for comparison.
+WRITER_PROFILES = {
+    'legacy': {
+        'compression': 'none',
+        'sort_by': None,
+        'options': {}
+    },
+    'storage': {
+        'compression': 'snappy',
+        'sort_by': 'card_key',
+        'options': {
+            'parquet.enable.dictionary': 'true',
+            'parquet.block.size': str(1024 * 1024)
+        }
+    },
+    'compact': {
+        'compression': 'zstd',
+        'sort_by': 'card_key',
+        'options': {
+            'parquet.enable.dictionary': 'true',
+            'parquet.enable.bytestreamsplit': 'true',
+            'parquet.block.size': str(1024 * 1024)
+        }
+    }
+}
+DEFAULT_WRITER_PROFILE = 'storage'
+
+# Attempts at the conditional write of the card key dictionary before giving up
+CARD_KEYS_RETRIES = 5
+
+# Static columns whose content makes up a row's hash. pull_date changes every day and
+# is left out, so an unchanged card hashes the same from one snapshot to the next.
+STATIC_HASH_COLUMNS = [
+    "id", "card_key", "oracle_id", "mtgo_id", "mtgo_foil_id", "tcgplayer_id", "cardmarket_id",
+    "name", "lang", "released_at", "set_name", "set", "set_type", "rarity"
+]
+STATIC_PREFIX = 'mtg_static_parquet/'
+
+# Per-stage totals from Spark's status API reported as job metrics, with their units.
+# peakExecutionMemory is the largest of any stage rather than a total.
+SPARK_STAGE_METRICS = {
+    'inputBytes': 'Bytes',
+    'inputRecords': 'Count',
+    'outputBytes': 'Bytes',
+    'outputRecords': 'Count',
+    'shuffleReadBytes': 'Bytes',
+    'shuffleWriteBytes': 'Bytes',
+    'memoryBytesSpilled': 'Bytes',
+    'diskBytesSpilled': 'Bytes',
+    'executorRunTime': 'Milliseconds',
+    'jvmGcTime': 'Milliseconds',
+    'peakExecutionMemory': 'Bytes'
+}
 
 def main():
+    # Job arguments; --date reprocesses a historical day's retained raw JSON
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--date', help='Day to process as YYYY-MM-DD, defaults to today')
+    parser.add_argument('--target-file-mb', type=int, help='Target output file size in MB')
+    parser.add_argument('--writer-profile', choices=sorted(WRITER_PROFILES), default=DEFAULT_WRITER_PROFILE,
+                        help='Parquet layout for the daily prices output')
+    parser.add_argument('--profile', nargs='?', const='all', choices=['all', 'cpu', 'memory'],
+                        help='Profile the driver and write the results under mtg_profiles/')
+    args, _ = parser.parse_known_args()
+    started = perf_counter()
+
     # Initialize Spark Session
     spark = SparkSession.builder \
         .appName("MTG-JSON-to-Parquet-Dual-Output") \
@@ -19,16 +147,18 @@ def main():
         .config("spark.sql.parquet.int96RebaseModeInWrite", "LEGACY") \
         .config("spark.sql.parquet.datetimeRebaseModeInWrite", "LEGACY") \
         .config("spark.sql.hive.convertMetastoreParquet", "false") \
-        .config("spark.dynamicAllocation.enabled", "false") \
-        .config("spark.executor.instances", "1") \
-        .config("spark.executor.memory", "20g") \
+        .config("spark.dynamicAllocation.enabled", "true") \
+        .config("spark.dynamicAllocation.initialExecutors", "1") \
+        .config("spark.dynamicAllocation.maxExecutors", "8") \
+        .config("spark.executor.memory", "8g") \
         .config("spark.executor.cores", "4") \
         .config("spark.driver.memory", "6g") \
         .config("spark.driver.cores", "1") \
+        .config("spark.scheduler.mode", "FAIR") \
         .getOrCreate()
     
     # Get date info
-    dates_dict = get_dates()
+    dates_dict = get_dates(args.date)
 
     # Get configuration
     param_names = [
@@ -39,66 +169,314 @@ def main():
 
     # Define S3 paths
     json_key = f"mtg_temp_json/all_cards_{dates_dict['short_date']}.json"
+    ndjson_prefix = f"mtg_temp_json/all_cards_{dates_dict['short_date']}/"
     
     # Define output paths for both parquet files
     daily_parquet_key = f"mtg_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
     static_parquet_key = f"mtg_static_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    static_changes_key = f"mtg_static_changes/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
     
     input_path = f"s3://{primary_bucket}/{json_key}"
+    ndjson_path = f"s3://{primary_bucket}/{ndjson_prefix}"
     daily_output_path = f"s3://{primary_bucket}/{daily_parquet_key}"
     static_output_path = f"s3://{primary_bucket}/{static_parquet_key}"
+    static_changes_path = f"s3://{primary_bucket}/{static_changes_key}"
+
+    target_file_bytes = args.target_file_mb * 1024 * 1024 if args.target_file_mb else TARGET_FILE_BYTES
+
+    # Only the driver's Python is profiled; executor time shows up as waits on Spark actions
+    profiler = None
+    if args.profile:
+        try:
+            from stage_profiler import StageProfiler
+            profiler = StageProfiler('json_to_parquet', dates_dict['formatted_date'], primary_bucket, args.profile).start()
+        except ImportError:
+            print("WARNING: --profile needs stage_profiler.py and mtg_runtime.py passed with --py-files")
     
     print(f"Processing JSON from {input_path}")
     print(f"Creating daily parquet: {daily_output_path}")
     print(f"Creating static parquet: {static_output_path}")
     
     try:
-        # Read JSON from S3 once
-        df_raw = spark.read.option("multiline", "true").json(input_path)
+        # Warn early if Scryfall has changed the fields we rely on
+        check_schema_drift(primary_bucket, json_key)
+
+        # Read JSON from S3 once with the declared schema, no inference pass
+        reader = spark.read \
+            .schema(BULK_SCHEMA) \
+            .option("mode", "PERMISSIVE") \
+            .option("columnNameOfCorruptRecord", "_corrupt_record")
+
+        if prefix_has_objects(primary_bucket, ndjson_prefix):
+            # NDJSON shards from data_pull are splittable, so every executor core gets a task
+            print(f"Reading NDJSON shards from {ndjson_path}")
+            df_raw = reader.json(ndjson_path)
+        else:
+            # A single JSON array can only be read by one task
+            print(f"No NDJSON shards found, reading multiline JSON from {input_path}")
+            df_raw = reader.option("multiline", "true").json(input_path)
         
-        # Cache the raw data since we'll use it twice
+        # Cache the projected data since we'll use it twice
         df_raw.cache()
-        
-        # Process daily prices data
-        print("Processing daily prices data...")
-        df_daily = process_daily_prices(df_raw, dates_dict['formatted_date'])
-        daily_count = df_daily.count()
-        
-        # Write daily prices parquet
-        df_daily.coalesce(1) \
-            .write \
-            .mode("overwrite") \
-            .option("compression", "none") \
-            .parquet(daily_output_path)
-
-        print(f"Successfully wrote {daily_count} rows to daily parquet")
-        
-        # Process static card data  
-        print("Processing static card data...")
-        df_static = process_static_fields(df_raw, dates_dict['formatted_date'])
-        static_count = df_static.count()
-
-        df_static.coalesce(1) \
-            .write \
-            .mode("overwrite") \
-            .option("compression", "snappy") \
-            .parquet(static_output_path)
-
-        print(f"Successfully wrote {static_count} rows to static parquet")
+
+        # One action both fills the cache and sizes the outputs
+        stats = df_raw.agg(
+            count(lit(1)).alias("total"),
+            count(col("_corrupt_record")).alias("corrupt")
+        ).collect()[0]
+        if stats['corrupt']:
+            print(f"WARNING: {stats['corrupt']} records did not match schema version {SCHEMA_VERSION}")
+        read_seconds = perf_counter() - started
+
+        # Prices carry only the integer card_key; the UUID stays in the static dimension
+        df_keys = assign_card_keys(spark, primary_bucket, df_raw)
+
+        df_daily = process_daily_prices(df_raw, df_keys, dates_dict['formatted_date'])
+        df_static = process_static_fields(df_raw, df_keys, dates_dict['formatted_date'])
+
+        # Only inserted and changed static rows go to Snowflake
+        previous_static_key = previous_partition(primary_bucket, STATIC_PREFIX, dates_dict)
+        previous_static_path = f"s3://{primary_bucket}/{previous_static_key}" if previous_static_key else None
+        df_changes = static_changes(spark, df_static, previous_static_path)
+
+        # Every output reads the same cache independently, so write them concurrently.
+        # Row counts are observed during the write rather than by a second count() action.
+        outputs = [
+            ('daily', df_daily, daily_output_path, WRITER_PROFILES[args.writer_profile],
+             file_count(stats['total'], DAILY_BYTES_PER_ROW, target_file_bytes)),
+            ('static', df_static, static_output_path, WRITER_PROFILES[DEFAULT_WRITER_PROFILE],
+             file_count(stats['total'], STATIC_BYTES_PER_ROW, target_file_bytes)),
+            ('changes', df_changes, static_changes_path, WRITER_PROFILES[DEFAULT_WRITER_PROFILE], 1)
+        ]
+        write_started = perf_counter()
+        with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+            futures = [executor.submit(write_parquet, *output) for output in outputs]
+            row_counts = dict(future.result() for future in futures)
+        write_seconds = perf_counter() - write_started
+
+        print(f"Successfully wrote {row_counts['daily']} rows to daily parquet")
+        print(f"Successfully wrote {row_counts['static']} rows to static parquet")
+        print(f"Successfully wrote {row_counts['changes']} changed rows to {static_changes_path}")
+
+        write_row_counts(primary_bucket, dates_dict['formatted_date'], {
+            'daily': (daily_parquet_key, row_counts['daily']),
+            'static': (static_parquet_key, row_counts['static']),
+            'changes': (static_changes_key, row_counts['changes'])
+        })
         
         # Unpersist cached data
         df_raw.unpersist()
+
+        emit_metrics(spark, dates_dict['formatted_date'], started, {
+            'RowsIn': (stats['total'], 'Count'),
+            'CorruptRecords': (stats['corrupt'], 'Count'),
+            'RowsOutDaily': (row_counts['daily'], 'Count'),
+            'RowsOutStatic': (row_counts['static'], 'Count'),
+            'RowsOutChanges': (row_counts['changes'], 'Count'),
+            'ReadSeconds': (read_seconds, 'Seconds'),
+            'WriteSeconds': (write_seconds, 'Seconds')
+        })
                 
     except Exception as e:
         print(f"Error processing data: {str(e)}")
         raise e
     finally:
+        if profiler:
+            profiler.finish()
         spark.stop()
 
-def process_daily_prices(df_raw, pull_date):
-    # Extract the fields we need
-    df_filtered = df_raw.select(
-        col("id"),
+def write_parquet(name, df, output_path, profile, num_files):
+    """
+    Write df as Parquet with a WRITER_PROFILES layout in a single Spark action, counting
+    rows with an Observation on the way through. Returns (name, row_count).
+    """
+    print(f"Writing {name} parquet as {num_files} file(s) with {profile['compression']} compression...")
+    if profile['sort_by']:
+        # Range partitioning keeps each file's key range disjoint, the sort orders its row groups
+        df = df.repartitionByRange(num_files, col(profile['sort_by'])).sortWithinPartitions(profile['sort_by'])
+    else:
+        df = df.coalesce(num_files)
+
+    # Observed last, so the count is taken from the rows the write itself consumes
+    observation = Observation(name)
+    df.observe(observation, count(lit(1)).alias("rows")).write \
+        .mode("overwrite") \
+        .option("compression", profile['compression']) \
+        .options(**profile['options']) \
+        .parquet(output_path)
+
+    return name, observation.get["rows"]
+
+def write_row_counts(bucket, date, outputs):
+    """Record the observed row count of each output as {name: (prefix, rows)}"""
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{ROW_COUNTS_PREFIX}{date}.json",
+        Body=json.dumps({
+            'date': date,
+            'outputs': {name: {'prefix': prefix, 'rows': rows} for name, (prefix, rows) in outputs.items()}
+        }, indent=2)
+    )
+
+def spark_stage_metrics(spark):
+    """
+    SPARK_STAGE_METRICS summed over the application's completed stages, read from the
+    driver's status REST API. Empty when the UI is disabled or unreachable.
+    """
+    ui_url = spark.sparkContext.uiWebUrl
+    if not ui_url:
+        return {}
+    try:
+        with urlopen(f"{ui_url}/api/v1/applications/{spark.sparkContext.applicationId}/stages?status=complete", timeout=10) as response:
+            stages = json.loads(response.read())
+    except Exception as e:
+        print(f"Could not read Spark stage metrics: {str(e)}")
+        return {}
+
+    totals = {'SparkStages': (len(stages), 'Count')}
+    for name, unit in SPARK_STAGE_METRICS.items():
+        values = [stage.get(name) or 0 for stage in stages]
+        if name == 'peakExecutionMemory':
+            total = builtins.max(values, default=0)
+        else:
+            total = builtins.sum(values)
+        totals[f"Spark{name[0].upper()}{name[1:]}"] = (total, unit)
+    return totals
+
+def emit_metrics(spark, date, started, values):
+    """
+    Emit the job's metrics and Spark stage totals as an EMF record on the driver log.
+    stage_metrics ships alongside the job with --py-files; without it the values are
+    printed as plain JSON instead.
+    """
+    values = dict(values, **spark_stage_metrics(spark))
+    try:
+        from stage_metrics import StageMetrics
+    except ImportError:
+        print(f"Job metrics: {json.dumps({name: value for name, (value, _) in values.items()})}")
+        return
+
+    metrics = StageMetrics('json_to_parquet', date)
+    metrics.started = started
+    for name, (value, unit) in values.items():
+        metrics.put(name, value, unit)
+    metrics.emit()
+
+def file_count(row_estimate, bytes_per_row, target_file_bytes):
+    """Number of output files needed to keep each near target_file_bytes"""
+    return math.ceil(row_estimate * bytes_per_row / target_file_bytes) or 1
+
+def prefix_has_objects(bucket, prefix):
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1)
+    return response.get('KeyCount', 0) > 0
+
+def check_schema_drift(bucket, json_key):
+    """
+    Sample the first records of the bulk file with a ranged GET and compare them to the
+    declared schema and to the field list seen on the previous run. Drift is only
+    reported; records that no longer fit the schema are counted as corrupt by the read.
+    Returns a dict describing added, removed and retyped fields.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket, Key=json_key, Range=f'bytes=0-{SCHEMA_SAMPLE_BYTES - 1}')
+        sample = response['Body'].read().decode('utf-8', errors='ignore')
+    except Exception as e:
+        print(f"Schema drift check skipped, could not sample {json_key}: {str(e)}")
+        return {}
+
+    # Decode whole records from the start of the array until the sample runs out
+    decoder = json.JSONDecoder()
+    records = []
+    position = sample.find('[') + 1
+    while True:
+        while position < len(sample) and sample[position] in ' \t\r\n,':
+            position += 1
+        try:
+            record, position = decoder.raw_decode(sample, position)
+        except ValueError:
+            break
+        records.append(record)
+
+    if not records:
+        print("Schema drift check skipped, no complete records in sample")
+        return {}
+
+    seen_fields = sorted(set().union(*(record.keys() for record in records)))
+    retyped = {}
+    for field, expected in EXPECTED_JSON_TYPES.items():
+        types = {type(record[field]).__name__ for record in records if record.get(field) is not None}
+        if types - {expected}:
+            retyped[field] = sorted(types)
+    missing = [field for field in EXPECTED_JSON_TYPES if field not in seen_fields]
+
+    try:
+        previous = json.loads(s3.get_object(Bucket=bucket, Key=SCHEMA_FINGERPRINT_KEY)['Body'].read())
+        previous_fields = set(previous['fields'])
+    except s3.exceptions.NoSuchKey:
+        previous_fields = set(seen_fields)
+
+    drift = {
+        'added': sorted(set(seen_fields) - previous_fields),
+        'removed': sorted(previous_fields - set(seen_fields)),
+        'missing_projected': missing,
+        'retyped_projected': retyped
+    }
+
+    print(f"Schema drift check on {len(records)} sampled records (schema version {SCHEMA_VERSION}): {json.dumps(drift)}")
+    if missing or retyped:
+        print("WARNING: projected Scryfall fields changed, BULK_SCHEMA needs updating")
+
+    s3.put_object(
+        Bucket=bucket,
+        Key=SCHEMA_FINGERPRINT_KEY,
+        Body=json.dumps({'schema_version': SCHEMA_VERSION, 'fields': seen_fields}, indent=2)
+    )
+    return drift
+
+def assign_card_keys(spark, bucket, df_raw):
+    """
+    Hand out the next dense integer keys to ids seen for the first time and refresh changed
+    set codes, then return an (id, card_key) DataFrame for the whole dictionary. The distinct
+    ids are small enough to assign on the driver. Keys are never reused or reassigned.
+    """
+    cards = df_raw.where(col("id").isNotNull()).select("id", "set").distinct().collect()
+
+    for attempt in range(CARD_KEYS_RETRIES):
+        card_keys, etag = read_card_keys(bucket)
+        next_key = len(card_keys)
+        changed = False
+        for card in cards:
+            entry = card_keys.get(card['id'])
+            if entry is None:
+                card_keys[card['id']] = {'card_key': next_key, 'set': card['set'] or ''}
+                next_key += 1
+                changed = True
+            elif card['set'] and entry['set'] != card['set']:
+                entry['set'] = card['set']
+                changed = True
+
+        if not changed:
+            break
+        try:
+            save_card_keys(bucket, card_keys, etag)
+            print(f"Card key dictionary now holds {len(card_keys)} ids")
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            print(f"Card key dictionary changed underneath us, retrying ({attempt + 1}/{CARD_KEYS_RETRIES})")
+    else:
+        raise Exception(f"Could not update {CARD_KEYS_KEY} after {CARD_KEYS_RETRIES} attempts")
+
+    return spark.createDataFrame(
+        [(card_id, entry['card_key']) for card_id, entry in card_keys.items()],
+        "id STRING, card_key INT"
+    )
+
+def process_daily_prices(df_raw, df_keys, pull_date):
+    # Extract the fields we need, swapping the UUID for its integer key
+    df_filtered = df_raw.join(broadcast(df_keys), "id").select(
+        col("card_key"),
         col("prices.usd").alias("usd"),
         col("prices.usd_foil").alias("usd_foil")
     ).filter(
@@ -112,9 +490,10 @@ def process_daily_prices(df_raw, pull_date):
     
     return df_final
 
-def process_static_fields(df_raw, pull_date):
-    df_filtered = df_raw.select(
+def process_static_fields(df_raw, df_keys, pull_date):
+    df_filtered = df_raw.join(broadcast(df_keys), "id").select(
         col("id"),
+        col("card_key"),
         col("oracle_id"),
         col("mtgo_id"), 
         col("mtgo_foil_id"),
@@ -134,15 +513,55 @@ def process_static_fields(df_raw, pull_date):
                          .withColumn("mtgo_foil_id", col("mtgo_foil_id").cast("double")) \
                          .withColumn("tcgplayer_id", col("tcgplayer_id").cast("double")) \
                          .withColumn("cardmarket_id", col("cardmarket_id").cast("double"))
+
+    # Field names are part of the JSON, so a null can't hash like a value in another column
+    df_final = df_final.withColumn("row_hash", xxhash64(to_json(struct(*STATIC_HASH_COLUMNS))))
     
     return df_final
 
-def get_dates():
-    current_date = datetime.now()
-    
-    # Uncomment to force a specific date for testing
-    # temp_date = '2024-12-08'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
+def static_changes(spark, df_static, previous_path):
+    """
+    Rows of df_static that are new or whose row_hash differs from the previous snapshot,
+    tagged with change_type 'insert' or 'update'. Without a previous snapshot, or one
+    written before row hashes existed, every row counts as changed.
+    """
+    if previous_path is None:
+        print("No previous static snapshot, the change set is the full snapshot")
+        return df_static.withColumn("change_type", lit("insert"))
+
+    df_previous = spark.read.parquet(previous_path)
+    previous_hash = col("row_hash") if "row_hash" in df_previous.columns else lit(None).cast("long")
+    df_previous = df_previous.select(
+        col("id"),
+        previous_hash.alias("previous_hash"),
+        lit(True).alias("previously_seen")
+    )
+
+    return df_static.join(df_previous, "id", "left") \
+        .where(col("previously_seen").isNull() | ~col("row_hash").eqNullSafe(col("previous_hash"))) \
+        .withColumn("change_type", when(col("previously_seen").isNull(), lit("insert")).otherwise(lit("update"))) \
+        .drop("previous_hash", "previously_seen")
+
+def previous_partition(bucket, prefix, dates_dict):
+    """Key prefix of the latest year=/month=/day= partition under prefix before dates_dict"""
+    current = (dates_dict['year'], dates_dict['month'], dates_dict['day'])
+    latest = None
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            parts = dict(
+                part.split('=', 1) for part in obj['Key'][len(prefix):].split('/')[:3] if '=' in part
+            )
+            partition = (parts.get('year'), parts.get('month'), parts.get('day'))
+            if None not in partition and partition < current and (latest is None or partition > latest):
+                latest = partition
+
+    if latest is None:
+        return None
+    return f"{prefix}year={latest[0]}/month={latest[1]}/day={latest[2]}"
+
+def get_dates(date=None):
+    current_date = datetime.strptime(date, '%Y-%m-%d') if date else datetime.now()
     
     return {
         'year': current_date.strftime('%Y'),
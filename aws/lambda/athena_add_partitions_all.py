@@ -1,15 +1,23 @@
-import boto3
-from datetime import datetime
 import json
-import time
+from athena_runner import run_queries, run_query, summarize
+from mtg_runtime import LazyClient, clear_prefix, commit_snapshot, get_date_range, get_multiple_parameters, register_partitions
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
 
-athena = boto3.client('athena')
-sns_client = boto3.client('sns')
-ssm = boto3.client('ssm')
+athena = LazyClient('athena')
+sns_client = LazyClient('sns')
 
+@profiled('athena_add_partitions_all')
 def lambda_handler(event, context):
 
-    dates_dict = get_dates()
+    # A single day normally; a backfill passes a range or list of dates
+    dates_list = get_date_range(event)
+    # The static table and the notification follow the latest day
+    dates_dict = dates_list[-1]
+    date_values = ", ".join(f"'{dates['formatted_date']}'" for dates in dates_list)
+    date_literals = ", ".join(f"date('{dates['formatted_date']}')" for dates in dates_list)
+    date_label = dates_dict['formatted_date'] if len(dates_list) == 1 else f"{dates_list[0]['formatted_date']} to {dates_dict['formatted_date']}"
+    metrics = StageMetrics('athena_add_partitions_all', date_label)
 
     # Get configuration
     param_names = [
@@ -25,129 +33,91 @@ def lambda_handler(event, context):
     body_return = {}
     body_return['default'] = 'This is the default message'
 
-    # Process daily prices partition
-    print("Adding partition for daily prices table...")
-    query1 = f"""
+    # The daily partition add and the static SET LOCATION are independent, so run them together
+    print("Adding partitions for daily prices and static data tables...")
+    partition_queries = {}
+    # A backfill of older days leaves the static table on the latest snapshot
+    if not isinstance(event, dict) or event.get('update_static', True):
+        partition_queries['static_data_partition'] = f"""
+    ALTER TABLE mtg_static_parquet
+    SET LOCATION 's3://{primary_bucket}/mtg_static_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}/';
+    """
+    if len(dates_list) == 1:
+        partition_queries['daily_prices_partition'] = f"""
     ALTER TABLE mtg_prices_parquet ADD IF NOT EXISTS
     PARTITION (year='{dates_dict['year']}', month='{dates_dict['month']}', day='{dates_dict['day']}')
     LOCATION 's3://{primary_bucket}/mtg_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}/'
     """
-
-    response1 = athena.start_query_execution(
-        QueryString=query1,
-        QueryExecutionContext={'Database': 'mtg'},
-        ResultConfiguration={'OutputLocation': s3_output}
-        )
-    
-    query1_execution_id = response1['QueryExecutionId']
-    query1_logs = wait_for_query_to_complete(query1_execution_id, athena)
-
-    body_return['daily_prices_partition'] = response1
-    body_return['daily_prices_partition_logs'] = query1_logs
-
-    # Process static data partition
-    print("Adding partition for static data table...")
-    query2 = f"""
-    ALTER TABLE mtg_static_parquet
-    SET LOCATION 's3://{primary_bucket}/mtg_static_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}/';
-    """
-
-    response2 = athena.start_query_execution(
-        QueryString=query2,
-        QueryExecutionContext={'Database': 'mtg'},
-        ResultConfiguration={'OutputLocation': s3_output}
-        )
-    
-    query2_execution_id = response2['QueryExecutionId']
-    query2_logs = wait_for_query_to_complete(query2_execution_id, athena)
-
-    body_return['static_data_partition'] = response2
-    body_return['static_data_partition_logs'] = query2_logs
-
-    # Process Iceberg merge for daily prices
-    print("Merging daily prices into Iceberg table...")
-    query3 = f"""
-    MERGE INTO mtg_prices_iceberg AS target
+    else:
+        # Many days at once go through the Glue batch API rather than one query per day
+        with metrics.timer('GluePartitions'):
+            body_return['daily_prices_partitions_created'] = register_partitions('mtg', 'mtg_prices_parquet', primary_bucket, 'mtg_parquet', dates_list)
+        metrics.put('PartitionsCreated', body_return['daily_prices_partitions_created'])
+    results = run_queries(athena, partition_queries, s3_output)
+
+    # A single MERGE is one Iceberg commit, so a failure leaves the day as it was. The
+    # pull_date predicate limits the target side of the join to the days being loaded,
+    # and a rerun updates the same rows instead of adding duplicates.
+    if 'daily_prices_partition' in results and results['daily_prices_partition']['state'] != 'SUCCEEDED':
+        print("Daily prices partition was not added, skipping the Iceberg merge")
+    else:
+        print("Merging daily prices into Iceberg table...")
+        query_merge = f"""
+    MERGE INTO mtg_prices_iceberg AS t
     USING (
         SELECT
-            id,
+            card_key,
             CAST(usd AS DECIMAL(10, 2)) AS usd,
             CAST(usd_foil AS DECIMAL(10, 2)) AS usd_foil,
             CAST(pull_date AS DATE) AS pull_date
         FROM mtg_prices_parquet
-        WHERE year = '{dates_dict['year']}'
-        AND month = '{dates_dict['month']}'
-        AND day = '{dates_dict['day']}'
-    ) AS source
-    ON target.id = source.id AND target.pull_date = source.pull_date
+        WHERE year || '-' || month || '-' || day IN ({date_values})
+        -- Partitions written before the card_key migration read it as NULL; their rows
+        -- were keyed in Iceberg by migrate_mtg_prices_card_key.sql
+        AND card_key IS NOT NULL
+    ) AS s
+    ON t.card_key = s.card_key AND t.pull_date = s.pull_date AND t.pull_date IN ({date_literals})
+    WHEN MATCHED THEN
+    UPDATE SET usd = s.usd, usd_foil = s.usd_foil
     WHEN NOT MATCHED THEN
-    INSERT (id, usd, usd_foil, pull_date)
-    VALUES (source.id, source.usd, source.usd_foil, source.pull_date);
+    INSERT (card_key, usd, usd_foil, pull_date)
+    VALUES (s.card_key, s.usd, s.usd_foil, s.pull_date)
     """
+        results['iceberg_merge'] = run_query(athena, query_merge, s3_output)
 
-    response3 = athena.start_query_execution(
-        QueryString=query3,
-        QueryExecutionContext={'Database': 'mtg'},
-        ResultConfiguration={'OutputLocation': s3_output}
-        )
-    
-    query3_execution_id = response3['QueryExecutionId']
-    query3_logs = wait_for_query_to_complete(query3_execution_id, athena)
-
-    body_return['iceberg_merge'] = response3
-    body_return['iceberg_merge_logs'] = query3_logs
+        if results['iceberg_merge']['state'] == 'SUCCEEDED':
+            # query_athena's cached joined slices for these days are stale now
+            for dates in dates_list:
+                clear_prefix(primary_bucket, f"mtg_query_slices/{dates['formatted_date']}/")
 
     # Get count from Iceberg table
     print("Getting count from Iceberg table...")
     query4 = f"""
     SELECT count(*) as total_count 
     FROM mtg_prices_iceberg 
-    WHERE date(pull_date) = date('{dates_dict['formatted_date']}')
+    WHERE pull_date IN ({date_literals})
     """
+    results['iceberg_count_query'] = run_query(athena, query4, s3_output)
 
-    response4 = athena.start_query_execution(
-        QueryString=query4,
-        QueryExecutionContext={'Database': 'mtg'},
-        ResultConfiguration={'OutputLocation': s3_output}
-    )
-    
-    query4_execution_id = response4['QueryExecutionId']
-    query4_logs = wait_for_query_to_complete(query4_execution_id, athena)
-    results4 = athena.get_query_results(QueryExecutionId=query4_execution_id)
-
-    iceberg_count = None
-    if len(results4['ResultSet']['Rows']) > 1:
-        iceberg_count = results4['ResultSet']['Rows'][1]['Data'][0]['VarCharValue']
-    else:
-        iceberg_count = '0'
+    iceberg_count = '0'
+    if results['iceberg_count_query']['state'] == 'SUCCEEDED':
+        results4 = athena.get_query_results(QueryExecutionId=results['iceberg_count_query']['query_execution_id'])
+        if len(results4['ResultSet']['Rows']) > 1:
+            iceberg_count = results4['ResultSet']['Rows'][1]['Data'][0]['VarCharValue']
 
-    body_return['iceberg_count_query'] = response4
-    body_return['iceberg_count_logs'] = query4_logs
-    body_return['iceberg_count_results'] = results4
+    body_return.update(results)
     body_return['iceberg_count'] = iceberg_count
 
-    # Prepare SNS notification
-    email_message = f"""
-    MTG Data Partitioning Complete for {dates_dict['formatted_date']}
-
-    Daily Prices Partition:
-    {response1}
-    {query1_logs}
+    for name, result in results.items():
+        metrics.add_athena(name, result)
+    metrics.put('DaysProcessed', len(dates_list))
+    metrics.put('RowsOut', int(iceberg_count))
+    metrics.emit()
 
-    Static Data Partition:
-    {response2}
-    {query2_logs}
+    # Prepare SNS notification: the metrics, plus the reason for any query that didn't succeed
+    failures = [summarize(name, result) for name, result in results.items() if result['state'] != 'SUCCEEDED']
+    email_message = metrics.summary('MTG Data Partitioning Complete', failures)
 
-    Iceberg Merge:
-    {response3}
-    {query3_logs}
-
-    Iceberg Count Verification:
-    {response4}
-    {query4_logs}
-    Final Iceberg Count: {iceberg_count}
-    """
-    
     sns_return = {
         'default': 'This is the default message',
         'email': email_message
@@ -161,84 +131,32 @@ def lambda_handler(event, context):
             MessageStructure='json'
         )
 
-        print(f"SNS message sent. Response: {sns_response}")
-        body_return['sns_response'] = sns_response
+        print(f"SNS message sent: {sns_response['MessageId']}")
     except Exception as e:
         error_message = f"Error sending SNS notification: {str(e)}"
         print(error_message)
         return {'statusCode': 500, 'body': json.dumps(error_message)}
 
+    failed = [name for name, result in results.items() if result['state'] != 'SUCCEEDED']
+    if failed:
+        return {
+            'statusCode': 500,
+            'message': f"Partition processing failed for {failed}",
+            'dates_processed': [dates['formatted_date'] for dates in dates_list],
+            'body': body_return
+        }
+
+    # The day is in Iceberg, so data_pull may skip this snapshot from now on
+    try:
+        commit_snapshot(primary_bucket, [dates['formatted_date'] for dates in dates_list])
+    except Exception as e:
+        print(f"Error committing the snapshot manifest: {str(e)}")
+
     return {
         'statusCode': 200,
         'message': 'Both partitions processed successfully',
         'date_processed': dates_dict['formatted_date'],
+        'dates_processed': [dates['formatted_date'] for dates in dates_list],
         'iceberg_count': iceberg_count,
         'body': body_return
     }
-
-def get_dates():
-    current_date = datetime.now()
-
-    ### Temp force a specific date
-    # temp_date = '2024-12-08'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
-
-    return {
-        'year': current_date.strftime('%Y'),
-        'month': current_date.strftime('%m'),
-        'day': current_date.strftime('%d'),
-        'short_date': current_date.strftime('%Y%m%d'),
-        'formatted_date': current_date.strftime('%Y-%m-%d')
-    }
-
-def get_multiple_parameters(parameter_names):
-    try:
-        response = ssm.get_parameters(
-            Names=parameter_names,
-            WithDecryption=True
-        )
-
-        # Check for missing parameters
-        if response.get('InvalidParameters'):
-            raise Exception(f"Missing parameters: {response['InvalidParameters']}")
-
-        params = {}
-        for param in response['Parameters']:
-            params[param['Name']] = param['Value']
-        
-        return params
-    except Exception as e:
-        print(f"Error getting parameters: {e}")
-        raise
-
-def wait_for_query_to_complete(query_execution_id, athena_client, check_interval=5):
-    """
-    Poll the query status every `check_interval` seconds
-    until it is in a final state: SUCCEEDED, FAILED, or CANCELLED.
-    Logs the StateChangeReason if the query fails or is canceled.
-    Returns a JSON object with all printed statements.
-    """
-    logs = []  # List to store all log statements
-
-    while True:
-        response = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-        status = response['QueryExecution']['Status']['State']
-        state_change_reason = response['QueryExecution']['Status'].get('StateChangeReason', 'No further details')
-
-        log_statement = f"Query {query_execution_id} finished with status: {status}" if status in ['SUCCEEDED', 'FAILED', 'CANCELLED'] else f"Query {query_execution_id} is in status '{status}'. Waiting {check_interval}s..."
-        logs.append(log_statement)
-        print(log_statement)
-
-        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            if status in ['FAILED', 'CANCELLED']:
-                reason_log = f"Reason: {state_change_reason}"
-                logs.append(reason_log)
-                print(reason_log)
-            break
-        else:
-            log_statement = f"Query {query_execution_id} is in status '{status}'. Waiting {check_interval}s..."
-            logs.append(log_statement)
-            print(log_statement)
-            time.sleep(check_interval)
-
-    return json.dumps({"logs": logs}, indent=4)
\ No newline at end of file
@@ -0,0 +1,104 @@
+import time
+
+FINAL_STATES = ['SUCCEEDED', 'FAILED', 'CANCELLED']
+# The most ids batch_get_query_execution accepts in one call
+BATCH_GET_LIMIT = 50
+
+def run_query(athena_client, query, output_location, database='mtg', **poll_options):
+    """Run a single Athena statement and wait for it to finish, returning run_queries' result for it"""
+    return run_queries(athena_client, {'query': query}, output_location, database, **poll_options)['query']
+
+def run_queries(athena_client, queries, output_location, database='mtg',
+                initial_interval=0.25, max_interval=5, backoff=1.5, timeout=None):
+    """Run {name: SQL} together and wait for all of them. Failed queries are returned, not raised."""
+    results = {}
+    for name, query in queries.items():
+        response = athena_client.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={'Database': database},
+            ResultConfiguration={'OutputLocation': output_location}
+        )
+        query_execution_id = response['QueryExecutionId']
+        results[name] = {
+            'query_execution_id': query_execution_id,
+            'state': 'QUEUED',
+            'state_change_reason': None,
+            'output_location': None,
+            'statistics': {},
+            'logs': [f"Query {name} submitted as {query_execution_id}"]
+        }
+        print(results[name]['logs'][-1])
+
+    # Short DDL returns in well under a second, and long queries back off to max_interval
+    started = time.monotonic()
+    interval = initial_interval
+    pending = {result['query_execution_id']: name for name, result in results.items()}
+
+    while pending:
+        time.sleep(interval)
+
+        pending_ids = list(pending)
+        executions = []
+        unprocessed_ids = []
+        for offset in range(0, len(pending_ids), BATCH_GET_LIMIT):
+            response = athena_client.batch_get_query_execution(
+                QueryExecutionIds=pending_ids[offset:offset + BATCH_GET_LIMIT]
+            )
+            executions.extend(response['QueryExecutions'])
+            unprocessed_ids.extend(response.get('UnprocessedQueryExecutionIds', []))
+
+        for execution in executions:
+            name = pending[execution['QueryExecutionId']]
+            result = results[name]
+            status = execution['Status']
+            result['state'] = status['State']
+
+            if status['State'] in FINAL_STATES:
+                result['state_change_reason'] = status.get('StateChangeReason')
+                result['output_location'] = execution.get('ResultConfiguration', {}).get('OutputLocation')
+                result['statistics'] = execution.get('Statistics', {})
+                log_statement = f"Query {name} ({execution['QueryExecutionId']}) finished with status: {status['State']}"
+                if status['State'] != 'SUCCEEDED':
+                    log_statement += f". Reason: {status.get('StateChangeReason', 'No further details')}"
+                result['logs'].append(log_statement)
+                print(log_statement)
+                del pending[execution['QueryExecutionId']]
+
+        for unprocessed in unprocessed_ids:
+            print(f"Could not fetch status for {unprocessed['QueryExecutionId']}: {unprocessed.get('ErrorMessage')}")
+
+        if pending and timeout is not None and time.monotonic() - started > timeout:
+            for query_execution_id, name in pending.items():
+                athena_client.stop_query_execution(QueryExecutionId=query_execution_id)
+                results[name]['state'] = 'CANCELLED'
+                results[name]['state_change_reason'] = f"Timed out after {timeout}s"
+                results[name]['logs'].append(f"Query {name} ({query_execution_id}) cancelled after {timeout}s")
+                print(results[name]['logs'][-1])
+            break
+
+        interval = min(interval * backoff, max_interval)
+
+    return results
+
+def summarize(name, result):
+    """One-line, human readable summary of a run_queries result"""
+    statistics = result['statistics']
+    scanned_mb = statistics.get('DataScannedInBytes', 0) / (1024 * 1024)
+    summary = (f"{name}: {result['state']} in {statistics.get('EngineExecutionTimeInMillis', 0)} ms engine time, "
+               f"{scanned_mb:.2f} MB scanned")
+    if result['state'] != 'SUCCEEDED':
+        summary += f" ({result['state_change_reason']})"
+    return summary
+
+def fetch_rows(athena_client, result):
+    """Rows of a finished SELECT as a list of {column: string value} dicts"""
+    if result['state'] != 'SUCCEEDED':
+        return []
+    rows = []
+    paginator = athena_client.get_paginator('get_query_results')
+    for page in paginator.paginate(QueryExecutionId=result['query_execution_id']):
+        rows.extend([column.get('VarCharValue') for column in row['Data']] for row in page['ResultSet']['Rows'])
+    if not rows:
+        return []
+    header = rows[0]
+    return [dict(zip(header, row)) for row in rows[1:]]
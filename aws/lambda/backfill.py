@@ -0,0 +1,136 @@
+"""Replay retained raw JSON snapshots through the pipeline for a range of days, e.g. --start-date 2024-12-01 --end-date 2024-12-31"""
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import athena_add_partitions_all
+from data_pull import transcode_to_ndjson
+from mtg_runtime import get_client, get_date_range, get_multiple_parameters
+
+# Default concurrency per downstream resource
+DEFAULT_LIMITS = {
+    'transcode': 4,
+    'emr': 3
+}
+
+EMR_FINAL_STATES = ['SUCCESS', 'FAILED', 'CANCELLED']
+
+def backfill(dates_list, limits=DEFAULT_LIMITS, emr_poll_interval=30):
+    """Reprocess every day in dates_list. Returns {'succeeded': [...], 'failed': {date: reason}}."""
+    # Transcode in a process pool, one EMR Serverless job run per day, then one batched
+    # athena_add_partitions_all call for every successful day
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket',
+        '/mtg/emr/application_id',
+        '/mtg/emr/execution_role_arn',
+        '/mtg/emr/entry_point',
+        '/mtg/emr/py_files'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+
+    succeeded = []
+    failed = {}
+
+    with ProcessPoolExecutor(max_workers=limits['transcode']) as transcode_pool, \
+            ThreadPoolExecutor(max_workers=limits['emr']) as emr_pool:
+
+        transcodes = {
+            transcode_pool.submit(replay_raw_snapshot, primary_bucket, dates_dict): dates_dict
+            for dates_dict in dates_list
+        }
+
+        # Hand each day to EMR as soon as its shards are ready
+        emr_runs = {}
+        for future in as_completed(transcodes):
+            dates_dict = transcodes[future]
+            try:
+                record_count = future.result()
+                print(f"{dates_dict['formatted_date']}: transcoded {record_count} records")
+            except Exception as e:
+                failed[dates_dict['formatted_date']] = f"transcode: {str(e)}"
+                continue
+
+            emr_future = emr_pool.submit(run_emr_job, params, dates_dict, emr_poll_interval)
+            emr_runs[emr_future] = dates_dict
+
+        for future in as_completed(emr_runs):
+            dates_dict = emr_runs[future]
+            try:
+                state = future.result()
+            except Exception as e:
+                state = str(e)
+            if state == 'SUCCESS':
+                succeeded.append(dates_dict['formatted_date'])
+            else:
+                failed[dates_dict['formatted_date']] = f"emr: {state}"
+            print(f"{dates_dict['formatted_date']}: EMR job {state}")
+
+    if succeeded:
+        # One batch partition registration and one Iceberg MERGE for the whole range.
+        # The static table stays on the latest snapshot rather than moving back in time.
+        try:
+            response = athena_add_partitions_all.lambda_handler({'dates': sorted(succeeded), 'update_static': False}, None)
+        except Exception as e:
+            response = {'statusCode': 500, 'message': str(e)}
+        # The handler reports its own failures as a 500, and then none of the days reached Iceberg
+        if response.get('statusCode') != 200:
+            message = response.get('message') or response.get('body')
+            failed.update({formatted_date: f"merge: {message}" for formatted_date in succeeded})
+            succeeded = []
+            print(f"Partition registration and Iceberg MERGE failed: {message}")
+
+    return {'succeeded': sorted(succeeded), 'failed': failed}
+
+def replay_raw_snapshot(bucket, dates_dict):
+    """Transcode one day's retained raw JSON into NDJSON shards. Runs in a worker process."""
+    json_key = f"mtg_temp_json/all_cards_{dates_dict['short_date']}.json"
+    ndjson_prefix = f"mtg_temp_json/all_cards_{dates_dict['short_date']}/"
+
+    # Fail fast with a clear message when the lifecycle rule already removed the day
+    get_client('s3').head_object(Bucket=bucket, Key=json_key)
+
+    _, record_count = transcode_to_ndjson(bucket, json_key, ndjson_prefix)
+    return record_count
+
+def run_emr_job(params, dates_dict, poll_interval):
+    """Run json_to_parquet for one day on EMR Serverless and wait for its final state"""
+    emr = get_client('emr-serverless')
+    application_id = params['/mtg/emr/application_id']
+
+    response = emr.start_job_run(
+        applicationId=application_id,
+        executionRoleArn=params['/mtg/emr/execution_role_arn'],
+        name=f"mtg-backfill-{dates_dict['short_date']}",
+        jobDriver={
+            'sparkSubmit': {
+                'entryPoint': params['/mtg/emr/entry_point'],
+                'entryPointArguments': ['--date', dates_dict['formatted_date']],
+                # Comma separated S3 paths of card_keys.py, mtg_runtime.py and stage_metrics.py
+                'sparkSubmitParameters': f"--py-files {params['/mtg/emr/py_files']}"
+            }
+        }
+    )
+
+    while True:
+        job_run = emr.get_job_run(applicationId=application_id, jobRunId=response['jobRunId'])['jobRun']
+        if job_run['state'] in EMR_FINAL_STATES:
+            return job_run['state']
+        time.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay retained raw snapshots for historical days')
+    parser.add_argument('--start-date', required=True, help='First day to replay, YYYY-MM-DD')
+    parser.add_argument('--end-date', help='Last day to replay (inclusive), defaults to --start-date')
+    parser.add_argument('--transcode-workers', type=int, default=DEFAULT_LIMITS['transcode'])
+    parser.add_argument('--emr-jobs', type=int, default=DEFAULT_LIMITS['emr'])
+    args = parser.parse_args()
+
+    dates_list = get_date_range({'start_date': args.start_date, 'end_date': args.end_date or args.start_date})
+    limits = {'transcode': args.transcode_workers, 'emr': args.emr_jobs}
+
+    result = backfill(dates_list, limits)
+    print(json.dumps(result, indent=4))
+
+if __name__ == "__main__":
+    main()
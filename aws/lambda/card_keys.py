@@ -0,0 +1,39 @@
+"""The persistent dictionary of compact integer card_key values for Scryfall card ids"""
+import csv
+import gzip
+import io
+from mtg_runtime import LazyClient
+
+s3 = LazyClient('s3')
+
+# card_key,id,set as gzipped CSV, read by Athena as mtg_card_keys. Keys are dense int32 values
+# handed out in the order ids first appear and never reused, so they can index arrays directly.
+# json_to_parquet is the only writer; the lambdas only read it.
+CARD_KEYS_KEY = 'mtg_card_keys/card_keys.csv.gz'
+
+def load_card_keys(bucket):
+    """{id: {'card_key': int, 'set': str}}, empty before the first assignment"""
+    return read_card_keys(bucket)[0]
+
+def read_card_keys(bucket):
+    """(load_card_keys' dictionary, ETag), or ({}, None) before the first assignment"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=CARD_KEYS_KEY)
+    except s3.exceptions.NoSuchKey:
+        return {}, None
+
+    reader = csv.DictReader(io.StringIO(gzip.decompress(response['Body'].read()).decode('utf-8')))
+    card_keys = {row['id']: {'card_key': int(row['card_key']), 'set': row['set']} for row in reader}
+    return card_keys, response['ETag']
+
+def save_card_keys(bucket, card_keys, etag):
+    """Write the dictionary only if it is still the version read with etag (None: only if it doesn't exist yet)"""
+    # A lost race raises ClientError with code PreconditionFailed or ConditionalRequestConflict
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['card_key', 'id', 'set'])
+    for card_id, entry in sorted(card_keys.items(), key=lambda item: item[1]['card_key']):
+        writer.writerow([entry['card_key'], card_id, entry['set']])
+
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    s3.put_object(Bucket=bucket, Key=CARD_KEYS_KEY, Body=gzip.compress(output.getvalue().encode('utf-8')), **condition)
@@ -0,0 +1,335 @@
+"""Search index over card and set names with each card's price aggregates, answering GET_CARD_ID without Snowflake"""
+import gzip
+import io
+import json
+import re
+from datetime import datetime, timedelta
+from athena_runner import fetch_rows, run_queries
+from mtg_runtime import LazyClient, clear_prefix, get_dates, get_multiple_parameters, read_parquet_prefix
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+s3 = LazyClient('s3')
+athena = LazyClient('athena')
+
+# CURRENT names the live gen=YYYYMMDD/index.json.gz; state/ holds the running aggregates
+INDEX_PREFIX = 'mtg_card_search'
+STATE_PREFIX = f"{INDEX_PREFIX}/state/"
+# aggregate_dtype records indexed by card_key, with the days already merged into them
+STATE_KEY = f"{STATE_PREFIX}aggregates.npz"
+GRAM = 3
+KEEP_GENERATIONS = 2
+TCGPLAYER_URL = 'https://www.tcgplayer.com/product/'
+
+# GET_CARD_ID's result columns, in its order
+RESULT_COLUMNS = [
+    'name', 'set_name', 'id', 'tcgplayer_url', 'price_records_count',
+    'avg_price', 'min_price', 'max_price', 'avg_foil_price', 'min_foil_price', 'max_foil_price'
+]
+
+@profiled('card_search')
+def lambda_handler(event, context):
+    """Pass {'rebuild': True} to recompute the aggregates from the full Iceberg history"""
+    dates_dict = get_dates(event)
+    metrics = StageMetrics('card_search', dates_dict['formatted_date'])
+
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+
+    with metrics.timer('Aggregate'):
+        if isinstance(event, dict) and event.get('rebuild'):
+            aggregates, days = rebuild_aggregates(primary_bucket)
+        else:
+            aggregates, days = merge_day(primary_bucket, dates_dict, metrics)
+    metrics.put('DaysAggregated', len(days))
+
+    with metrics.timer('Build'):
+        document = build_document(primary_bucket, dates_dict, aggregates)
+    body = gzip.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'), mtime=0)
+    publish_generation(primary_bucket, dates_dict['short_date'], body)
+    metrics.put('CardsIndexed', len(document['cards']))
+    metrics.put('IndexBytes', len(body), 'Bytes')
+    metrics.emit()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Card search generation {dates_dict['short_date']} covers {len(document['cards'])} cards "
+                           f"over {len(days)} days of prices")
+    }
+
+def aggregate_dtype():
+    import numpy as np
+    return np.dtype([
+        ('records', '<i4'),
+        ('usd_count', '<i4'), ('usd_sum', '<f8'), ('usd_min', '<f8'), ('usd_max', '<f8'),
+        ('foil_count', '<i4'), ('foil_sum', '<f8'), ('foil_min', '<f8'), ('foil_max', '<f8')
+    ])
+
+def empty_aggregates(size):
+    import numpy as np
+
+    aggregates = np.zeros(size, dtype=aggregate_dtype())
+    for field in ['usd_min', 'foil_min']:
+        aggregates[field] = np.inf
+    for field in ['usd_max', 'foil_max']:
+        aggregates[field] = -np.inf
+    return aggregates
+
+def load_state(bucket):
+    """(aggregates, [merged days]), empty before the first run"""
+    import numpy as np
+
+    try:
+        body = s3.get_object(Bucket=bucket, Key=STATE_KEY)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return load_legacy_state(bucket)
+    with np.load(io.BytesIO(body)) as state:
+        return state['aggregates'].copy(), state['days'].tolist()
+
+def load_legacy_state(bucket):
+    """State written as separate aggregates.bin and meta.json objects, until the next save replaces it"""
+    import numpy as np
+
+    try:
+        meta = json.loads(s3.get_object(Bucket=bucket, Key=f"{STATE_PREFIX}meta.json")['Body'].read())
+        body = s3.get_object(Bucket=bucket, Key=f"{STATE_PREFIX}aggregates.bin")['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return empty_aggregates(0), []
+    return np.frombuffer(body, dtype=aggregate_dtype()).copy(), meta['days']
+
+def save_state(bucket, aggregates, days):
+    """The aggregates and the days merged into them go in one object, so they can't disagree"""
+    import numpy as np
+
+    buffer = io.BytesIO()
+    np.savez(buffer, aggregates=aggregates, days=np.array(sorted(days), dtype='U10'))
+    s3.put_object(Bucket=bucket, Key=STATE_KEY, Body=buffer.getvalue())
+
+def merge_day(bucket, dates_dict, metrics):
+    """Fold the day's mtg_parquet partition into the aggregates, once per day"""
+    import numpy as np
+
+    aggregates, days = load_state(bucket)
+    if dates_dict['formatted_date'] in days:
+        print(f"Skipped {dates_dict['formatted_date']}, already merged into the aggregates. Rebuild to pick up corrected prices")
+        metrics.put('DaysMerged', 0)
+        return aggregates, days
+
+    partition = f"year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    prices = read_parquet_prefix(bucket, f"mtg_parquet/{partition}", ['card_key', 'usd', 'usd_foil'])
+    keys = prices.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+    metrics.put('RowsIn', len(keys))
+
+    if len(keys) and keys.max() >= len(aggregates):
+        grown = empty_aggregates(int(keys.max()) + 1)
+        grown[:len(aggregates)] = aggregates
+        aggregates = grown
+
+    # card_key is unique within a day, so plain fancy indexing updates each card once
+    aggregates['records'][keys] += 1
+    for name, prefix in [('usd', 'usd'), ('usd_foil', 'foil')]:
+        values = prices.column(name).to_numpy(zero_copy_only=False).astype('<f8')
+        priced = ~np.isnan(values)
+        priced_keys, priced_values = keys[priced], values[priced]
+        aggregates[f"{prefix}_count"][priced_keys] += 1
+        aggregates[f"{prefix}_sum"][priced_keys] += priced_values
+        aggregates[f"{prefix}_min"][priced_keys] = np.minimum(aggregates[f"{prefix}_min"][priced_keys], priced_values)
+        aggregates[f"{prefix}_max"][priced_keys] = np.maximum(aggregates[f"{prefix}_max"][priced_keys], priced_values)
+
+    days = days + [dates_dict['formatted_date']]
+    save_state(bucket, aggregates, days)
+    metrics.put('DaysMerged', 1)
+    print(f"Merged {len(keys)} prices for {dates_dict['formatted_date']} into the aggregates")
+    return aggregates, days
+
+def rebuild_aggregates(bucket):
+    """Recompute the aggregates from mtg_prices_iceberg with one grouped UNLOAD"""
+    import numpy as np
+
+    rebuild_prefix = f"{INDEX_PREFIX}/_rebuild/"
+    clear_prefix(bucket, rebuild_prefix)
+    queries = {
+        'aggregates': f"""
+    UNLOAD (
+        SELECT
+            card_key,
+            count(*) AS records,
+            count(usd) AS usd_count,
+            sum(CAST(usd AS DOUBLE)) AS usd_sum,
+            min(CAST(usd AS DOUBLE)) AS usd_min,
+            max(CAST(usd AS DOUBLE)) AS usd_max,
+            count(usd_foil) AS foil_count,
+            sum(CAST(usd_foil AS DOUBLE)) AS foil_sum,
+            min(CAST(usd_foil AS DOUBLE)) AS foil_min,
+            max(CAST(usd_foil AS DOUBLE)) AS foil_max
+        FROM mtg_prices_iceberg
+        GROUP BY card_key
+    )
+    TO 's3://{bucket}/{rebuild_prefix}'
+    WITH (format = 'PARQUET', compression = 'SNAPPY')
+    """,
+        'days': "SELECT DISTINCT CAST(pull_date AS VARCHAR) AS pull_date FROM mtg_prices_iceberg"
+    }
+    results = run_queries(athena, queries, f"s3://{bucket}/athena_output/")
+    for name, result in results.items():
+        if result['state'] != 'SUCCEEDED':
+            raise Exception(f"Card search {name} query {result['state']}: {result['state_change_reason']}")
+
+    table = read_parquet_prefix(bucket, rebuild_prefix)
+    keys = table.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+    aggregates = empty_aggregates(int(keys.max()) + 1 if len(keys) else 0)
+    for field in aggregate_dtype().names:
+        values = table.column(field).to_numpy(zero_copy_only=False)
+        if field.endswith('_count') or field == 'records':
+            aggregates[field][keys] = values
+        else:
+            # Cards never priced come back null; keep the empty defaults for them
+            present = ~np.isnan(values.astype('<f8'))
+            aggregates[field][keys[present]] = values[present]
+
+    days = sorted(row['pull_date'] for row in fetch_rows(athena, results['days']))
+    save_state(bucket, aggregates, days)
+    clear_prefix(bucket, rebuild_prefix)
+    return aggregates, days
+
+def trigrams(text):
+    return {text[start:start + GRAM] for start in range(len(text) - GRAM + 1)}
+
+def gram_postings(strings):
+    """{trigram: [index of each lowercased string containing it]}"""
+    postings = {}
+    for position, text in enumerate(strings):
+        for gram in trigrams(text.lower()):
+            postings.setdefault(gram, []).append(position)
+    return postings
+
+def build_document(bucket, dates_dict, aggregates):
+    """The search document for the day's static snapshot, with trigram postings over names and set names"""
+    # names and set_names hold the distinct values, which name_grams/set_grams ({trigram: [positions]})
+    # and each card row reference by position. cards are in name, set_name, id order.
+    partition = f"year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    static = read_parquet_prefix(bucket, f"mtg_static_parquet/{partition}",
+                                 ['id', 'card_key', 'tcgplayer_id', 'name', 'set_name']).to_pylist()
+    static.sort(key=lambda card: (card['name'] or '', card['set_name'] or '', card['id']))
+
+    names = sorted({card['name'] or '' for card in static})
+    set_names = sorted({card['set_name'] or '' for card in static})
+    name_positions = {name: position for position, name in enumerate(names)}
+    set_positions = {set_name: position for position, set_name in enumerate(set_names)}
+
+    cards = []
+    for card in static:
+        row = [name_positions[card['name'] or ''], set_positions[card['set_name'] or ''], card['id'],
+               None if card['tcgplayer_id'] is None else int(card['tcgplayer_id'])]
+        card_key = card['card_key']
+        row += price_summary(aggregates[card_key] if card_key is not None and card_key < len(aggregates) else None)
+        cards.append(row)
+
+    return {
+        'date': dates_dict['formatted_date'],
+        'columns': ['name', 'set_name', 'id', 'tcgplayer_id', 'price_records_count',
+                    'avg_price', 'min_price', 'max_price', 'avg_foil_price', 'min_foil_price', 'max_foil_price'],
+        'names': names,
+        'set_names': set_names,
+        'name_grams': gram_postings(names),
+        'set_grams': gram_postings(set_names),
+        'cards': cards
+    }
+
+def price_summary(aggregate):
+    """[records, avg, min, max, avg foil, min foil, max foil], rounded to cents as GET_CARD_ID does"""
+    if aggregate is None:
+        return [0, None, None, None, None, None, None]
+    summary = [int(aggregate['records'])]
+    for prefix in ['usd', 'foil']:
+        count = int(aggregate[f"{prefix}_count"])
+        if count:
+            summary += [round(float(aggregate[f"{prefix}_sum"]) / count, 2),
+                        round(float(aggregate[f"{prefix}_min"]), 2), round(float(aggregate[f"{prefix}_max"]), 2)]
+        else:
+            summary += [None, None, None]
+    return summary
+
+def publish_generation(bucket, generation, body):
+    s3.put_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/gen={generation}/index.json.gz", Body=body)
+    s3.put_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/CURRENT", Body=json.dumps({'generation': generation}))
+
+    cutoff = (datetime.strptime(generation, '%Y%m%d') - timedelta(days=KEEP_GENERATIONS)).strftime('%Y%m%d')
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=f"{INDEX_PREFIX}/gen=", Delimiter='/')
+    for common_prefix in response.get('CommonPrefixes', []):
+        if common_prefix['Prefix'].rstrip('/').split('=')[-1] < cutoff:
+            clear_prefix(bucket, common_prefix['Prefix'])
+
+def download_index(bucket, local_path):
+    """Copy the live search document to local_path for CardSearchIndex"""
+    generation = json.loads(s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/CURRENT")['Body'].read())['generation']
+    s3.download_file(bucket, f"{INDEX_PREFIX}/gen={generation}/index.json.gz", local_path)
+    return generation
+
+class CardSearchIndex:
+    """GET_CARD_ID's search over a downloaded document, e.g. CardSearchIndex('card_search.json.gz').search('squall', 'final')"""
+    def __init__(self, local_path):
+        with gzip.open(local_path, 'rt', encoding='utf-8') as f:
+            document = json.load(f)
+        self.date = document['date']
+        self.names = document['names']
+        self.set_names = document['set_names']
+        self.cards = document['cards']
+        self._lowered_names = [name.lower() for name in self.names]
+        self._lowered_set_names = [set_name.lower() for set_name in self.set_names]
+        self._name_grams = document['name_grams']
+        self._set_grams = document['set_grams']
+
+        # Card rows for each distinct name and set name
+        self._rows_by_name = [[] for _ in self.names]
+        self._rows_by_set = [[] for _ in self.set_names]
+        for row, card in enumerate(self.cards):
+            self._rows_by_name[card[0]].append(row)
+            self._rows_by_set[card[1]].append(row)
+
+    @staticmethod
+    def _matching(term, lowered, grams):
+        """Positions of the distinct values containing term, with LIKE's % and _ wildcards"""
+        if '%' in term or '_' in term:
+            # Wildcards break the trigrams apart, so scan the distinct values as LIKE would
+            pattern = re.compile(''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char)
+                                         for char in term), re.DOTALL)
+            return [position for position, text in enumerate(lowered) if pattern.search(text)]
+        if len(term) < GRAM:
+            return [position for position, text in enumerate(lowered) if term in text]
+
+        # Intersect from the rarest trigram so the candidate set stays small
+        candidates = None
+        for gram in sorted(trigrams(term), key=lambda gram: len(grams.get(gram, ()))):
+            postings = grams.get(gram)
+            if not postings:
+                return []
+            candidates = set(postings) if candidates is None else candidates.intersection(postings)
+            if not candidates:
+                return []
+        # Every trigram present doesn't mean they are adjacent, so confirm the substring
+        return [position for position in candidates if term in lowered[position]]
+
+    def search(self, card_name=None, set_search=None, limit=10000):
+        """GET_CARD_ID rows, by name, whose name and set name contain the terms case-insensitively; empty terms match all"""
+        rows = None
+        for term, lowered, grams, rows_by_value in [
+            (card_name, self._lowered_names, self._name_grams, self._rows_by_name),
+            (set_search, self._lowered_set_names, self._set_grams, self._rows_by_set)
+        ]:
+            if not term:
+                continue
+            matched = {row for position in self._matching(term.lower(), lowered, grams) for row in rows_by_value[position]}
+            rows = matched if rows is None else rows & matched
+
+        # Cards are stored in name order, so row order is result order
+        ordered = range(len(self.cards)) if rows is None else sorted(rows)
+        results = []
+        for row in ordered[:limit]:
+            name, set_name, card_id, tcgplayer_id, *prices = self.cards[row]
+            tcgplayer_url = None if tcgplayer_id is None else f"{TCGPLAYER_URL}{tcgplayer_id}"
+            results.append(dict(zip(RESULT_COLUMNS, [self.names[name], self.set_names[set_name], card_id, tcgplayer_url] + prices)))
+        return results
@@ -1,13 +1,24 @@
-import boto3
-from datetime import datetime
 import json
-
-s3_client = boto3.client('s3')
-sns_client = boto3.client('sns')
-ssm = boto3.client('ssm')
-
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from mtg_runtime import LazyClient, get_dates, get_multiple_parameters
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+s3_client = LazyClient('s3')
+sns_client = LazyClient('sns')
+
+# Row counts json_to_parquet observed while writing, one file per day
+ROW_COUNTS_PREFIX = 'mtg_manifest/row_counts/'
+# One suffix read of this size covers the footers the job writes; a larger footer costs a second GET
+FOOTER_READ_BYTES = 64 * 1024
+FOOTER_WORKERS = 16
+PARQUET_MAGIC = b'PAR1'
+
+@profiled('confirm_parquet_created')
 def lambda_handler(event, context):   
-    dates_dict = get_dates()
+    dates_dict = get_dates(event)
+    metrics = StageMetrics('confirm_parquet_created', dates_dict['formatted_date'])
 
     # Get configuration
     param_names = [
@@ -28,15 +39,48 @@ def lambda_handler(event, context):
         
         # Check static folder  
         static_files = list_files_in_folder(s3_client, primary_bucket, static_parquet_key)
-        
+
+        # Read every file's footer and compare the totals with what the Spark job logged
+        logged_counts = read_logged_row_counts(s3_client, primary_bucket, dates_dict['formatted_date'])
+        reports = {}
+        problems = []
+        with metrics.timer('Verify'):
+            for label, output, files in [('Daily', 'daily', daily_files), ('Static', 'static', static_files)]:
+                report = verify_parquet_files(s3_client, primary_bucket, files)
+                reports[output] = report
+                print(f"{label} parquet: {len(report['files'])} files, {report['rows']} rows, "
+                      f"{report['row_groups']} row groups, schema {report['schema']}")
+
+                metrics.put(f"{label}Files", len(files))
+                metrics.put(f"{label}Bytes", sum(file['size'] for file in files), 'Bytes')
+                metrics.put(f"{label}Rows", report['rows'])
+                metrics.put(f"{label}RowGroups", report['row_groups'])
+                metrics.add('FooterBytesRead', report['footer_bytes'], 'Bytes')
+
+                problems += [f"  {label} unreadable: {error}" for error in report['unreadable']]
+                if report['schema_mismatches']:
+                    problems.append(f"  {label} schema differs from {report['schema_file']} in: {', '.join(report['schema_mismatches'])}")
+                logged_rows = logged_counts['outputs'].get(output, {}).get('rows') if logged_counts else None
+                if logged_rows is not None and logged_rows != report['rows']:
+                    problems.append(f"  {label} footers hold {report['rows']:,} rows, json_to_parquet logged {logged_rows:,}")
+        metrics.put('VerificationProblems', len(problems))
+        metrics.emit()
+
+        notes = list(problems)
+        if logged_counts is None:
+            notes.append(f"  No row counts logged by json_to_parquet at {ROW_COUNTS_PREFIX}{dates_dict['formatted_date']}.json")
+
         # Send notification
-        send_notification(sns_client, status_topic_arn, daily_files, static_files, dates_dict, daily_parquet_key, static_parquet_key)
+        send_notification(sns_client, status_topic_arn, primary_bucket, metrics, daily_files, static_files, daily_parquet_key, static_parquet_key, notes)
         
         return {
-            'statusCode': 200,
+            'statusCode': 500 if problems else 200,
             'message': f'Folder check complete for {dates_dict["formatted_date"]}',
             'daily_files': len(daily_files),
-            'static_files': len(static_files)
+            'static_files': len(static_files),
+            'verification': {output: {name: report[name] for name in ['rows', 'row_groups', 'schema']}
+                             for output, report in reports.items()},
+            'problems': problems
         }
         
     except Exception as e:
@@ -44,19 +88,16 @@ def lambda_handler(event, context):
         return {'statusCode': 500, 'error': str(e)}
 
 def list_files_in_folder(s3_client, primary_bucket, folder_key):
-    """List files in S3 folder"""
+    """List files in S3 folder, every page of it"""
     try:
-        response = s3_client.list_objects_v2(
-            Bucket=primary_bucket,
-            Prefix=folder_key + '/'
-        )
-        
         files = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=primary_bucket, Prefix=folder_key + '/'):
+            for obj in page.get('Contents', []):
                 files.append({
                     'name': obj['Key'].split('/')[-1],
-                    'size_mb': round(obj['Size'] / (1024 * 1024), 2)
+                    'key': obj['Key'],
+                    'size': obj['Size']
                 })
         
         return files
@@ -65,31 +106,90 @@ def list_files_in_folder(s3_client, primary_bucket, folder_key):
         print(f"Error checking folder {folder_key}: {str(e)}")
         return []
 
-def send_notification(sns_client, status_topic_arn, daily_files, static_files, dates_dict, daily_key, static_key):
-    """Send simple SNS notification"""
-
-    # Get configuration
-    param_names = [
-        '/mtg/s3/buckets/primary_bucket'
-    ]
-    params = get_multiple_parameters(param_names)
-    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
-
-    email_message = f"""MTG S3 Folder Check - {dates_dict['formatted_date']}
-
-Daily Parquet Folder (s3://{primary_bucket}/{daily_key}/):
-  Files found: {len(daily_files)}"""
-
-    for file in daily_files:
-        email_message += f"\n  - {file['name']} ({file['size_mb']} MB)"
-
-    email_message += f"""
-
-Static Parquet Folder (s3://{primary_bucket}/{static_key}/):
-  Files found: {len(static_files)}"""
+def read_logged_row_counts(s3_client, primary_bucket, date):
+    """The row counts json_to_parquet recorded for the day, or None for a job that predates them"""
+    try:
+        body = s3_client.get_object(Bucket=primary_bucket, Key=f"{ROW_COUNTS_PREFIX}{date}.json")['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+def read_footer(s3_client, primary_bucket, file):
+    """(pyarrow FileMetaData, bytes fetched) from ranged GETs of the file's tail; raises if the footer is missing or corrupt"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    size = file['size']
+    # Magic at both ends plus the 4 byte footer length
+    if size < 12:
+        raise ValueError(f"{size} bytes is too small for Parquet")
+
+    start = max(0, size - FOOTER_READ_BYTES)
+    tail = s3_client.get_object(Bucket=primary_bucket, Key=file['key'], Range=f"bytes={start}-{size - 1}")['Body'].read()
+    fetched = len(tail)
+    if tail[-4:] != PARQUET_MAGIC:
+        raise ValueError("no Parquet magic at the end, the write may be incomplete")
+
+    footer_length = struct.unpack('<I', tail[-8:-4])[0]
+    if footer_length + 12 > size:
+        raise ValueError(f"footer length {footer_length} is larger than the file")
+    if footer_length + 8 > len(tail):
+        start = size - footer_length - 8
+        tail = s3_client.get_object(Bucket=primary_bucket, Key=file['key'], Range=f"bytes={start}-{size - 1}")['Body'].read()
+        fetched += len(tail)
+
+    return pq.read_metadata(pa.BufferReader(tail[-(footer_length + 8):])), fetched
+
+def verify_parquet_files(s3_client, primary_bucket, files):
+    """
+    Read the footers of a folder's data files concurrently, comparing each schema with the first readable one
+    """
+    # Athena skips names starting with _ or ., such as Spark's _SUCCESS
+    data_files = [file for file in files if not file['name'].startswith(('_', '.'))]
+    report = {
+        'files': [file['name'] for file in data_files],
+        'rows': 0,
+        'row_groups': 0,
+        'footer_bytes': 0,
+        'schema': None,
+        'schema_file': None,
+        'schema_mismatches': [],
+        'unreadable': []
+    }
 
-    for file in static_files:
-        email_message += f"\n  - {file['name']} ({file['size_mb']} MB)"
+    def read(file):
+        try:
+            return file, read_footer(s3_client, primary_bucket, file), None
+        except Exception as e:
+            return file, (None, 0), str(e)
+
+    first_schema = None
+    with ThreadPoolExecutor(max_workers=FOOTER_WORKERS) as executor:
+        # map keeps listing order, so the first readable file's schema is the reference
+        for file, (metadata, fetched), error in executor.map(read, data_files):
+            report['footer_bytes'] += fetched
+            if error:
+                report['unreadable'].append(f"{file['name']}: {error}")
+                continue
+            report['rows'] += metadata.num_rows
+            report['row_groups'] += metadata.num_row_groups
+
+            schema = metadata.schema.to_arrow_schema()
+            if first_schema is None:
+                first_schema = schema
+                report['schema'] = [f"{field.name}: {field.type}" for field in schema]
+                report['schema_file'] = file['name']
+            elif not schema.equals(first_schema):
+                report['schema_mismatches'].append(file['name'])
+
+    return report
+
+def send_notification(sns_client, status_topic_arn, primary_bucket, metrics, daily_files, static_files, daily_key, static_key, notes=()):
+    """Send a short SNS summary of the metrics, calling out any empty folder and verification notes"""
+
+    missing = [f"  No files found in s3://{primary_bucket}/{key}/"
+               for key, files in [(daily_key, daily_files), (static_key, static_files)] if not files]
+    email_message = metrics.summary('MTG S3 Folder Check', missing + list(notes))
 
     message = {
         'default': 'This is the default message',
@@ -102,41 +202,6 @@ Static Parquet Folder (s3://{primary_bucket}/{static_key}/):
             Message=json.dumps(message),
             MessageStructure='json'
         )
-        print(f"SNS message sent. Response: {response}")
+        print(f"SNS message sent: {response['MessageId']}")
     except Exception as e:
         print(f"Error sending SNS: {str(e)}")
-
-def get_dates():
-    current_date = datetime.now()
-    
-    # Uncomment to force a specific date for testing
-    # temp_date = '2024-12-08'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
-    
-    return {
-        'year': current_date.strftime('%Y'),
-        'month': current_date.strftime('%m'),
-        'day': current_date.strftime('%d'),
-        'short_date': current_date.strftime('%Y%m%d'),
-        'formatted_date': current_date.strftime('%Y-%m-%d')
-    }
-
-def get_multiple_parameters(parameter_names):
-    try:
-        response = ssm.get_parameters(
-            Names=parameter_names,
-            WithDecryption=True
-        )
-
-        # Check for missing parameters
-        if response.get('InvalidParameters'):
-            raise Exception(f"Missing parameters: {response['InvalidParameters']}")
-
-        params = {}
-        for param in response['Parameters']:
-            params[param['Name']] = param['Value']
-        
-        return params
-    except Exception as e:
-        print(f"Error getting parameters: {e}")
-        raise
\ No newline at end of file
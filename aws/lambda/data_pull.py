@@ -1,15 +1,33 @@
-import boto3
+import codecs
+import hashlib
 import json
 import urllib3
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mtg_runtime import SNAPSHOT_MANIFEST_KEY, LazyClient, clear_prefix, get_dates, get_multiple_parameters
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
 
-s3 = boto3.client('s3')
-ssm = boto3.client('ssm')
+s3 = LazyClient('s3')
 http = urllib3.PoolManager()
 
+# Multipart upload tuning. Peak memory is roughly PART_SIZE * (MAX_CONCURRENCY + 1).
+# S3 requires every part except the last to be at least 5MB.
+PART_SIZE = 16 * 1024 * 1024
+MAX_CONCURRENCY = 4
+
+# Target size of the newline-delimited JSON shards the EMR job reads in parallel
+NDJSON_SHARD_BYTES = 64 * 1024 * 1024
+
+# Bulk-data listing; local stand-ins point this at their own server
+BULK_DATA_URL = 'https://api.scryfall.com/bulk-data'
+
+MANIFEST_KEY = SNAPSHOT_MANIFEST_KEY
+
+@profiled('data_pull')
 def lambda_handler(event, context):
-    dates_dict = get_dates()
+    dates_dict = get_dates(event)
+    metrics = StageMetrics('data_pull', dates_dict['formatted_date'])
 
     # Get configuration
     param_names = [
@@ -18,6 +36,23 @@ def lambda_handler(event, context):
     params = get_multiple_parameters(param_names)
     primary_bucket = params['/mtg/s3/buckets/primary_bucket']
 
+    json_key = f"mtg_temp_json/all_cards_{dates_dict['short_date']}.json"
+    ndjson_prefix = f"mtg_temp_json/all_cards_{dates_dict['short_date']}/"
+
+    # Scryfall only serves today's file, so a historical date replays the retained raw snapshot.
+    # 'download': true fetches from Scryfall anyway and files it under the event's date.
+    if isinstance(event, dict) and event.get('date') and not event.get('download'):
+        with metrics.timer('Transcode'):
+            shard_count, record_count = transcode_to_ndjson(primary_bucket, json_key, ndjson_prefix)
+        metrics.put('RowsOut', record_count)
+        metrics.put('NdjsonShards', shard_count)
+        metrics.emit()
+        return {
+            'statusCode': 200,
+            'new_data': True,
+            'body': json.dumps(f"Replayed {record_count} records from {json_key} into {shard_count} shards")
+        }
+
     # Scryfall API headers (required)
     headers = {
         'User-Agent': 'MTGPriceTracker/1.0 (jamesapplewhite.com/mtg)',
@@ -25,8 +60,7 @@ def lambda_handler(event, context):
     }
 
     # Fetch bulk data metadata
-    url = 'https://api.scryfall.com/bulk-data'
-    response = make_scryfall_request(url, headers)
+    response = make_scryfall_request(BULK_DATA_URL, headers)
 
     bulk_data = json.loads(response.data.decode('utf-8'))
 
@@ -34,31 +68,108 @@ def lambda_handler(event, context):
     all_cards_data = next(item for item in bulk_data['data'] if item['type'] == 'default_cards')
     all_cards_url = all_cards_data['download_uri']
 
+    # Skip the whole pipeline when Scryfall hasn't republished since the last run
+    force = event.get('force', False) if isinstance(event, dict) else False
+    # Only a snapshot the downstream stages finished loading counts as ingested; manifests
+    # from before the status field was added were all loaded
+    manifest = load_manifest(primary_bucket)
+    if manifest and manifest.get('status', 'committed') != 'committed':
+        print(f"Snapshot pulled for {manifest.get('pull_date')} was never loaded downstream, processing again")
+        manifest = None
+    if not force and manifest and manifest['updated_at'] == all_cards_data.get('updated_at') and manifest['size'] == all_cards_data.get('size'):
+        print(f"default_cards unchanged since {manifest['updated_at']}, skipping download")
+        metrics.put('NewData', 0)
+        metrics.emit()
+        return {
+            'statusCode': 200,
+            'new_data': False,
+            'updated_at': manifest['updated_at'],
+            'body': json.dumps('No new bulk data since the last run')
+        }
+
     # Rate limiting delay (50-100ms between requests as recommended)
     time.sleep(0.1)  # 100ms delay
 
-    # Download the bulk data file
-    response = make_scryfall_request(all_cards_url, headers)
+    # Stream by default; 'buffered' keeps the old read-everything-then-put_object path
+    upload_mode = event.get('upload_mode', 'stream') if isinstance(event, dict) else 'stream'
+
+    with metrics.timer('Download'):
+        if upload_mode == 'buffered':
+            # Download the bulk data file
+            response = make_scryfall_request(all_cards_url, headers)
+
+            # Upload data to S3
+            s3.put_object(Bucket=primary_bucket, Key=json_key, Body=response.data, ChecksumAlgorithm='SHA256')
+            total_bytes = len(response.data)
+            content_hash = hashlib.sha256(response.data).hexdigest()
+        else:
+            # Stream the bulk data file into S3, resuming from any progress a failed run left behind
+            total_bytes, content_hash = download_to_s3(
+                all_cards_url,
+                headers,
+                primary_bucket,
+                json_key,
+                expected_size=all_cards_data.get('size'),
+                updated_at=all_cards_data.get('updated_at')
+            )
+    metrics.put('BytesDownloaded', total_bytes, 'Bytes')
+
+    # A republished file with identical content still needs no downstream processing
+    new_data = force or not manifest or manifest['content_hash'] != content_hash
+    if not new_data:
+        print(f"default_cards republished at {all_cards_data.get('updated_at')} with unchanged content")
+
+    # Split the single JSON array into NDJSON shards so Spark can read it with many tasks
+    shard_count, record_count = (0, 0)
+    if new_data:
+        with metrics.timer('Transcode'):
+            shard_count, record_count = transcode_to_ndjson(primary_bucket, json_key, ndjson_prefix)
+
+    save_manifest(primary_bucket, {
+        'updated_at': all_cards_data.get('updated_at'),
+        'size': all_cards_data.get('size'),
+        'content_hash': content_hash,
+        'bytes': total_bytes,
+        'json_key': json_key,
+        'ndjson_prefix': ndjson_prefix,
+        'ndjson_shards': shard_count,
+        'records': record_count,
+        'pull_date': dates_dict['formatted_date'],
+        # athena_add_partitions_all commits it once the day is in Iceberg
+        'status': 'pending' if new_data else 'committed'
+    })
+
+    metrics.put('NewData', int(new_data))
+    metrics.put('RowsOut', record_count)
+    metrics.put('NdjsonShards', shard_count)
+    metrics.emit()
 
-    # Upload data to S3
-    s3.put_object(Bucket=primary_bucket, Key=f'mtg_temp_json/all_cards_{dates_dict['short_date']}.json', Body=response.data)
-    
     return {
         'statusCode': 200,
-        'body': json.dumps('Data downloaded to S3 successfully')
+        'new_data': new_data,
+        'updated_at': all_cards_data.get('updated_at'),
+        'body': json.dumps('Data downloaded to S3 successfully' if new_data else 'Bulk data content unchanged since the last run')
     }
 
-def make_scryfall_request(url, headers, max_retries=3, backoff_factor=2):
+def make_scryfall_request(url, headers, max_retries=3, backoff_factor=2, preload_content=True):
     """
-    Make HTTP request to Scryfall with retry logic for 429 responses
+    Make HTTP request to Scryfall with retry logic for 429 responses.
+    With preload_content=False the body is left unread so the caller can stream it.
     """
     for attempt in range(max_retries):
         try:
-            response = http.request('GET', url, headers=headers)
+            response = http.request('GET', url, headers=headers, preload_content=preload_content)
             
-            if response.status == 200:
+            # 206 is the answer to a Range request when resuming a download
+            if response.status in (200, 206):
                 return response
-            elif response.status == 429:
+
+            if not preload_content:
+                # Free the connection before retrying or raising
+                response.drain_conn()
+                response.release_conn()
+
+            if response.status == 429:
                 # Rate limited - exponential backoff
                 wait_time = backoff_factor ** attempt
                 print(f"Rate limited (429). Waiting {wait_time} seconds before retry {attempt + 1}/{max_retries}")
@@ -81,37 +192,293 @@ def make_scryfall_request(url, headers, max_retries=3, backoff_factor=2):
     # Should not reach here, but just in case
     raise Exception(f"Failed to fetch {url} after {max_retries} attempts")
 
-def get_dates():
-    current_date = datetime.now()
+def download_to_s3(url, headers, bucket, key, expected_size=None, updated_at=None,
+                   part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY, max_resumes=5):
+    """
+    Stream url into an S3 multipart upload at bucket/key, resuming dropped connections with Range requests.
+    Returns the total number of bytes uploaded and the hex SHA256 of the whole object.
+    """
+    # Committed parts are recorded in a progress file next to the target, so a retried
+    # invocation picks up the same multipart upload where the last one stopped
+    progress_key = get_progress_key(key)
+    state = load_progress(bucket, progress_key)
 
-    ### Temp force a specific date
-    # temp_date = '2024-12-03'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
+    # A newer Scryfall snapshot invalidates whatever was uploaded before
+    if state and (state['updated_at'] != updated_at or state['size'] != expected_size or state['part_size'] != part_size):
+        print(f"Discarding stale progress for {key} (updated_at {state['updated_at']} -> {updated_at})")
+        abort_upload(bucket, key, state['upload_id'], progress_key)
+        state = None
 
-    return {
-        'year': current_date.strftime('%Y'),
-        'month': current_date.strftime('%m'),
-        'day': current_date.strftime('%d'),
-        'short_date': current_date.strftime('%Y%m%d'),
-        'formatted_date': current_date.strftime('%Y-%m-%d')
-    }
+    if state:
+        print(f"Resuming {key} from byte {committed_bytes(state)} ({len(state['parts'])} parts committed)")
+    else:
+        upload_id = s3.create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            Metadata={'scryfall-updated-at': updated_at or ''},
+            ChecksumAlgorithm='SHA256'
+        )['UploadId']
+        state = {
+            'upload_id': upload_id,
+            'updated_at': updated_at,
+            'size': expected_size,
+            'part_size': part_size,
+            'parts': []
+        }
+        save_progress(bucket, progress_key, state)
 
-def get_multiple_parameters(parameter_names):
-    try:
-        response = ssm.get_parameters(
-            Names=parameter_names,
-            WithDecryption=True
+    # Download without content encoding so Range offsets and the size check are in raw bytes
+    headers = dict(headers, **{'Accept-Encoding': 'identity'})
+
+    # Hashed as parts are committed; parts committed by an earlier invocation were never
+    # seen here, so that case hashes the finished object instead
+    hasher = None if state['parts'] else hashlib.sha256()
+
+    resumes = 0
+    while True:
+        offset = committed_bytes(state)
+        if expected_size is not None and offset >= expected_size:
+            break
+
+        request_headers = dict(headers)
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+
+        response = make_scryfall_request(url, request_headers, preload_content=False)
+        try:
+            if offset and response.status != 206:
+                # The server ignored the Range header and is sending the whole file again
+                print(f"Range request not honored (HTTP {response.status}), restarting {key} from byte 0")
+                state['parts'] = []
+                hasher = hashlib.sha256()
+            upload_parts(response, bucket, key, state, progress_key, max_concurrency, hasher)
+            break
+        except (urllib3.exceptions.HTTPError, ConnectionError, TimeoutError) as e:
+            resumes += 1
+            if resumes > max_resumes:
+                # Leave the progress file in place so a retried invocation can continue
+                raise Exception(f"Download of {url} dropped {resumes} times, last at byte {committed_bytes(state)}: {str(e)}")
+            print(f"Connection dropped at byte {committed_bytes(state)}: {str(e)}. Resuming ({resumes}/{max_resumes})")
+        finally:
+            response.release_conn()
+
+    total_bytes = committed_bytes(state)
+    if expected_size is not None and total_bytes != expected_size:
+        abort_upload(bucket, key, state['upload_id'], progress_key)
+        raise Exception(f"Size mismatch for {key}: expected {expected_size} bytes, received {total_bytes}")
+
+    if not state['parts']:
+        # Multipart uploads need at least one part
+        abort_upload(bucket, key, state['upload_id'], progress_key)
+        s3.put_object(Bucket=bucket, Key=key, Body=b'', ChecksumAlgorithm='SHA256')
+        return 0, hashlib.sha256(b'').hexdigest()
+
+    s3.complete_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=state['upload_id'],
+        MultipartUpload={'Parts': [
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'ChecksumSHA256': part['ChecksumSHA256']}
+            for part in state['parts']
+        ]}
+    )
+    s3.delete_object(Bucket=bucket, Key=progress_key)
+    print(f"Uploaded {total_bytes} bytes to s3://{bucket}/{key} in {len(state['parts'])} parts")
+    content_hash = hasher.hexdigest() if hasher else hash_object(bucket, key)
+    return total_bytes, content_hash
+
+def upload_parts(response, bucket, key, state, progress_key, max_concurrency, hasher=None):
+    """
+    Upload an unbuffered urllib3 response as multipart parts, keeping at most max_concurrency uncommitted
+    """
+    # Parts are committed to the progress file and fed to hasher in order, so the committed
+    # byte count is always a valid Range offset. On a failure the parts in flight still finish
+    # and are committed before the error is raised.
+    part_size = state['part_size']
+    upload_id = state['upload_id']
+    finished = {}
+    # Bodies are kept until their part is committed, so the hash sees bytes in file order
+    bodies = {}
+
+    def upload_part(part_number, body):
+        part = s3.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body,
+            ChecksumAlgorithm='SHA256'
         )
+        return {'PartNumber': part_number, 'ETag': part['ETag'], 'ChecksumSHA256': part['ChecksumSHA256'], 'Size': len(body)}
+
+    def commit(done):
+        error = None
+        for future in done:
+            try:
+                part = future.result()
+                finished[part['PartNumber']] = part
+            except Exception as e:
+                error = e
+
+        # Advance the committed prefix as far as contiguous parts allow
+        next_part = len(state['parts']) + 1
+        advanced = False
+        while next_part in finished:
+            state['parts'].append(finished.pop(next_part))
+            body = bodies.pop(next_part)
+            if hasher:
+                hasher.update(body)
+            next_part += 1
+            advanced = True
+        if advanced:
+            save_progress(bucket, progress_key, state)
+
+        if error:
+            raise error
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = set()
+        part_number = len(state['parts']) + 1
+        try:
+            while True:
+                chunk = read_chunk(response, part_size)
+                if not chunk:
+                    break
+
+                # Bound memory by waiting for a free slot before reading further; a part that
+                # finished out of order still holds its slot until the parts before it commit
+                while len(bodies) >= max_concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    commit(done)
+
+                bodies[part_number] = chunk
+                in_flight.add(executor.submit(upload_part, part_number, chunk))
+                part_number += 1
+        finally:
+            # A partially read chunk is dropped; the Range resume refetches it
+            done, _ = wait(in_flight)
+            commit(done)
+
+def committed_bytes(state):
+    return sum(part['Size'] for part in state['parts'])
+
+def get_progress_key(key):
+    folder, _, file_name = key.rpartition('/')
+    return f"{folder}/_progress/{file_name}.progress.json"
+
+def load_progress(bucket, progress_key):
+    """Return the saved download state, or None when there is nothing to resume"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=progress_key)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def save_progress(bucket, progress_key, state):
+    s3.put_object(Bucket=bucket, Key=progress_key, Body=json.dumps(state))
+
+def transcode_to_ndjson(bucket, json_key, shard_prefix, shard_bytes=NDJSON_SHARD_BYTES, read_bytes=PART_SIZE):
+    """
+    Rewrite the bulk JSON array as NDJSON shards of about shard_bytes under shard_prefix, streaming from S3.
+    Returns the number of shards and records written.
+    """
+    # Memory stays bounded by one shard plus one read chunk. Each record's original text is
+    # kept unless it spans lines.
+    # Old shards from an earlier run of the same day would otherwise be read twice
+    clear_prefix(bucket, shard_prefix)
 
-        # Check for missing parameters
-        if response.get('InvalidParameters'):
-            raise Exception(f"Missing parameters: {response['InvalidParameters']}")
+    body = s3.get_object(Bucket=bucket, Key=json_key)['Body']
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
 
-        params = {}
-        for param in response['Parameters']:
-            params[param['Name']] = param['Value']
-        
-        return params
+    buffer = ''
+    position = 0
+    in_array = False
+    shard = []
+    shard_size = 0
+    shard_count = 0
+    record_count = 0
+
+    def flush():
+        nonlocal shard, shard_size, shard_count
+        if shard:
+            shard_key = f"{shard_prefix}part-{shard_count:05d}.json"
+            s3.put_object(Bucket=bucket, Key=shard_key, Body=('\n'.join(shard) + '\n').encode('utf-8'))
+            shard_count += 1
+        shard = []
+        shard_size = 0
+
+    for chunk in body.iter_chunks(read_bytes):
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+        if not in_array:
+            start = buffer.find('[')
+            if start < 0:
+                continue
+            position = start + 1
+            in_array = True
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+            try:
+                record, end = json_decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Record continues in the next chunk
+                break
+
+            line = buffer[position:end]
+            if '\n' in line or '\r' in line:
+                line = json.dumps(record)
+            shard.append(line)
+            shard_size += len(line) + 1
+            record_count += 1
+            position = end
+
+            if shard_size >= shard_bytes:
+                flush()
+
+    if buffer[position:].strip() not in ('', ']'):
+        raise Exception(f"Unexpected trailing data in {json_key} after {record_count} records")
+    flush()
+
+    print(f"Wrote {record_count} records to {shard_count} NDJSON shards under s3://{bucket}/{shard_prefix}")
+    return shard_count, record_count
+
+def hash_object(bucket, key, read_bytes=PART_SIZE):
+    """Hex SHA256 of an S3 object, streamed"""
+    hasher = hashlib.sha256()
+    for chunk in s3.get_object(Bucket=bucket, Key=key)['Body'].iter_chunks(read_bytes):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+def load_manifest(bucket):
+    """Return the manifest of the last ingested snapshot, or None on the first run"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def save_manifest(bucket, manifest):
+    s3.put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest, indent=2))
+
+def abort_upload(bucket, key, upload_id, progress_key):
+    try:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
     except Exception as e:
-        print(f"Error getting parameters: {e}")
-        raise
\ No newline at end of file
+        print(f"Error aborting multipart upload {upload_id}: {str(e)}")
+    s3.delete_object(Bucket=bucket, Key=progress_key)
+
+def read_chunk(response, size):
+    """Read exactly `size` bytes from the stream, or fewer at end of stream"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = response.read(size - len(buffer))
+        if not data:
+            break
+        buffer.extend(data)
+    return bytes(buffer)
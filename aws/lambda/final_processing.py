@@ -1,16 +1,45 @@
 import json
-import boto3
-import pandas as pd
+import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
-import math
-from datetime import datetime
+from urllib.parse import quote
+from mtg_runtime import LazyClient, get_dates, get_multiple_parameters, read_parquet_prefix, round_ratios
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
 
-s3 = boto3.client('s3')
-ssm = boto3.client('ssm')
+s3 = LazyClient('s3')
 
+# Columns produced by query_athena
+INPUT_COLUMNS = ['id', 'tcgplayer_id', 'name', 'set_name', 'set_type', 'rarity', 'released_at', 'usd', 'pull_date']
+
+# Columns of the published CSV; the processed frame also carries rarity for the feeds
+OUTPUT_COLUMNS = [
+    'id', 'tcgplayer_id', 'name', 'set_name', 'set_type', 'released_at', 'today_price', 'today_price_date',
+    '1wk_ago_price', '2wk_ago_price', '4wk_ago_price', '1wk_diff', '2wk_diff', '4wk_diff'
+]
+
+# Top and bottom movers per window, for all cards and per value of each segment column,
+# published as small JSON documents next to the CSV under feeds/. 'feed_size' overrides FEED_SIZE.
+FEED_WINDOWS = ['1wk', '2wk', '4wk']
+FEED_SEGMENTS = ['set_type', 'rarity']
+FEED_SIZE = 10
+FEED_COLUMNS = ['id', 'tcgplayer_id', 'name', 'set_name', 'set_type', 'rarity', 'released_at', 'today_price']
+FEED_WORKERS = 16
+
+# Output price column for each movers.py window it is read from
+MOVERS_WINDOWS = {
+    '1wk_ago_price': 7,
+    '2wk_ago_price': 14,
+    '4wk_ago_price': 28
+}
+
+@profiled('final_processing')
 def lambda_handler(event, context):
     # Get the current dates
-    dates = get_dates()
+    dates = get_dates(event)
+    metrics = StageMetrics('final_processing', dates['formatted_date'])
 
     # Get configuration
     param_names = [
@@ -23,25 +52,46 @@ def lambda_handler(event, context):
     output_bucket = params['/mtg/s3/buckets/output_bucket']
     final_output_key = params['/mtg/s3/paths/final_output_key']
     
+    # Must match the handoff_format query_athena was run with; 'movers' reads the
+    # table movers.py maintains instead and needs no query_athena run
+    handoff_format = event.get('handoff_format', 'parquet') if isinstance(event, dict) else 'parquet'
+
     # Define S3 bucket and file paths
     input_key = f"mtg_temp_daily/{dates['short_date']}_daily_out_raw.csv"
+    parquet_prefix = f"mtg_temp_daily/{dates['short_date']}_daily_out_raw/"
     
-    # Read the input CSV from S3
     try:
-        csv_file = s3.get_object(Bucket=primary_bucket, Key=input_key)
-        csv_content = csv_file['Body'].read().decode('utf-8')
-        
-        # Create a file-like object from the CSV content
-        csv_file_like = StringIO(csv_content)
+        with metrics.timer('Transform'):
+            if handoff_format == 'movers':
+                movers_prefix = f"mtg_movers/year={dates['year']}/month={dates['month']}/day={dates['day']}/"
+                processed_data = process_movers(primary_bucket, movers_prefix, dates['formatted_date'], metrics)
+            elif handoff_format == 'parquet':
+                # Read the typed Parquet unloaded by query_athena, column by column straight from S3
+                processed_data = process_parquet(primary_bucket, parquet_prefix, dates['formatted_date'], metrics)
+            else:
+                # Read the input CSV from S3
+                csv_file = s3.get_object(Bucket=primary_bucket, Key=input_key)
+                csv_content = csv_file['Body'].read().decode('utf-8')
+                metrics.put('BytesRead', len(csv_content), 'Bytes')
+
+                # Create a file-like object from the CSV content
+                csv_file_like = StringIO(csv_content)
 
-        # Process the CSV data using the new transformation logic
-        processed_data = process_csv(csv_file_like)
+                # Process the CSV data using the new transformation logic
+                processed_data = process_csv(csv_file_like, dates['formatted_date'], metrics)
 
-        # Convert processed DataFrame to CSV
-        output_csv = processed_data.to_csv(index=False)
+        # Stream the CSV and its gzip copy through /tmp rather than building either as a string
+        with metrics.timer('Write'):
+            metrics.put('BytesWritten', upload_csv(processed_data, output_bucket, final_output_key), 'Bytes')
+            metrics.put('BytesWrittenGzip', upload_csv(processed_data, output_bucket, f"{final_output_key}.gz", compress=True), 'Bytes')
+        metrics.put('RowsOut', len(processed_data))
 
-        # Upload the processed CSV back to S3
-        s3.put_object(Bucket=output_bucket, Key=final_output_key, Body=output_csv)
+        feed_size = event.get('feed_size', FEED_SIZE) if isinstance(event, dict) else FEED_SIZE
+        with metrics.timer('Feeds'):
+            documents = build_feeds(processed_data, dates['formatted_date'], feed_size)
+            metrics.put('FeedBytes', publish_feeds(output_bucket, feeds_prefix(final_output_key), documents), 'Bytes')
+        metrics.put('FeedDocuments', len(documents))
+        metrics.emit()
         
         return {
             'statusCode': 200,
@@ -53,117 +103,187 @@ def lambda_handler(event, context):
             'body': json.dumps(f"Error: {str(e)}")
         }
 
-def get_dates():
-    current_date = datetime.now()
+def process_parquet(bucket, prefix, run_date=None, metrics=None):
+    # Only the needed column chunks are fetched, straight from S3
+    df = read_parquet_prefix(bucket, prefix, INPUT_COLUMNS).to_pandas(date_as_object=False)
+    if metrics:
+        metrics.put('RowsIn', len(df))
 
-    ## Temp force a specific date -- this forced date doesn't seem to work on this lambda
-    # temp_date = '2024-12-08'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
+    return process_frame(df, run_date)
 
-    return {
-        'year': current_date.strftime('%Y'),
-        'month': current_date.strftime('%m'),
-        'day': current_date.strftime('%d'),
-        'short_date': current_date.strftime('%Y%m%d'),
-        'formatted_date': current_date.strftime('%Y-%m-%d')
-    }
+def process_movers(bucket, prefix, run_date=None, metrics=None):
+    """Build the same output from the movers table, which already holds one row per card"""
+    import pandas as pd
 
-def get_multiple_parameters(parameter_names):
-    try:
-        response = ssm.get_parameters(
-            Names=parameter_names,
-            WithDecryption=True
-        )
-
-        # Check for missing parameters
-        if response.get('InvalidParameters'):
-            raise Exception(f"Missing parameters: {response['InvalidParameters']}")
-
-        params = {}
-        for param in response['Parameters']:
-            params[param['Name']] = param['Value']
-        
-        return params
-    except Exception as e:
-        print(f"Error getting parameters: {e}")
-        raise
+    columns = ['id', 'tcgplayer_id', 'name', 'set_name', 'set_type', 'rarity', 'released_at', 'usd']
+    columns += [f"usd_{window}d_ago" for window in MOVERS_WINDOWS.values()]
+    df = read_parquet_prefix(bucket, prefix, columns).to_pandas()
+    if metrics:
+        metrics.put('RowsIn', len(df))
+
+    today = pd.to_datetime(run_date if run_date else 'today').normalize()
+    df['released_at'] = pd.to_datetime(df['released_at'])
+
+    # The release window query_athena applies in SQL
+    df = df[df['released_at'] >= today - pd.DateOffset(years=10)]
+
+    cards = df.set_index('id').sort_index()
+    prices = pd.DataFrame({'today_price': cards['usd']})
+    for label, window in MOVERS_WINDOWS.items():
+        prices[label] = cards[f"usd_{window}d_ago"]
+
+    return movers_output(cards, prices, today)
+
+def process_csv(file_path, run_date=None, metrics=None):
+    import pandas as pd
 
-def process_csv(file_path):
     # Ingest the CSV into a DataFrame
     df = pd.read_csv(file_path)
+    if metrics:
+        metrics.put('RowsIn', len(df))
+
+    return process_frame(df, run_date)
+
+def process_frame(df, run_date=None):
+    # Imported here rather than at module load to keep handler init light
+    import pandas as pd
 
     # Convert pull_date and released_at to datetime
     df['pull_date'] = pd.to_datetime(df['pull_date'])
     df['released_at'] = pd.to_datetime(df['released_at'])
 
-    # Get today's date
-    today = pd.to_datetime('today').normalize() 
-        # - pd.Timedelta(days=1)
+    # Get the run date; today unless a historical date is being reprocessed
+    today = pd.to_datetime(run_date if run_date else 'today').normalize()
 
     # Define the dates for price comparisons: 1 week ago, 2 weeks ago, and 4 weeks ago
-    one_week_ago = today - pd.DateOffset(weeks=1)
-    two_weeks_ago = today - pd.DateOffset(weeks=2)
-    four_weeks_ago = today - pd.DateOffset(weeks=4)
-
-    # Initialize a list to store the processed results
-    results = []
-
-    # Group by 'id' and process each group
-    grouped = df.groupby('id')
-
-    for id_, group in grouped:
-        row = {
-            'id': id_,
-            'tcgplayer_id': f'https://www.tcgplayer.com/product/{int(float(group["tcgplayer_id"].iloc[0]))}' 
-                            if not math.isnan(group['tcgplayer_id'].iloc[0]) else None,
-            'name': group['name'].iloc[0],
-            'set_name': group['set_name'].iloc[0],
-            'set_type': group['set_type'].iloc[0],
-            'released_at': group['released_at'].iloc[0].date()
-        }
+    comparison_dates = {
+        'today_price': today,
+        '1wk_ago_price': today - pd.DateOffset(weeks=1),
+        '2wk_ago_price': today - pd.DateOffset(weeks=2),
+        '4wk_ago_price': today - pd.DateOffset(weeks=4)
+    }
+
+    # Static card fields come from each card's newest row, one row per id in id order.
+    # Cached query_athena slices were joined against the static snapshot of their own day.
+    cards = df.sort_values('pull_date', ascending=False, kind='stable') \
+        .drop_duplicates(subset='id', keep='first').set_index('id').sort_index()
+
+    # Pivot the comparison dates into columns once, keeping the first price per card and date
+    date_labels = {date: label for label, date in comparison_dates.items()}
+    prices = df[df['pull_date'].isin(list(date_labels))]
+    prices = prices.assign(label=prices['pull_date'].map(date_labels)) \
+        .drop_duplicates(subset=['id', 'label'], keep='first') \
+        .pivot(index='id', columns='label', values='usd') \
+        .reindex(index=cards.index, columns=list(comparison_dates))
+
+    return movers_output(cards, prices, today)
+
+def movers_output(cards, prices, today):
+    """
+    The final CSV frame from static fields and a price per comparison date, both indexed
+    by id in id order
+    """
+    import pandas as pd
+
+    # Only keep cards where today's price is at least 1
+    keep = prices['today_price'] >= 1
+    cards = cards[keep]
+    prices = prices[keep]
+
+    tcgplayer_id = cards['tcgplayer_id'].dropna().astype('float64').astype('int64').astype(str)
+
+    result_df = pd.DataFrame({
+        'id': cards.index,
+        'tcgplayer_id': ('https://www.tcgplayer.com/product/' + tcgplayer_id).reindex(cards.index).values,
+        'name': cards['name'].values,
+        'set_name': cards['set_name'].values,
+        'set_type': cards['set_type'].values,
+        'rarity': cards['rarity'].values,
+        'released_at': cards['released_at'].dt.date.values,
+        'today_price': prices['today_price'].values,
+        'today_price_date': today.date(),
+        '1wk_ago_price': prices['1wk_ago_price'].values,
+        '2wk_ago_price': prices['2wk_ago_price'].values,
+        '4wk_ago_price': prices['4wk_ago_price'].values
+    })
 
-        # Get the prices on today, one week ago, two weeks ago, and four weeks ago
-        today_price_data = group.loc[group['pull_date'] == today, ['usd', 'pull_date']].values
-        one_week_ago_price = group.loc[group['pull_date'] == one_week_ago, 'usd'].values
-        two_weeks_ago_price = group.loc[group['pull_date'] == two_weeks_ago, 'usd'].values
-        four_weeks_ago_price = group.loc[group['pull_date'] == four_weeks_ago, 'usd'].values
-
-        # Assign today's price and handle missing values
-        if len(today_price_data) > 0:
-            row['today_price'] = today_price_data[0][0]
-            row['today_price_date'] = today_price_data[0][1].date()
-        else:
-            row['today_price'] = None
-            row['today_price_date'] = None
-
-        row['1wk_ago_price'] = one_week_ago_price[0] if len(one_week_ago_price) > 0 else None
-        row['2wk_ago_price'] = two_weeks_ago_price[0] if len(two_weeks_ago_price) > 0 else None
-        row['4wk_ago_price'] = four_weeks_ago_price[0] if len(four_weeks_ago_price) > 0 else None
-
-        # Calculate price differences (today's price / price from previous periods)
-        if row['1wk_ago_price'] and row['today_price']:
-            row['1wk_diff'] = round(row['today_price'] / row['1wk_ago_price'], 4)
-        else:
-            row['1wk_diff'] = None
-
-        if row['2wk_ago_price'] and row['today_price']:
-            row['2wk_diff'] = round(row['today_price'] / row['2wk_ago_price'], 4)
-        else:
-            row['2wk_diff'] = None
-
-        if row['4wk_ago_price'] and row['today_price']:
-            row['4wk_diff'] = round(row['today_price'] / row['4wk_ago_price'], 4)
-        else:
-            row['4wk_diff'] = None
-
-        # Only append rows where today's price is at least 1
-        if row['today_price'] is not None and row['today_price'] >= 1:
-            results.append(row)
-
-    # Convert results to a DataFrame
-    result_df = pd.DataFrame(results)
+    # Calculate price differences (today's price / price from previous periods)
+    # A missing or zero price leaves the ratio empty
+    for period in ['1wk', '2wk', '4wk']:
+        previous_price = result_df[f'{period}_ago_price']
+        valid = previous_price.notna() & (previous_price != 0)
+        ratio = (result_df['today_price'] / previous_price).where(valid)
+        result_df[f'{period}_diff'] = round_ratios(ratio.to_numpy())
 
     # Sort by the highest 4-week difference, descending
     result_df = result_df.sort_values(by='4wk_diff', ascending=False).reset_index(drop=True)
 
     return result_df
+
+def upload_csv(df, bucket, key, compress=False):
+    """
+    Write df's OUTPUT_COLUMNS as CSV to a temporary file, which pandas does in chunks, and
+    upload it from disk. Returns the bytes uploaded.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'output.csv.gz' if compress else 'output.csv')
+        # A fixed mtime keeps the gzip bytes identical for identical data
+        df.to_csv(path, columns=OUTPUT_COLUMNS, index=False,
+                  compression={'method': 'gzip', 'mtime': 0} if compress else None)
+        s3.upload_file(path, bucket, key, ExtraArgs={'ContentType': 'application/gzip' if compress else 'text/csv'})
+        return os.path.getsize(path)
+
+def feeds_prefix(final_output_key):
+    return posixpath.join(posixpath.dirname(final_output_key), 'feeds') + '/'
+
+def feed_rows(df, columns):
+    """JSON-ready records, with missing values as null and dates as ISO strings"""
+    rows = df[columns].astype(object)
+    rows = rows.where(rows.notna(), None)
+    return [{name: value.isoformat() if hasattr(value, 'isoformat') else value for name, value in row.items()}
+            for row in rows.to_dict('records')]
+
+def build_feeds(df, run_date, size=FEED_SIZE):
+    """
+    {key under feeds/: document} with the top and bottom `size` movers per window, overall and per FEED_SEGMENTS value
+    """
+    # index.json lists the documents, and each one holds its biggest moves first
+    segments = [('all', {}, df)]
+    for column in FEED_SEGMENTS:
+        for value, group in df.groupby(column, sort=True):
+            segments.append((f"{column}={quote(str(value), safe='')}", {column: value}, group))
+
+    documents = {}
+    for window in FEED_WINDOWS:
+        diff = f"{window}_diff"
+        columns = FEED_COLUMNS + [f"{window}_ago_price", diff]
+        for name, segment, group in segments:
+            ranked = group[group[diff].notna()].sort_values(diff, ascending=False, kind='stable')
+            documents[f"{window}/{name}.json"] = {
+                'date': run_date,
+                'window': window,
+                'segment': segment,
+                'cards': len(ranked),
+                'top': feed_rows(ranked.head(size), columns),
+                'bottom': feed_rows(ranked.tail(size).iloc[::-1], columns)
+            }
+
+    documents['index.json'] = {
+        'date': run_date,
+        'size': size,
+        'windows': FEED_WINDOWS,
+        'segments': FEED_SEGMENTS,
+        'documents': sorted(documents)
+    }
+    return documents
+
+def publish_feeds(bucket, prefix, documents):
+    """Upload the feed documents concurrently. Returns the bytes written."""
+    def put(item):
+        key, document = item
+        body = json.dumps(document, separators=(',', ':')).encode('utf-8')
+        s3.put_object(Bucket=bucket, Key=prefix + key, Body=body, ContentType='application/json')
+        return len(body)
+
+    with ThreadPoolExecutor(max_workers=FEED_WORKERS) as executor:
+        return sum(executor.map(put, documents.items()))
@@ -0,0 +1,127 @@
+import json
+from datetime import datetime, timedelta
+from athena_runner import fetch_rows, run_queries, run_query, summarize
+from mtg_runtime import LazyClient, get_multiple_parameters
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+athena = LazyClient('athena')
+sns_client = LazyClient('sns')
+
+TABLE = 'mtg_prices_iceberg'
+
+# measure_table values reported as metrics after maintenance, with their units
+LAYOUT_METRICS = {
+    'data_files': 'Count',
+    'data_bytes': 'Bytes',
+    'manifests': 'Count',
+    'snapshots': 'Count',
+    'probe_planning_ms': 'Milliseconds',
+    'probe_scanned_bytes': 'Bytes'
+}
+
+@profiled('iceberg_maintenance')
+def lambda_handler(event, context):
+    """
+    Compact, expire snapshots and remove orphan files for mtg_prices_iceberg, measuring the table before and after.
+    Pass {'optimize_days': N} to compact only the last N days of partitions.
+    """
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket',
+        '/mtg/sns/status_topic_arn'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+    status_topic_arn = params['/mtg/sns/status_topic_arn']
+
+    s3_output = f's3://{primary_bucket}/athena_out/'
+    optimize_days = event.get('optimize_days') if isinstance(event, dict) else None
+
+    print("Measuring table layout before maintenance...")
+    before = measure_table(s3_output)
+
+    results = {}
+
+    # Bin-pack small files from the daily loads into write_target_data_file_size_bytes files,
+    # as set on the table in create_mtg_prices_iceberg.sql.
+    # Rewriting the data files also rewrites the manifests that track them.
+    optimize_query = f"OPTIMIZE {TABLE} REWRITE DATA USING BIN_PACK"
+    if optimize_days:
+        since = (datetime.now() - timedelta(days=int(optimize_days))).strftime('%Y-%m-%d')
+        optimize_query += f" WHERE pull_date >= DATE '{since}'"
+    print("Compacting data files...")
+    results['optimize'] = run_query(athena, optimize_query, s3_output)
+
+    # Expire snapshots past the table's vacuum_* retention and remove files nothing references
+    print("Expiring old snapshots...")
+    results['vacuum'] = run_query(athena, f"VACUUM {TABLE}", s3_output)
+
+    print("Measuring table layout after maintenance...")
+    after = measure_table(s3_output)
+
+    metrics = StageMetrics('iceberg_maintenance', datetime.now().strftime('%Y-%m-%d'))
+    for name, result in results.items():
+        metrics.add_athena(name, result)
+    for metric, unit in LAYOUT_METRICS.items():
+        if after.get(metric) is not None:
+            metrics.put(metric, int(after[metric]), unit)
+    metrics.emit()
+
+    # The metrics, how the layout moved, and the reason for any step that didn't succeed
+    notes = [f"  {metric}: {before.get(metric)} -> {after.get(metric)}" for metric in before]
+    notes += [summarize(name, result) for name, result in results.items() if result['state'] != 'SUCCEEDED']
+    email_message = metrics.summary('MTG Iceberg Maintenance', notes)
+
+    message = {
+        'default': 'This is the default message',
+        'email': email_message
+    }
+
+    try:
+        sns_response = sns_client.publish(
+            TopicArn=status_topic_arn,
+            Message=json.dumps(message),
+            MessageStructure='json'
+        )
+        print(f"SNS message sent: {sns_response['MessageId']}")
+    except Exception as e:
+        print(f"Error sending SNS: {str(e)}")
+
+    failed = [name for name, result in results.items() if result['state'] != 'SUCCEEDED']
+    return {
+        'statusCode': 500 if failed else 200,
+        'message': f"Maintenance failed for {failed}" if failed else 'Iceberg maintenance complete',
+        'before': before,
+        'after': after
+    }
+
+def measure_table(s3_output):
+    """
+    File, manifest and snapshot counts from the Iceberg metadata tables, plus the planning
+    time, engine time and bytes scanned of a probe shaped like query_athena's 4-date read.
+    """
+    today = datetime.now()
+    probe_dates = ", ".join(
+        f"DATE '{(today - timedelta(days=offset)).strftime('%Y-%m-%d')}'" for offset in (0, 7, 14, 28)
+    )
+    queries = {
+        'files': f'SELECT count(*) AS data_files, sum(file_size_in_bytes) AS data_bytes FROM "{TABLE}$files"',
+        'manifests': f'SELECT count(*) AS manifests FROM "{TABLE}$manifests"',
+        'snapshots': f'SELECT count(*) AS snapshots FROM "{TABLE}$snapshots"',
+        'probe': f"SELECT count(*) AS probe_rows, sum(usd) AS probe_usd FROM {TABLE} WHERE pull_date IN ({probe_dates})"
+    }
+    results = run_queries(athena, queries, s3_output)
+
+    metrics = {}
+    for name in ['files', 'manifests', 'snapshots']:
+        rows = fetch_rows(athena, results[name])
+        if rows:
+            metrics.update(rows[0])
+
+    statistics = results['probe']['statistics']
+    metrics['probe_planning_ms'] = statistics.get('QueryPlanningTimeInMillis')
+    metrics['probe_engine_ms'] = statistics.get('EngineExecutionTimeInMillis')
+    metrics['probe_scanned_bytes'] = statistics.get('DataScannedInBytes')
+
+    print(f"Table metrics: {json.dumps(metrics)}")
+    return metrics
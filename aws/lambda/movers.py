@@ -0,0 +1,152 @@
+"""Rolling-window price movers, maintained one day at a time from a usd price vector per day"""
+import io
+import json
+from datetime import datetime, timedelta
+from mtg_runtime import LazyClient, format_dates, get_dates, get_multiple_parameters, read_parquet_prefix, round_ratios
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+s3 = LazyClient('s3')
+
+# state/usd_YYYYMMDD.f8 holds one float64 vector per retained day, indexed by card_key with
+# NaN where a card has no non-zero price. year=/month=/day=/movers.parquet is the day's
+# table: each card priced today with its static fields, usd, and usd_{w}d_ago and
+# change_{w}d per window. final_processing's 'movers' handoff needs windows 7, 14 and 28.
+MOVERS_PREFIX = 'mtg_movers/'
+STATE_PREFIX = f"{MOVERS_PREFIX}state/"
+DEFAULT_WINDOWS = [1, 7, 14, 28, 90, 365]
+
+STATIC_COLUMNS = ['card_key', 'id', 'tcgplayer_id', 'name', 'set_name', 'set_type', 'rarity', 'released_at']
+
+@profiled('movers')
+def lambda_handler(event, context):
+    """Pass {'windows': [...]} to override DEFAULT_WINDOWS"""
+    dates_dict = get_dates(event)
+    metrics = StageMetrics('movers', dates_dict['formatted_date'])
+
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+
+    windows = sorted(set(event.get('windows', DEFAULT_WINDOWS) if isinstance(event, dict) else DEFAULT_WINDOWS))
+    row_count = update_movers(primary_bucket, dates_dict, windows, metrics)
+    metrics.put('RowsOut', row_count)
+    metrics.emit()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Movers for {dates_dict['formatted_date']} cover {row_count} cards over windows {windows}")
+    }
+
+def partition_path(dates_dict):
+    return f"year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+
+def state_key(dates_dict):
+    return f"{STATE_PREFIX}usd_{dates_dict['short_date']}.f8"
+
+def daily_vector(bucket, dates_dict):
+    """The day's usd prices by card_key from mtg_parquet, or None when the partition doesn't exist"""
+    import numpy as np
+
+    prefix = f"mtg_parquet/{partition_path(dates_dict)}/"
+    if not s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1).get('KeyCount'):
+        return None
+
+    prices = read_parquet_prefix(bucket, prefix, ['card_key', 'usd'])
+    keys = prices.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+    usd = prices.column('usd').to_numpy(zero_copy_only=False).astype('<f8')
+
+    vector = np.full(int(keys.max()) + 1 if len(keys) else 0, np.nan, dtype='<f8')
+    # Zero means unpriced, as in query_athena's usd <> 0
+    vector[keys] = np.where(usd == 0, np.nan, usd)
+    return vector
+
+def load_vector(bucket, dates_dict, metrics):
+    """A retained day's vector, deriving and storing it from mtg_parquet when it isn't kept yet"""
+    import numpy as np
+
+    try:
+        body = s3.get_object(Bucket=bucket, Key=state_key(dates_dict))['Body'].read()
+        metrics.add('StateDaysRead', 1)
+        metrics.add('StateBytesRead', len(body), 'Bytes')
+        return np.frombuffer(body, dtype='<f8')
+    except s3.exceptions.NoSuchKey:
+        pass
+
+    vector = daily_vector(bucket, dates_dict)
+    if vector is not None:
+        s3.put_object(Bucket=bucket, Key=state_key(dates_dict), Body=vector.tobytes())
+        metrics.add('StateDaysDerived', 1)
+    return vector
+
+def retire_state(bucket, run_date, longest_window):
+    """Delete vectors no window can reach any more. Returns how many were removed."""
+    # Retention follows the newest day kept, so rerunning an old day doesn't drop recent state
+    name_start = len(f"{STATE_PREFIX}usd_")
+    kept = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{STATE_PREFIX}usd_"):
+        for obj in page.get('Contents', []):
+            kept[obj['Key']] = obj['Key'][name_start:].split('.')[0]
+
+    newest = max([run_date.strftime('%Y%m%d')] + list(kept.values()))
+    oldest_kept = (datetime.strptime(newest, '%Y%m%d') - timedelta(days=longest_window)).strftime('%Y%m%d')
+    retired = [{'Key': key} for key, short_date in kept.items() if short_date < oldest_kept]
+
+    for start in range(0, len(retired), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': retired[start:start + 1000]})
+    return len(retired)
+
+def update_movers(bucket, dates_dict, windows, metrics):
+    """Store the day's vector, write its movers table and retire old vectors. Returns the rows written."""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    today = daily_vector(bucket, dates_dict)
+    if today is None:
+        raise Exception(f"No mtg_parquet partition for {dates_dict['formatted_date']}")
+    s3.put_object(Bucket=bucket, Key=state_key(dates_dict), Body=today.tobytes())
+
+    run_date = datetime.strptime(dates_dict['formatted_date'], '%Y-%m-%d')
+    window_vectors = {}
+    for window in windows:
+        vector = load_vector(bucket, format_dates(run_date - timedelta(days=window)), metrics)
+        # Cards newer than the old day's keys, or a day with no data at all, have no price
+        padded = np.full(len(today), np.nan, dtype='<f8')
+        if vector is not None:
+            padded[:min(len(vector), len(today))] = vector[:len(today)]
+        window_vectors[window] = padded
+
+    # Static fields for every card priced today, one row per card
+    static = read_parquet_prefix(bucket, f"mtg_static_parquet/{partition_path(dates_dict)}/", STATIC_COLUMNS)
+    keys = static.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+    in_range = keys < len(today)
+    priced = np.zeros(len(keys), dtype=bool)
+    priced[in_range] = ~np.isnan(today[keys[in_range]])
+    static = static.filter(pa.array(priced))
+    keys = keys[priced]
+
+    usd = today[keys]
+    columns = {name: static.column(name) for name in STATIC_COLUMNS}
+    columns['usd'] = pa.array(usd)
+    for window, vector in window_vectors.items():
+        previous = vector[keys]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = round_ratios(usd / previous)
+        columns[f"usd_{window}d_ago"] = pa.array(previous, from_pandas=True)
+        columns[f"change_{window}d"] = pa.array(change, from_pandas=True)
+    columns['pull_date'] = pa.array([dates_dict['formatted_date']] * len(keys), pa.string())
+    table = pa.table(columns)
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='snappy')
+    s3.put_object(Bucket=bucket, Key=f"{MOVERS_PREFIX}{partition_path(dates_dict)}/movers.parquet", Body=buffer.getvalue())
+    metrics.put('BytesWritten', buffer.tell(), 'Bytes')
+
+    metrics.put('StateDaysRetired', retire_state(bucket, run_date, max(windows)))
+
+    print(f"Wrote {table.num_rows} movers for {dates_dict['formatted_date']} over windows {windows}")
+    return table.num_rows
@@ -0,0 +1,187 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+# How long SSM parameters are reused across warm invocations before being fetched again
+PARAMETER_TTL_SECONDS = 300
+
+# Last Scryfall snapshot data_pull ingested, kept outside mtg_temp_json/ so the raw JSON
+# lifecycle rule doesn't remove it. 'pending' until athena_add_partitions_all loads its day.
+SNAPSHOT_MANIFEST_KEY = 'mtg_manifest/default_cards.json'
+
+_clients = {}
+_parameter_cache = {}
+
+def get_client(service_name, **kwargs):
+    """
+    Return a boto3 client for service_name, creating it on first use.
+    boto3 itself is only imported the first time any client is needed.
+    """
+    key = (service_name, tuple(sorted(kwargs.items())))
+    if key not in _clients:
+        import boto3
+        _clients[key] = boto3.client(service_name, **kwargs)
+    return _clients[key]
+
+class LazyClient:
+    """
+    Stand-in for a module-level boto3 client that builds the real client on first
+    attribute access, so importing a handler doesn't pay for client creation.
+    """
+    def __init__(self, service_name, **kwargs):
+        self._service_name = service_name
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service_name, **self._kwargs), name)
+
+def get_dates(event=None):
+    """
+    Date parts for the day being processed. Defaults to today; pass {'date': 'YYYY-MM-DD'}
+    in the event to reprocess a historical day.
+    """
+    date = event.get('date') if isinstance(event, dict) else None
+    current_date = datetime.strptime(date, '%Y-%m-%d') if date else datetime.now()
+    return format_dates(current_date)
+
+def get_date_range(event=None):
+    """
+    Every day an event asks for, oldest first. Accepts {'dates': [...]},
+    {'start_date': ..., 'end_date': ...} (inclusive), or anything get_dates accepts.
+    """
+    if isinstance(event, dict) and event.get('dates'):
+        return [format_dates(datetime.strptime(date, '%Y-%m-%d')) for date in sorted(event['dates'])]
+
+    if isinstance(event, dict) and event.get('start_date'):
+        start_date = datetime.strptime(event['start_date'], '%Y-%m-%d')
+        end_date = datetime.strptime(event.get('end_date', event['start_date']), '%Y-%m-%d')
+        return [format_dates(start_date + timedelta(days=offset)) for offset in range((end_date - start_date).days + 1)]
+
+    return [get_dates(event)]
+
+def format_dates(current_date):
+    return {
+        'year': current_date.strftime('%Y'),
+        'month': current_date.strftime('%m'),
+        'day': current_date.strftime('%d'),
+        'short_date': current_date.strftime('%Y%m%d'),
+        'formatted_date': current_date.strftime('%Y-%m-%d')
+    }
+
+def get_multiple_parameters(parameter_names, ttl=PARAMETER_TTL_SECONDS):
+    """
+    Return {name: value} for the given SSM parameters, cached for ttl seconds across warm invocations
+    """
+    # Only missing or expired names are fetched, in a single get_parameters call
+    now = time.monotonic()
+    stale = [name for name in parameter_names
+             if name not in _parameter_cache or now - _parameter_cache[name][1] > ttl]
+
+    if stale:
+        try:
+            response = get_client('ssm').get_parameters(
+                Names=stale,
+                WithDecryption=True
+            )
+
+            # Check for missing parameters
+            if response.get('InvalidParameters'):
+                raise Exception(f"Missing parameters: {response['InvalidParameters']}")
+
+            for param in response['Parameters']:
+                _parameter_cache[param['Name']] = (param['Value'], now)
+        except Exception as e:
+            print(f"Error getting parameters: {e}")
+            raise
+
+    return {name: _parameter_cache[name][0] for name in parameter_names}
+
+def clear_prefix(bucket, prefix):
+    """Delete every object under prefix"""
+    s3 = get_client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': objects})
+
+def commit_snapshot(bucket, formatted_dates):
+    """Mark data_pull's pending manifest committed if its pull_date is one of the days just loaded"""
+    s3 = get_client('s3')
+    try:
+        response = s3.get_object(Bucket=bucket, Key=SNAPSHOT_MANIFEST_KEY)
+    except s3.exceptions.NoSuchKey:
+        return False
+    manifest = json.loads(response['Body'].read())
+    if manifest.get('status') != 'pending' or manifest.get('pull_date') not in formatted_dates:
+        return False
+
+    manifest['status'] = 'committed'
+    # A newer snapshot written by data_pull meanwhile stays pending
+    s3.put_object(Bucket=bucket, Key=SNAPSHOT_MANIFEST_KEY, Body=json.dumps(manifest, indent=2),
+                  IfMatch=response['ETag'])
+    print(f"Snapshot manifest for {manifest['pull_date']} committed")
+    return True
+
+def register_partitions(database, table, bucket, data_folder, dates_list):
+    """
+    Register year/month/day partitions for many days with Glue's batch API, skipping existing ones.
+    Returns the number of partitions created.
+    """
+    glue = get_client('glue')
+    storage_descriptor = glue.get_table(DatabaseName=database, Name=table)['Table']['StorageDescriptor']
+
+    created = 0
+    # batch_create_partition takes up to 100 partitions per call
+    for start in range(0, len(dates_list), 100):
+        batch = dates_list[start:start + 100]
+        partitions = []
+        for dates_dict in batch:
+            location = f"s3://{bucket}/{data_folder}/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}/"
+            partitions.append({
+                'Values': [dates_dict['year'], dates_dict['month'], dates_dict['day']],
+                'StorageDescriptor': dict(storage_descriptor, Location=location)
+            })
+
+        response = glue.batch_create_partition(DatabaseName=database, TableName=table, PartitionInputList=partitions)
+        errors = [error for error in response.get('Errors', [])
+                  if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException']
+        if errors:
+            raise Exception(f"Error registering partitions on {table}: {errors}")
+        created += len(batch) - len(response.get('Errors', []))
+
+    print(f"Registered {created} new partitions on {database}.{table}")
+    return created
+
+def read_parquet_prefix(bucket, prefix, columns=None):
+    """
+    Read every Parquet file under an S3 prefix into a pyarrow Table. Only the requested
+    columns' chunks are fetched, with ranged reads through pyarrow's S3FileSystem.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    # Honour the same endpoint override boto3 does, e.g. a local S3 stand-in
+    endpoint = os.environ.get('AWS_ENDPOINT_URL_S3') or os.environ.get('AWS_ENDPOINT_URL')
+    s3_fs = fs.S3FileSystem(region=get_client('s3').meta.region_name, endpoint_override=endpoint)
+    dataset = ds.dataset(f"{bucket}/{prefix}", format='parquet', filesystem=s3_fs)
+    return dataset.to_table(columns=columns)
+
+def round_ratios(values, digits=4):
+    """
+    Round a float array as Python's round(value, digits) does, keeping NaN
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype='float64')
+    # numpy multiplies by 10**digits first, and that product can land on the other side of a
+    # tie (13.27 / 8 is 1.6587 in Python but 1.6588 in numpy), so near-ties are redone one by one
+    rounded = np.round(values, digits)
+    scaled = values * 10.0 ** digits
+    # Far wider than the product's rounding error, so every possible disagreement is caught
+    with np.errstate(invalid='ignore'):
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 1e-9 * np.maximum(1.0, np.abs(scaled))
+    near_tie &= np.isfinite(values)
+    rounded[near_tie] = [round(value, digits) for value in values[near_tie].tolist()]
+    return rounded
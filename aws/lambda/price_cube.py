@@ -0,0 +1,232 @@
+"""Dense card x day float32 price cube per field under mtg_price_cube/, one row per day and one column per card_key"""
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from card_keys import load_card_keys
+from mtg_runtime import LazyClient, get_dates, get_multiple_parameters, read_parquet_prefix
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+s3 = LazyClient('s3')
+
+# meta.json names each field's live <field>-<generation>.f32, num_days x card_capacity
+# little-endian float32 with NaN for missing prices. Field files are never modified in
+# place: a run writes new ones and commits by replacing meta.json last.
+CUBE_PREFIX = 'mtg_price_cube'
+FIELDS = ['usd', 'usd_foil']
+
+# Card axis grows in steps so a handful of new printings doesn't force a rewrite
+CAPACITY_STEP = 4096
+CAPACITY_HEADROOM = 1.1
+
+# S3 multipart copy needs every part but the last to be at least 5MB
+MIN_COPY_PART_BYTES = 5 * 1024 * 1024
+
+@profiled('price_cube')
+def lambda_handler(event, context):
+    dates_dict = get_dates(event)
+
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+
+    metrics = StageMetrics('price_cube', dates_dict['formatted_date'])
+    meta = update_cube(primary_bucket, dates_dict)
+    metrics.put('CubeDays', meta['num_days'])
+    metrics.put('CardCapacity', meta['card_capacity'])
+    metrics.emit()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Price cube holds {meta['num_days']} days x {meta['card_capacity']} cards")
+    }
+
+def update_cube(bucket, dates_dict):
+    """Append the day's row to each field, or rewrite the fields for an earlier day or a larger card capacity"""
+    import numpy as np
+
+    daily_prefix = f"mtg_parquet/year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    prices = read_parquet_prefix(bucket, daily_prefix, ['card_key'] + FIELDS)
+    keys = prices.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+
+    meta, etag = load_meta(bucket)
+    meta = meta or {
+        'start_date': dates_dict['formatted_date'],
+        'num_days': 0,
+        'card_capacity': 0,
+        'fields': FIELDS
+    }
+    start_date = datetime.strptime(meta['start_date'], '%Y-%m-%d')
+    day_index = (datetime.strptime(dates_dict['formatted_date'], '%Y-%m-%d') - start_date).days
+    if day_index < 0:
+        raise Exception(f"{dates_dict['formatted_date']} is before the cube start {meta['start_date']}")
+
+    # Cubes written before meta.json named its files kept one fixed key per field
+    files = meta.get('files') or {field: f"{CUBE_PREFIX}/{field}.f32" for field in FIELDS}
+    generation = f"{dates_dict['short_date']}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+    new_files = {}
+
+    capacity = meta['card_capacity']
+    key_count = int(keys.max()) + 1 if len(keys) else 0
+    if key_count > capacity:
+        capacity = int(np.ceil(key_count * CAPACITY_HEADROOM / CAPACITY_STEP)) * CAPACITY_STEP
+
+    try:
+        for field in FIELDS:
+            row = np.full(capacity, np.nan, dtype='<f4')
+            row[keys] = prices.column(field).to_numpy(zero_copy_only=False).astype('<f4')
+            field_key = f"{CUBE_PREFIX}/{field}-{generation}.f32"
+
+            if capacity == meta['card_capacity'] and day_index >= meta['num_days']:
+                # Pad any missed days with NaN rows, then append today's row
+                gap = np.full((day_index - meta['num_days'], capacity), np.nan, dtype='<f4')
+                append_object(bucket, files[field], field_key, gap.tobytes() + row.tobytes(),
+                              meta['num_days'] * capacity * 4)
+            else:
+                rewrite_field(bucket, files[field], field_key, meta, capacity, day_index, row)
+            new_files[field] = field_key
+
+        meta['num_days'] = max(meta['num_days'], day_index + 1)
+        meta['card_capacity'] = capacity
+        meta['files'] = new_files
+        # meta.json goes last, and only over the version this run started from
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        s3.put_object(Bucket=bucket, Key=f"{CUBE_PREFIX}/meta.json", Body=json.dumps(meta, indent=2), **condition)
+    except Exception as e:
+        # Nothing references this run's files; a lost race leaves the other run's cube intact
+        delete_files(bucket, new_files.values())
+        if isinstance(e, s3.exceptions.ClientError) and \
+                e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise Exception(f"{CUBE_PREFIX}/meta.json changed while writing {dates_dict['formatted_date']}, rerun the day") from e
+        raise
+
+    # Only the files this run replaced; any others belong to another run
+    delete_files(bucket, [key for field, key in files.items() if key != new_files[field]])
+    print(f"Wrote {prices.num_rows} prices for {dates_dict['formatted_date']} as cube day {day_index}")
+    return meta
+
+def append_object(bucket, source_key, key, data, size):
+    """Write the first size bytes of source_key followed by data to key, copying the source server side"""
+    # Bytes past size, such as a row appended by a run that never committed, are dropped
+    if size:
+        try:
+            source_size = s3.head_object(Bucket=bucket, Key=source_key)['ContentLength']
+        except s3.exceptions.ClientError:
+            source_size = 0
+        if source_size < size:
+            raise Exception(f"{source_key} is {source_size} bytes but the cube metadata expects {size}")
+
+    if size < MIN_COPY_PART_BYTES:
+        existing = s3.get_object(Bucket=bucket, Key=source_key, Range=f"bytes=0-{size - 1}")['Body'].read() if size else b''
+        s3.put_object(Bucket=bucket, Key=key, Body=existing + data)
+        return
+
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+    try:
+        copied = s3.upload_part_copy(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=1,
+            CopySource={'Bucket': bucket, 'Key': source_key},
+            CopySourceRange=f"bytes=0-{size - 1}"
+        )
+        appended = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=2, Body=data)
+        s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': 1, 'ETag': copied['CopyPartResult']['ETag']},
+                {'PartNumber': 2, 'ETag': appended['ETag']}
+            ]}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+def rewrite_field(bucket, source_key, key, meta, capacity, day_index, row):
+    """Write source_key's committed days to key with a new card capacity and/or a replaced day row"""
+    import numpy as np
+
+    num_days = max(meta['num_days'], day_index + 1)
+    cube = np.full((num_days, capacity), np.nan, dtype='<f4')
+    if meta['num_days']:
+        size = meta['num_days'] * meta['card_capacity'] * 4
+        data = s3.get_object(Bucket=bucket, Key=source_key, Range=f"bytes=0-{size - 1}")['Body'].read()
+        if len(data) < size:
+            raise Exception(f"{source_key} is {len(data)} bytes but the cube metadata expects {size}")
+        cube[:meta['num_days'], :meta['card_capacity']] = np.frombuffer(data, dtype='<f4').reshape(meta['num_days'], -1)
+    cube[day_index] = row
+    s3.put_object(Bucket=bucket, Key=key, Body=cube.tobytes())
+
+def delete_files(bucket, keys):
+    keys = list(keys)
+    if keys:
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys]})
+
+def load_meta(bucket):
+    """(meta.json, its ETag), or (None, None) before the first update"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"{CUBE_PREFIX}/meta.json")
+        return json.loads(response['Body'].read()), response['ETag']
+    except s3.exceptions.NoSuchKey:
+        return None, None
+
+def download_cube(bucket, local_dir):
+    """Copy the cube, its metadata and the card key dictionary to local_dir for PriceCube"""
+    os.makedirs(local_dir, exist_ok=True)
+    meta, _ = load_meta(bucket)
+    with open(os.path.join(local_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    files = meta.get('files') or {field: f"{CUBE_PREFIX}/{field}.f32" for field in FIELDS}
+    for field in FIELDS:
+        s3.download_file(bucket, files[field], os.path.join(local_dir, f"{field}.f32"))
+
+    card_keys = load_card_keys(bucket)
+    with open(os.path.join(local_dir, 'card_keys.json'), 'w') as f:
+        json.dump(card_keys, f)
+
+class PriceCube:
+    """Memory-mapped access to a cube fetched with download_cube, e.g. PriceCube('/data/mtg_price_cube').card(id)"""
+    def __init__(self, local_dir, field='usd'):
+        with open(os.path.join(local_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(local_dir, 'card_keys.json')) as f:
+            self.card_keys = json.load(f)
+
+        import numpy as np
+        self.start_date = datetime.strptime(self.meta['start_date'], '%Y-%m-%d')
+        self.prices = np.memmap(
+            os.path.join(local_dir, f"{field}.f32"),
+            dtype='<f4',
+            mode='r',
+            shape=(self.meta['num_days'], self.meta['card_capacity'])
+        )
+
+    def day_index(self, date):
+        return (datetime.strptime(date, '%Y-%m-%d') - self.start_date).days
+
+    def date_of(self, day_index):
+        return (self.start_date + timedelta(days=day_index)).strftime('%Y-%m-%d')
+
+    def card(self, card_id, start_date=None, end_date=None):
+        """Prices for one card over the date range (inclusive), as a strided view"""
+        return self.date_range(start_date, end_date)[:, self.card_keys[card_id]['card_key']]
+
+    def date_range(self, start_date=None, end_date=None):
+        """Every card's prices for the date range (inclusive), as a contiguous view"""
+        start = self.day_index(start_date) if start_date else 0
+        end = self.day_index(end_date) + 1 if end_date else self.meta['num_days']
+        return self.prices[max(start, 0):end]
+
+    def set_keys(self, set_code):
+        import numpy as np
+        return np.array(sorted(entry['card_key'] for entry in self.card_keys.values() if entry['set'] == set_code),
+                        dtype=np.int64)
+
+    def set_cards(self, set_code, start_date=None, end_date=None):
+        """Prices for every card in a set over the date range, days x cards, gathered into a copy"""
+        return self.date_range(start_date, end_date)[:, self.set_keys(set_code)]
@@ -0,0 +1,388 @@
+"""Per-card price history index on S3: each card's history is one ranged GET of a bucket file, plus a cached tail"""
+import csv
+import gzip
+import io
+import json
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from athena_runner import run_query
+from mtg_runtime import LazyClient, clear_prefix, get_dates, get_multiple_parameters, read_parquet_prefix
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
+
+s3 = LazyClient('s3')
+athena = LazyClient('athena')
+
+# CURRENT names the live generation. gen=<id>/ holds manifest.json (each bucket file's
+# generation, the tail's days and the generations published before), directory.csv.gz
+# (id,bucket,offset,count,tail_offset,tail_count), tail.bin with the records since the last
+# compaction, and the bucket-NNN.bin files it rewrote. Records are packed little-endian
+# (day int32, usd float32, usd_foil float32), grouped by id; a card's bucket is crc32(id).
+INDEX_PREFIX = 'mtg_price_history'
+NUM_BUCKETS = 256
+RECORD_BYTES = 12
+EPOCH = date(1970, 1, 1)
+
+# The tail is folded into the bucket files once it holds this many days
+COMPACT_AFTER_DAYS = 7
+# Previously published generations kept for readers still holding their directory
+KEEP_GENERATIONS = 2
+MAX_CONCURRENCY = 16
+
+@profiled('price_history')
+def lambda_handler(event, context):
+    """Add a day's prices to the index; 'rebuild' rebuilds it from mtg_prices_iceberg and 'compact' folds the tail now"""
+    dates_dict = get_dates(event)
+
+    param_names = [
+        '/mtg/s3/buckets/primary_bucket'
+    ]
+    params = get_multiple_parameters(param_names)
+    primary_bucket = params['/mtg/s3/buckets/primary_bucket']
+
+    metrics = StageMetrics('price_history', dates_dict['formatted_date'])
+    if isinstance(event, dict) and event.get('rebuild'):
+        generation, card_count, buckets_written = rebuild_index(primary_bucket, dates_dict)
+    else:
+        compact = isinstance(event, dict) and event.get('compact', False)
+        generation, card_count, buckets_written = update_index(primary_bucket, dates_dict, compact)
+    metrics.put('CardsIndexed', card_count)
+    metrics.put('BucketsWritten', buckets_written)
+    metrics.emit()
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Price history index generation {generation} covers {card_count} cards, "
+                           f"{buckets_written} bucket files rewritten")
+    }
+
+def bucket_for(card_id):
+    """Same value as Athena's mod(crc32(to_utf8(id)), NUM_BUCKETS)"""
+    return zlib.crc32(card_id.encode('utf-8')) % NUM_BUCKETS
+
+def record_dtype():
+    import numpy as np
+    return np.dtype([('day', '<i4'), ('usd', '<f4'), ('usd_foil', '<f4')])
+
+def new_generation(dates_dict):
+    """The day's date plus the run's UTC timestamp, unique per run and ordered by run time"""
+    return f"{dates_dict['short_date']}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+
+def built_at(generation):
+    return generation.split('-', 1)[1]
+
+def merge_records(history, records):
+    """history with records added, replacing any record for the same day, in day order"""
+    import numpy as np
+    kept = history[~np.isin(history['day'], records['day'])]
+    return np.sort(np.concatenate([kept, records]), order='day')
+
+def group_by_id(ids):
+    """{id: (start, count)} for ids sorted so that each id's rows are contiguous"""
+    import numpy as np
+    unique_ids, starts, counts = np.unique(ids, return_index=True, return_counts=True)
+    return dict(zip(unique_ids.tolist(), zip(starts.tolist(), counts.tolist())))
+
+def update_index(bucket, dates_dict, compact=False):
+    """Merge one day's mtg_parquet prices into a new generation. Returns (generation, cards indexed, buckets written)."""
+    # Reads only the previous directory and tail, and when compacting the buckets the tail touches
+    import numpy as np
+
+    partition = f"year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    table = read_parquet_prefix(bucket, f"mtg_parquet/{partition}", ['card_key', 'usd', 'usd_foil'])
+
+    # Prices only carry card_key; the same day's static snapshot maps it back to the id
+    static = read_parquet_prefix(bucket, f"mtg_static_parquet/{partition}", ['id', 'card_key'])
+    static_keys = static.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)
+    ids_by_key = np.empty(int(static_keys.max()) + 1 if len(static_keys) else 0, dtype='U36')
+    ids_by_key[static_keys] = static.column('id').to_numpy(zero_copy_only=False)
+
+    day = (datetime.strptime(dates_dict['formatted_date'], '%Y-%m-%d').date() - EPOCH).days
+    todays_ids = ids_by_key[table.column('card_key').to_numpy(zero_copy_only=False).astype(np.int64)]
+    todays_records = np.empty(table.num_rows, dtype=record_dtype())
+    todays_records['day'] = day
+    for name in ['usd', 'usd_foil']:
+        todays_records[name] = table.column(name).to_numpy(zero_copy_only=False).astype('float32')
+
+    current, etag = load_current(bucket)
+    manifest = load_manifest(bucket, current) if current else empty_manifest()
+    directory = load_directory(bucket, current) if current else {}
+    tail = load_tail(bucket, current) if current else np.empty(0, dtype=record_dtype())
+
+    # The tail as parallel id and record arrays; rerunning a day replaces its records
+    tail_ids = np.empty(len(tail), dtype='U36')
+    for card_id, entry in directory.items():
+        if entry[4]:
+            tail_ids[entry[3]:entry[3] + entry[4]] = card_id
+    kept = tail['day'] != day
+    tail_ids = np.concatenate([tail_ids[kept], todays_ids])
+    tail = np.concatenate([tail[kept], todays_records])
+    order = np.lexsort((tail['day'], tail_ids))
+    tail_ids, tail = tail_ids[order], tail[order]
+
+    tail_days = sorted(set(manifest['tail_days']) | {day})
+    generation = new_generation(dates_dict)
+    buckets = list(manifest['buckets'])
+    bases = {card_id: entry[:3] for card_id, entry in directory.items() if entry[2]}
+
+    if compact or len(tail_days) >= COMPACT_AFTER_DAYS:
+        tails = group_by_id(tail_ids)
+        touched = [{} for _ in range(NUM_BUCKETS)]
+        for card_id, (start, count) in tails.items():
+            touched[bucket_for(card_id)][card_id] = tail[start:start + count]
+        based = [{} for _ in range(NUM_BUCKETS)]
+        for card_id, (bucket_number, offset, count) in bases.items():
+            based[bucket_number][card_id] = (offset, count)
+
+        def compact_bucket(bucket_number):
+            if not touched[bucket_number]:
+                return None
+            existing = np.empty(0, dtype=record_dtype())
+            if buckets[bucket_number]:
+                data = s3.get_object(Bucket=bucket, Key=bucket_key(buckets[bucket_number], bucket_number))['Body'].read()
+                existing = np.frombuffer(data, dtype=record_dtype())
+
+            histories = {card_id: existing[offset:offset + count] for card_id, (offset, count) in based[bucket_number].items()}
+            for card_id, records in touched[bucket_number].items():
+                histories[card_id] = merge_records(histories.get(card_id, np.empty(0, dtype=record_dtype())), records)
+            return write_bucket(bucket, generation, bucket_number, histories)
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            rewritten = list(executor.map(compact_bucket, range(NUM_BUCKETS)))
+
+        for bucket_number, entries in enumerate(rewritten):
+            if entries is not None:
+                buckets[bucket_number] = generation
+                bases.update({card_id: (bucket_number, offset, count) for card_id, offset, count in entries})
+        tail_ids, tail, tail_days = tail_ids[:0], tail[:0], []
+        print(f"Compacted the tail into {sum(entries is not None for entries in rewritten)} bucket files")
+
+    card_count = publish_generation(bucket, generation, current, etag, manifest, buckets, bases, tail_ids, tail,
+                                    tail_days, dates_dict)
+    buckets_written = sum(owner == generation for owner in buckets)
+    print(f"Merged {table.num_rows} prices for {dates_dict['formatted_date']} into generation {generation}")
+    return generation, card_count, buckets_written
+
+def rebuild_index(bucket, dates_dict):
+    """Build a generation from the full Iceberg history. Returns (generation, cards indexed, buckets written)."""
+    import numpy as np
+
+    current, etag = load_current(bucket)
+    manifest = load_manifest(bucket, current) if current else empty_manifest()
+
+    rebuild_prefix = f"{INDEX_PREFIX}/_rebuild/"
+    clear_prefix(bucket, rebuild_prefix)
+    # Partitioned by the index's own crc32 bucket, so each bucket is read and written on its own
+    query = f"""
+    UNLOAD (
+        SELECT
+            keys.id,
+            date_diff('day', DATE '1970-01-01', price.pull_date) AS day,
+            CAST(price.usd AS REAL) AS usd,
+            CAST(price.usd_foil AS REAL) AS usd_foil,
+            mod(crc32(to_utf8(keys.id)), {NUM_BUCKETS}) AS bucket
+        FROM mtg_prices_iceberg AS price
+        INNER JOIN mtg_card_keys AS keys ON price.card_key = keys.card_key
+    )
+    TO 's3://{bucket}/{rebuild_prefix}'
+    WITH (format = 'PARQUET', compression = 'SNAPPY', partitioned_by = ARRAY['bucket'])
+    """
+    result = run_query(athena, query, f"s3://{bucket}/athena_output/")
+    if result['state'] != 'SUCCEEDED':
+        raise Exception(f"History unload {result['state']}: {result['state_change_reason']}")
+
+    generation = new_generation(dates_dict)
+
+    def build_bucket(bucket_number):
+        try:
+            table = read_parquet_prefix(bucket, f"{rebuild_prefix}bucket={bucket_number}", ['id', 'day', 'usd', 'usd_foil']) \
+                .sort_by([('id', 'ascending'), ('day', 'ascending')])
+        except FileNotFoundError:
+            return write_bucket(bucket, generation, bucket_number, {})
+
+        ids = table.column('id').to_numpy(zero_copy_only=False)
+        records = np.empty(table.num_rows, dtype=record_dtype())
+        for name in ['day', 'usd', 'usd_foil']:
+            records[name] = table.column(name).to_numpy(zero_copy_only=False)
+
+        # Rows are sorted by id, so each card's history is one contiguous run
+        histories = {}
+        boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        for start, end in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(ids)]])):
+            histories[ids[start]] = records[start:end]
+
+        return write_bucket(bucket, generation, bucket_number, histories)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        bucket_entries = list(executor.map(build_bucket, range(NUM_BUCKETS)))
+    bases = {card_id: (bucket_number, offset, count)
+             for bucket_number, entries in enumerate(bucket_entries) for card_id, offset, count in entries}
+
+    no_tail = np.empty(0, dtype=record_dtype())
+    card_count = publish_generation(bucket, generation, current, etag, manifest, [generation] * NUM_BUCKETS, bases,
+                                    np.empty(0, dtype='U36'), no_tail, [], dates_dict)
+    clear_prefix(bucket, rebuild_prefix)
+    return generation, card_count, NUM_BUCKETS
+
+def write_bucket(bucket, generation, bucket_number, histories):
+    """Write one bucket file, cards in id order. Returns its (id, offset, count) entries."""
+    import numpy as np
+
+    entries = []
+    chunks = []
+    offset = 0
+    for card_id in sorted(histories):
+        history = histories[card_id]
+        entries.append((card_id, offset, len(history)))
+        chunks.append(history)
+        offset += len(history)
+
+    body = np.concatenate(chunks).tobytes() if chunks else b''
+    s3.put_object(Bucket=bucket, Key=bucket_key(generation, bucket_number), Body=body)
+    return entries
+
+def publish_generation(bucket, generation, current, etag, manifest, buckets, bases, tail_ids, tail, tail_days, dates_dict):
+    """Write the generation, then point CURRENT at it if unchanged since etag was read. Returns the directory's card count."""
+    # tail_ids and tail are sorted by id, then day. Losing the race on CURRENT deletes this
+    # generation and fails, leaving the newer one live.
+    generation_prefix = f"{INDEX_PREFIX}/gen={generation}/"
+    tails = group_by_id(tail_ids)
+    directory_csv = io.StringIO()
+    writer = csv.writer(directory_csv)
+    writer.writerow(['id', 'bucket', 'offset', 'count', 'tail_offset', 'tail_count'])
+    card_ids = sorted(set(bases) | set(tails))
+    for card_id in card_ids:
+        bucket_number, offset, count = bases.get(card_id, (bucket_for(card_id), 0, 0))
+        tail_offset, tail_count = tails.get(card_id, (0, 0))
+        writer.writerow([card_id, bucket_number, offset, count, tail_offset, tail_count])
+
+    s3.put_object(Bucket=bucket, Key=f"{generation_prefix}tail.bin", Body=tail.tobytes())
+    s3.put_object(Bucket=bucket, Key=f"{generation_prefix}directory.csv.gz",
+                  Body=gzip.compress(directory_csv.getvalue().encode('utf-8')))
+    s3.put_object(Bucket=bucket, Key=f"{generation_prefix}manifest.json", Body=json.dumps({
+        'date': dates_dict['formatted_date'],
+        'buckets': buckets,
+        'tail_days': [int(day) for day in tail_days],
+        'previous': ([current] + manifest['previous'])[:KEEP_GENERATIONS] if current else []
+    }))
+
+    # CURRENT goes last, and only over the generation this run started from
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3.put_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/CURRENT", Body=json.dumps({'generation': generation}), **condition)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise
+        clear_prefix(bucket, generation_prefix)
+        raise Exception(f"Another run replaced generation {current} first; rerun to build on top of it")
+
+    delete_old_generations(bucket, generation)
+    return len(card_ids)
+
+def delete_old_generations(bucket, generation):
+    """Delete older generations that neither the live one, the ones kept before it, nor their bucket files need"""
+    # Newer generations may belong to a run still in progress and are left alone
+    retained = [generation] + load_manifest(bucket, generation)['previous']
+    keep = set(retained)
+    for retained_generation in retained:
+        try:
+            keep |= set(load_manifest(bucket, retained_generation)['buckets'])
+        except s3.exceptions.NoSuchKey:
+            # Already gone, so no reader can be pinned to it
+            pass
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=f"{INDEX_PREFIX}/gen=", Delimiter='/')
+    for common_prefix in response.get('CommonPrefixes', []):
+        old_generation = common_prefix['Prefix'].rstrip('/').split('=', 1)[-1]
+        if old_generation not in keep and built_at(old_generation) < built_at(generation):
+            clear_prefix(bucket, common_prefix['Prefix'])
+
+def bucket_key(generation, bucket_number):
+    return f"{INDEX_PREFIX}/gen={generation}/bucket-{bucket_number:03d}.bin"
+
+def empty_manifest():
+    return {'buckets': [None] * NUM_BUCKETS, 'tail_days': [], 'previous': []}
+
+def load_current(bucket):
+    """(generation name of the live index, CURRENT's ETag), or (None, None) before the first build"""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/CURRENT")
+        return json.loads(response['Body'].read())['generation'], response['ETag']
+    except s3.exceptions.NoSuchKey:
+        return None, None
+
+def load_manifest(bucket, generation):
+    response = s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/gen={generation}/manifest.json")
+    return json.loads(response['Body'].read())
+
+def load_directory(bucket, generation):
+    """{id: (bucket, offset, count, tail_offset, tail_count)} for a generation"""
+    response = s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/gen={generation}/directory.csv.gz")
+    reader = csv.DictReader(io.StringIO(gzip.decompress(response['Body'].read()).decode('utf-8')))
+    return {
+        row['id']: (int(row['bucket']), int(row['offset']), int(row['count']), int(row['tail_offset']), int(row['tail_count']))
+        for row in reader
+    }
+
+def load_tail(bucket, generation):
+    import numpy as np
+    response = s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/gen={generation}/tail.bin")
+    return np.frombuffer(response['Body'].read(), dtype=record_dtype())
+
+class PriceHistoryIndex:
+    """Card history lookups, e.g. PriceHistoryIndex('my-bucket').get_card_history(id), rechecking CURRENT every ttl seconds"""
+    def __init__(self, bucket, ttl=300):
+        self.bucket = bucket
+        self.ttl = ttl
+        self._generation = None
+        self._buckets = []
+        self._directory = {}
+        self._tail = None
+        self._checked_at = 0
+
+    def _refresh(self):
+        if time.monotonic() - self._checked_at < self.ttl:
+            return
+        generation, _ = load_current(self.bucket)
+        if generation != self._generation:
+            if generation:
+                self._buckets = load_manifest(self.bucket, generation)['buckets']
+                self._directory = load_directory(self.bucket, generation)
+                self._tail = load_tail(self.bucket, generation)
+            else:
+                self._buckets, self._directory, self._tail = [], {}, None
+            self._generation = generation
+        self._checked_at = time.monotonic()
+
+    def get_card_history(self, card_id):
+        """[{'pull_date', 'usd', 'usd_foil'}, ...] oldest first; empty for unknown ids"""
+        import numpy as np
+
+        self._refresh()
+        if card_id not in self._directory:
+            return []
+
+        bucket_number, offset, count, tail_offset, tail_count = self._directory[card_id]
+        records = np.empty(0, dtype=record_dtype())
+        if count:
+            start = offset * RECORD_BYTES
+            end = start + count * RECORD_BYTES - 1
+            response = s3.get_object(
+                Bucket=self.bucket,
+                Key=bucket_key(self._buckets[bucket_number], bucket_number),
+                Range=f'bytes={start}-{end}'
+            )
+            records = np.frombuffer(response['Body'].read(), dtype=record_dtype())
+        if tail_count:
+            records = merge_records(records, self._tail[tail_offset:tail_offset + tail_count])
+
+        return [
+            {
+                'pull_date': (EPOCH + timedelta(days=int(record['day']))).isoformat(),
+                'usd': None if np.isnan(record['usd']) else round(float(record['usd']), 2),
+                'usd_foil': None if np.isnan(record['usd_foil']) else round(float(record['usd_foil']), 2)
+            }
+            for record in records
+        ]
@@ -0,0 +1,120 @@
+"""Show one profile written by stage_profiler, or diff two runs"""
+import argparse
+import json
+import marshal
+import os
+from mtg_runtime import get_client
+
+ARTIFACTS = ['profile.prof', 'allocations.json']
+
+def load_run(location):
+    """{artifact name: bytes} for a run, resolving a stage/date prefix to its latest run"""
+    if not location.startswith('s3://'):
+        runs = sorted(directory for directory, _, files in os.walk(location) if set(ARTIFACTS) & set(files))
+        if not runs:
+            raise Exception(f"No profile found under {location}")
+        location = runs[-1]
+        artifacts = {}
+        for name in ARTIFACTS:
+            path = os.path.join(location, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    artifacts[name] = f.read()
+        return location, artifacts
+
+    bucket, _, prefix = location[len('s3://'):].partition('/')
+    prefix = prefix.rstrip('/') + '/'
+    s3 = get_client('s3')
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    if not keys:
+        raise Exception(f"No profile found under {location}")
+
+    # Run folders are UTC timestamps, so the last one sorts last
+    run_prefix = sorted(keys)[-1].rsplit('/', 1)[0] + '/'
+    artifacts = {}
+    for name in ARTIFACTS:
+        if run_prefix + name in keys:
+            artifacts[name] = s3.get_object(Bucket=bucket, Key=run_prefix + name)['Body'].read()
+    return f"s3://{bucket}/{run_prefix}", artifacts
+
+def function_times(artifacts):
+    """{function label: (calls, own seconds, cumulative seconds)}"""
+    if 'profile.prof' not in artifacts:
+        return {}
+    stats = marshal.loads(artifacts['profile.prof'])
+    return {
+        f"{os.path.basename(filename)}:{line}({function})": (calls, own, cumulative)
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.items()
+    }
+
+def allocation_sizes(artifacts):
+    """(peak traced bytes, {site: bytes still allocated at the end})"""
+    if 'allocations.json' not in artifacts:
+        return None, {}
+    allocations = json.loads(artifacts['allocations.json'])
+    # Runs profiled before the sites were labelled live_at_exit called them top
+    sites = allocations.get('live_at_exit', allocations.get('top', []))
+    return allocations['peak_bytes'], {site['site']: site['size'] for site in sites}
+
+def show(location, artifacts, top):
+    print(f"Run: {location}")
+    times = function_times(artifacts)
+    if times:
+        print(f"\n{'calls':>10}{'own s':>10}{'cum s':>10}  function")
+        for label, (calls, own, cumulative) in sorted(times.items(), key=lambda item: -item[1][2])[:top]:
+            print(f"{calls:>10}{own:>10.3f}{cumulative:>10.3f}  {label}")
+
+    peak, sizes = allocation_sizes(artifacts)
+    if peak is not None:
+        print(f"\nPeak traced memory: {peak / (1024 * 1024):.1f} MB")
+        print(f"{'KB':>12}  allocation site, live at exit")
+        for site, size in sorted(sizes.items(), key=lambda item: -item[1])[:top]:
+            print(f"{size / 1024:>12.1f}  {site}")
+
+def diff(first, second, top):
+    """Functions ranked by the change in cumulative time and sites by the change in size, B minus A"""
+    (first_location, first_artifacts), (second_location, second_artifacts) = first, second
+    print(f"A: {first_location}\nB: {second_location}")
+
+    first_times, second_times = function_times(first_artifacts), function_times(second_artifacts)
+    if first_times or second_times:
+        rows = []
+        for label in set(first_times) | set(second_times):
+            first_cumulative = first_times.get(label, (0, 0, 0))[2]
+            second_cumulative = second_times.get(label, (0, 0, 0))[2]
+            rows.append((second_cumulative - first_cumulative, first_cumulative, second_cumulative,
+                         first_times.get(label, (0,))[0], second_times.get(label, (0,))[0], label))
+        print(f"\n{'A cum s':>10}{'B cum s':>10}{'delta s':>10}{'A calls':>10}{'B calls':>10}  function")
+        for delta, first_cumulative, second_cumulative, first_calls, second_calls, label in \
+                sorted(rows, key=lambda row: -abs(row[0]))[:top]:
+            print(f"{first_cumulative:>10.3f}{second_cumulative:>10.3f}{delta:>+10.3f}{first_calls:>10}{second_calls:>10}  {label}")
+
+    first_peak, first_sizes = allocation_sizes(first_artifacts)
+    second_peak, second_sizes = allocation_sizes(second_artifacts)
+    if first_peak is not None and second_peak is not None:
+        print(f"\nPeak traced memory: {first_peak / (1024 * 1024):.1f} MB -> {second_peak / (1024 * 1024):.1f} MB")
+        rows = [(second_sizes.get(site, 0) - first_sizes.get(site, 0), first_sizes.get(site, 0), second_sizes.get(site, 0), site)
+                for site in set(first_sizes) | set(second_sizes)]
+        print(f"{'A KB':>12}{'B KB':>12}{'delta KB':>12}  allocation site, live at exit")
+        for delta, first_size, second_size, site in sorted(rows, key=lambda row: -abs(row[0]))[:top]:
+            print(f"{first_size / 1024:>12.1f}{second_size / 1024:>12.1f}{delta / 1024:>+12.1f}  {site}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Show one stage profile or diff two')
+    parser.add_argument('runs', nargs='+', help='One or two run locations (S3 prefix or local directory)')
+    parser.add_argument('--top', type=int, default=25, help='Rows to show per table')
+    args = parser.parse_args()
+
+    if len(args.runs) > 2:
+        parser.error('Give one run to show or two to diff')
+
+    runs = [load_run(location) for location in args.runs]
+    if len(runs) == 1:
+        show(*runs[0], args.top)
+    else:
+        diff(runs[0], runs[1], args.top)
+
+if __name__ == "__main__":
+    main()
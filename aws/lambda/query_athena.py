@@ -1,15 +1,29 @@
-import boto3
 import json
-import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from athena_runner import run_queries, run_query, summarize
+from mtg_runtime import LazyClient, clear_prefix, format_dates, get_dates, get_multiple_parameters
+from stage_metrics import StageMetrics
+from stage_profiler import profiled
 from urllib.parse import urlparse
 
-s3 = boto3.client('s3')
-ssm = boto3.client('ssm')
+s3 = LazyClient('s3')
+athena = LazyClient('athena')
 
+# One pre-joined Parquet slice per pull_date, reused by every run that looks back at that day
+SLICE_PREFIX = 'mtg_query_slices/'
+SLICE_MANIFEST = '_manifest.json'
+# Bump when the slice columns change so older slices are rebuilt rather than reused
+SLICE_FORMAT = 2
+# Today and 1, 2 and 4 weeks ago
+LOOKBACK_DAYS = [0, 7, 14, 28]
+# The longest lookback plus a week, so rerunning last week's days still hits the cache
+SLICE_RETENTION_DAYS = 35
+
+@profiled('query_athena')
 def lambda_handler(event, context):
-    date_info = get_dates()
+    date_info = get_dates(event)
     short_date = date_info['short_date']
+    metrics = StageMetrics('query_athena', date_info['formatted_date'])
 
     # Get configuration
     param_names = [
@@ -18,68 +32,58 @@ def lambda_handler(event, context):
     params = get_multiple_parameters(param_names)
     primary_bucket = params['/mtg/s3/buckets/primary_bucket']
 
+    # 'parquet' UNLOADs typed Parquet for final_processing, 'csv' keeps the copied Athena result file
+    handoff_format = event.get('handoff_format', 'parquet') if isinstance(event, dict) else 'parquet'
+
     # Define the output S3 path
     s3_key = f"mtg_temp_daily/{short_date}_daily_out_raw.csv"
+    parquet_prefix = f"mtg_temp_daily/{short_date}_daily_out_raw/"
     output_location = f"s3://{primary_bucket}/athena_output/"
 
+    # Parquet handoffs are assembled from cached per-day slices unless the event sets slice_cache: false
+    if handoff_format == 'parquet' and (not isinstance(event, dict) or event.get('slice_cache', True)):
+        refresh = isinstance(event, dict) and event.get('refresh_slices', False)
+        return sliced_handoff(primary_bucket, date_info, parquet_prefix, output_location, refresh, metrics)
+
+    # usd is DECIMAL in Iceberg; cast to DOUBLE so Parquet readers get the same floats the CSV parse gave
+    usd_column = 'CAST(price.usd AS DOUBLE) AS usd' if handoff_format == 'parquet' else 'price.usd'
+
+    # Dates are literals rather than current_date so a historical day can be rerun
+    run_date = f"DATE '{date_info['formatted_date']}'"
+
     # SQL query to execute
-    query = """
-    SELECT
-      price.id,
-      CAST(static.tcgplayer_id AS INT) AS tcgplayer_id,
-      static.name,
-      static.set_name,
-      static.set_type,
-      static.released_at,
-      price.usd,
-      price.pull_date
-    FROM mtg_prices_iceberg AS price
-    INNER JOIN mtg_static_parquet AS static ON price.id = static.id
-    WHERE price.usd IS NOT NULL
-      AND price.usd <> 0
-      AND CAST(static.released_at AS DATE) >= DATE_ADD('year', -10, current_date)
-      AND CAST(price.pull_date AS DATE) IN (
-        current_date,                     -- Today
-        DATE_ADD('day', -7, current_date), -- 1 week ago
-        DATE_ADD('day', -14, current_date),-- 2 weeks ago
-        DATE_ADD('day', -28, current_date) -- 4 weeks ago
-      )
-    """
+    query = joined_query(usd_column, run_date, f"""
+        {run_date},                     -- Today
+        DATE_ADD('day', -7, {run_date}), -- 1 week ago
+        DATE_ADD('day', -14, {run_date}),-- 2 weeks ago
+        DATE_ADD('day', -28, {run_date}) -- 4 weeks ago""")
+
+    if handoff_format == 'parquet':
+        # UNLOAD refuses to write into a non-empty prefix, so clear any earlier run for this date
+        clear_prefix(primary_bucket, parquet_prefix)
+        query = unload_query(query, f"s3://{primary_bucket}/{parquet_prefix}")
 
     # Execute the Athena query
-    client = boto3.client('athena')
-    response = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={
-            'Database': 'mtg'
-        },
-        ResultConfiguration={
-            'OutputLocation': output_location
+    result = run_query(athena, query, output_location)
+    metrics.add_athena('daily_query', result)
+    metrics.emit()
+
+    if result['state'] != 'SUCCEEDED':
+        print(f"Query {result['state']}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Query {result['state']}: {result['state_change_reason']}")
         }
-    )
+    print(f"Query succeeded: {summarize('daily_query', result)}")
 
-    # Get the query execution ID
-    query_execution_id = response['QueryExecutionId']
-
-    # Check the status of the query
-    query_status = None
-    while query_status not in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-        response = client.get_query_execution(QueryExecutionId=query_execution_id)
-        query_status = response['QueryExecution']['Status']['State']
-        if query_status == 'SUCCEEDED':
-            print("Query succeeded")
-        elif query_status in ['FAILED', 'CANCELLED']:
-            print(f"Query {query_status}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps(f"Query {query_status}: {response['QueryExecution']['Status']['StateChangeReason']}")
-            }
-        else:
-            print("Query is still running, waiting for 2 seconds...")
-            time.sleep(2)
+    if handoff_format == 'parquet':
+        return {
+            'statusCode': 200,
+            'body': json.dumps(f"Parquet successfully unloaded to s3://{primary_bucket}/{parquet_prefix}")
+        }
 
     # Get the output file location
-    query_output_location = response['QueryExecution']['ResultConfiguration']['OutputLocation']
+    query_output_location = result['output_location']
     parsed_url = urlparse(query_output_location)
     source_bucket = parsed_url.netloc
     source_key = parsed_url.path.lstrip('/')
@@ -100,37 +104,160 @@ def lambda_handler(event, context):
         'body': json.dumps(f"CSV successfully uploaded to s3://{primary_bucket}/{s3_key}")
     }
 
-def get_dates():
-    current_date = datetime.now()
+def joined_query(usd_column, run_date, pull_dates):
+    """Priced cards released in the 10 years before run_date, for the listed pull_date literals"""
+    return f"""
+    SELECT
+      static.id,
+      CAST(static.tcgplayer_id AS INT) AS tcgplayer_id,
+      static.name,
+      static.set_name,
+      static.set_type,
+      static.rarity,
+      static.released_at,
+      {usd_column},
+      price.pull_date
+    FROM mtg_prices_iceberg AS price
+    INNER JOIN mtg_static_parquet AS static ON price.card_key = static.card_key
+    WHERE price.usd IS NOT NULL
+      AND price.usd <> 0
+      AND CAST(static.released_at AS DATE) >= DATE_ADD('year', -10, {run_date})
+      AND CAST(price.pull_date AS DATE) IN ({pull_dates}
+      )
+    """
 
-    ### Temp force a specific date
-    # temp_date = '2024-12-08'
-    # current_date = datetime.strptime(temp_date, '%Y-%m-%d')
+def unload_query(query, location):
+    return f"""
+    UNLOAD ({query})
+    TO '{location}'
+    WITH (format = 'PARQUET', compression = 'SNAPPY')
+    """
 
-    return {
-        'year': current_date.strftime('%Y'),
-        'month': current_date.strftime('%m'),
-        'day': current_date.strftime('%d'),
-        'short_date': current_date.strftime('%Y%m%d'),
-        'formatted_date': current_date.strftime('%Y-%m-%d')
-    }
+def slice_prefix(formatted_date):
+    return f"{SLICE_PREFIX}{formatted_date}/"
 
-def get_multiple_parameters(parameter_names):
+def cached_slice(bucket, formatted_date):
+    """A slice's manifest, or None when the day has no complete slice in the current format"""
     try:
-        response = ssm.get_parameters(
-            Names=parameter_names,
-            WithDecryption=True
+        body = s3.get_object(Bucket=bucket, Key=slice_prefix(formatted_date) + SLICE_MANIFEST)['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    manifest = json.loads(body)
+    return manifest if manifest.get('format') == SLICE_FORMAT else None
+
+def build_slices(bucket, formatted_dates, output_location, metrics):
+    """
+    UNLOAD each day's joined rows into its slice, all days together, filtered as that day's own run filters them.
+    Returns ({date: manifest} for the slices built, [failure summaries]).
+    """
+    queries = {}
+    for formatted_date in formatted_dates:
+        # UNLOAD refuses to write into a non-empty prefix
+        clear_prefix(bucket, slice_prefix(formatted_date))
+        pull_date = f"DATE '{formatted_date}'"
+        queries[formatted_date] = unload_query(
+            joined_query('CAST(price.usd AS DOUBLE) AS usd', pull_date, pull_date),
+            f"s3://{bucket}/{slice_prefix(formatted_date)}"
         )
+    results = run_queries(athena, queries, output_location)
 
-        # Check for missing parameters
-        if response.get('InvalidParameters'):
-            raise Exception(f"Missing parameters: {response['InvalidParameters']}")
-
-        params = {}
-        for param in response['Parameters']:
-            params[param['Name']] = param['Value']
-        
-        return params
-    except Exception as e:
-        print(f"Error getting parameters: {e}")
-        raise
\ No newline at end of file
+    manifests = {}
+    failures = []
+    for formatted_date, result in results.items():
+        metrics.add_athena(f"slice_{formatted_date}", result)
+        if result['state'] != 'SUCCEEDED':
+            # Drop whatever a failed UNLOAD left behind
+            clear_prefix(bucket, slice_prefix(formatted_date))
+            failures.append(summarize(f"slice_{formatted_date}", result))
+            continue
+        print(f"Slice built: {summarize(f'slice_{formatted_date}', result)}")
+
+        files = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=slice_prefix(formatted_date)):
+            files.extend({'key': obj['Key'], 'size': obj['Size']} for obj in page.get('Contents', []))
+        manifests[formatted_date] = {
+            'pull_date': formatted_date,
+            'format': SLICE_FORMAT,
+            'query_execution_id': result['query_execution_id'],
+            'data_scanned_bytes': result['statistics'].get('DataScannedInBytes'),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'files': files
+        }
+        # Written last, so only a complete slice is ever reused
+        s3.put_object(Bucket=bucket, Key=slice_prefix(formatted_date) + SLICE_MANIFEST,
+                      Body=json.dumps(manifests[formatted_date]))
+    return manifests, failures
+
+def evict_slices(bucket, run_date):
+    """
+    Delete slices more than SLICE_RETENTION_DAYS older than the newest one kept, so
+    rerunning an old day doesn't drop recent slices. Returns how many were removed.
+    """
+    kept = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=SLICE_PREFIX, Delimiter='/'):
+        kept.extend(prefix['Prefix'][len(SLICE_PREFIX):].rstrip('/') for prefix in page.get('CommonPrefixes', []))
+
+    newest = max([run_date.strftime('%Y-%m-%d')] + kept)
+    oldest_kept = (datetime.strptime(newest, '%Y-%m-%d') - timedelta(days=SLICE_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    evicted = [formatted_date for formatted_date in kept if formatted_date < oldest_kept]
+    for formatted_date in evicted:
+        clear_prefix(bucket, slice_prefix(formatted_date))
+    return len(evicted)
+
+def sliced_handoff(bucket, date_info, parquet_prefix, output_location, refresh, metrics):
+    """
+    Build the Parquet handoff from one slice per lookback day
+    """
+    # athena_add_partitions_all drops a reprocessed day's slice, so a normal morning queries
+    # today alone and reuses the three earlier ones
+    run_date = datetime.strptime(date_info['formatted_date'], '%Y-%m-%d')
+    slice_dates = [format_dates(run_date - timedelta(days=days))['formatted_date'] for days in LOOKBACK_DAYS]
+
+    manifests = {}
+    if not refresh:
+        for formatted_date in slice_dates:
+            manifest = cached_slice(bucket, formatted_date)
+            if manifest is not None:
+                manifests[formatted_date] = manifest
+    missing = [formatted_date for formatted_date in slice_dates if formatted_date not in manifests]
+    metrics.put('SliceCacheHits', len(manifests))
+    metrics.put('SliceCacheMisses', len(missing))
+
+    failures = []
+    if missing:
+        with metrics.timer('Query'):
+            built, failures = build_slices(bucket, missing, output_location, metrics)
+        manifests.update(built)
+
+    if failures:
+        metrics.emit()
+        print(f"Slice queries failed: {failures}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Slice queries failed: {'; '.join(failures)}")
+        }
+
+    # Server-side copies into the handoff prefix final_processing reads, prefixed by day
+    # because UNLOAD file names are only unique within one query
+    clear_prefix(bucket, parquet_prefix)
+    with metrics.timer('Copy'):
+        for formatted_date in slice_dates:
+            for file in manifests[formatted_date]['files']:
+                s3.copy_object(
+                    Bucket=bucket,
+                    CopySource={'Bucket': bucket, 'Key': file['key']},
+                    Key=f"{parquet_prefix}{formatted_date}_{file['key'].rsplit('/', 1)[1]}"
+                )
+                metrics.add('BytesCopied', file['size'], 'Bytes')
+
+    metrics.put('SlicesEvicted', evict_slices(bucket, run_date))
+    metrics.emit()
+
+    print(f"Handoff built from {len(slice_dates)} slices, {len(missing)} queried: {missing}")
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"Parquet successfully assembled in s3://{bucket}/{parquet_prefix} "
+                           f"({len(slice_dates) - len(missing)} cached slices, {len(missing)} queried)")
+    }
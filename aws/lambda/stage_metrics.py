@@ -0,0 +1,140 @@
+"""Per-stage performance metrics, printed as CloudWatch Embedded Metric Format (EMF) records"""
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+NAMESPACE = 'MTG/Pipeline'
+DIMENSIONS = [['Stage']]
+
+# Statistics copied from each run_queries result, summed per stage
+ATHENA_STATISTICS = {
+    'DataScannedInBytes': 'Bytes',
+    'EngineExecutionTimeInMillis': 'Milliseconds',
+    'QueryQueueTimeInMillis': 'Milliseconds',
+    'QueryPlanningTimeInMillis': 'Milliseconds',
+    'TotalExecutionTimeInMillis': 'Milliseconds'
+}
+
+# One JSON line per stage run; CloudWatch Logs turns the EMF block into metrics, so there
+# are no PutMetricData calls. set_sink swaps in e.g. a MemorySink for the local harness.
+def print_sink(record):
+    print(json.dumps(record, default=str))
+
+_sink = print_sink
+
+def set_sink(sink):
+    """Send emitted records to sink(record) instead of stdout. Returns the previous sink."""
+    global _sink
+    previous = _sink
+    _sink = sink
+    return previous
+
+class MemorySink:
+    """Keeps emitted records so a local run can read them back and check them against budgets"""
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def metrics(self, stage, since=0):
+        """{metric: value} from the stage's records after index `since`, later values winning"""
+        values = {}
+        for record in self.records[since:]:
+            if record.get('Stage') == stage:
+                for directive in record['_aws']['CloudWatchMetrics']:
+                    values.update({metric['Name']: record[metric['Name']] for metric in directive['Metrics']})
+        return values
+
+class StageMetrics:
+    def __init__(self, stage, date=None):
+        self.stage = stage
+        self.date = date
+        self.started = time.perf_counter()
+        # name -> [value, unit]
+        self.values = {}
+        # Logged with the record but not turned into metrics
+        self.properties = {}
+
+    def add(self, name, value, unit='Count'):
+        """Accumulate into a metric, e.g. rows over several batches"""
+        if value is None:
+            return
+        if name in self.values:
+            self.values[name][0] += value
+        else:
+            self.values[name] = [value, unit]
+
+    def put(self, name, value, unit='Count'):
+        """Set a metric, replacing any earlier value"""
+        if value is not None:
+            self.values[name] = [value, unit]
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}Seconds", round(time.perf_counter() - start, 3), 'Seconds')
+
+    def add_athena(self, name, result):
+        """Record a run_queries result: summed statistics, query counts and the execution id"""
+        self.add('AthenaQueries', 1)
+        if result['state'] != 'SUCCEEDED':
+            self.add('AthenaFailedQueries', 1)
+        for statistic, unit in ATHENA_STATISTICS.items():
+            self.add(f"Athena{statistic}", result['statistics'].get(statistic), unit)
+        self.properties.setdefault('AthenaExecutions', {})[name] = {
+            'QueryExecutionId': result['query_execution_id'],
+            'State': result['state'],
+            'DataScannedInBytes': result['statistics'].get('DataScannedInBytes'),
+            'EngineExecutionTimeInMillis': result['statistics'].get('EngineExecutionTimeInMillis')
+        }
+
+    def record(self):
+        """The EMF record for everything collected so far, with duration and peak memory"""
+        self.put('DurationSeconds', round(time.perf_counter() - self.started, 3), 'Seconds')
+        # ru_maxrss is KB on Linux and covers the whole process, so a warm Lambda container
+        # reports the peak of every invocation it has served
+        self.put('PeakMemoryMB', round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), 'Megabytes')
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': DIMENSIONS,
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in self.values.items()]
+                }]
+            },
+            'Stage': self.stage,
+            'Date': self.date
+        }
+        record.update(self.properties)
+        record.update({name: value for name, (value, _) in self.values.items()})
+        return record
+
+    def emit(self):
+        record = self.record()
+        _sink(record)
+        return record
+
+    def summary(self, title, notes=()):
+        """Short plain text notice: a title, one line per metric, then any notes"""
+        lines = [f"{title} ({self.date})" if self.date else title]
+        lines += [f"  {name}: {format_value(value, unit)}" for name, (value, unit) in self.values.items()]
+        lines += list(notes)
+        return "\n".join(lines)
+
+def format_value(value, unit):
+    if unit == 'Bytes':
+        return f"{value / (1024 * 1024):,.1f} MB"
+    if unit == 'Milliseconds':
+        return f"{value:,} ms"
+    if unit == 'Seconds':
+        return f"{value:,.1f} s"
+    if unit == 'Megabytes':
+        return f"{value:,.0f} MB"
+    return f"{value:,}"
@@ -0,0 +1,141 @@
+"""Opt-in cProfile and tracemalloc profiling for pipeline stages, written to S3 under mtg_profiles/"""
+import functools
+import io
+import json
+import os
+from datetime import datetime, timezone
+from mtg_runtime import get_client, get_date_range, get_multiple_parameters
+
+# <stage>/<date>/<run>/ under this holds profile.prof (pstats dump), profile.txt (top functions
+# by cumulative time) and allocations.json; <date> is first_last for a range
+PROFILE_PREFIX = 'mtg_profiles/'
+TOP_FUNCTIONS = 60
+TOP_ALLOCATIONS = 50
+# Frames kept per allocation; 1 groups by the allocating line and keeps overhead down
+TRACEBACK_FRAMES = 1
+
+def profile_mode(stage, event=None):
+    """'cpu', 'memory', 'all', or None when the stage isn't being profiled"""
+    requested = event.get('profile') if isinstance(event, dict) else None
+    if not requested:
+        configured = os.environ.get('MTG_PROFILE')
+        if not configured:
+            return None
+        names = {name.strip() for name in configured.split(',')}
+        if 'all' not in names and stage not in names:
+            return None
+        requested = True
+    return requested if requested in ('cpu', 'memory') else 'all'
+
+class StageProfiler:
+    """start() before the work, finish() after it; finish() uploads and returns the S3 prefix"""
+    def __init__(self, stage, date, bucket, mode='all'):
+        self.stage = stage
+        self.date = date
+        self.bucket = bucket
+        self.mode = mode
+        self.profile = None
+        self.tracing = False
+
+    def start(self):
+        if self.mode in ('all', 'memory'):
+            import tracemalloc
+            # A caller may already be tracing; leave its settings alone
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEBACK_FRAMES)
+                self.tracing = True
+        if self.mode in ('all', 'cpu'):
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def finish(self):
+        artifacts = {}
+        if self.profile:
+            self.profile.disable()
+        # Snapshot allocations before building the profile report allocates anything
+        if self.mode in ('all', 'memory'):
+            artifacts['allocations.json'] = json.dumps(allocation_summary(), indent=2).encode('utf-8')
+            if self.tracing:
+                import tracemalloc
+                tracemalloc.stop()
+        if self.profile:
+            artifacts.update(profile_artifacts(self.profile))
+
+        run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        prefix = f"{PROFILE_PREFIX}{self.stage}/{self.date}/{run}/"
+        # Profiling must never fail the stage it is watching
+        try:
+            s3 = get_client('s3')
+            for name, body in artifacts.items():
+                s3.put_object(Bucket=self.bucket, Key=prefix + name, Body=body)
+            print(f"Profile for {self.stage} written to s3://{self.bucket}/{prefix}")
+        except Exception as e:
+            print(f"Error writing profile for {self.stage}: {str(e)}")
+        return prefix
+
+def profile_artifacts(profile):
+    import marshal
+    import pstats
+
+    profile.create_stats()
+    # Stats() snapshots the profile again, which leaves profile.stats empty, so dump first
+    dump = marshal.dumps(profile.stats)
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return {
+        'profile.prof': dump,
+        'profile.txt': report.getvalue().encode('utf-8')
+    }
+
+def allocation_summary():
+    """Current and peak traced memory, and the top sites by size of what is still allocated"""
+    import tracemalloc
+
+    # tracemalloc keeps the peak only as a number, so memory freed before the end counts
+    # toward peak_bytes but shows up under no site
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '*/cProfile.py')
+    ])
+    statistics = snapshot.statistics('lineno')
+    return {
+        'current_bytes': current,
+        'peak_bytes': peak,
+        'live_at_exit': [
+            {
+                'site': f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                'size': statistic.size,
+                'count': statistic.count
+            }
+            for statistic in statistics[:TOP_ALLOCATIONS]
+        ]
+    }
+
+def date_label(event):
+    """The event's day, or first_last when it asks for a range"""
+    dates = [dates_dict['formatted_date'] for dates_dict in get_date_range(event)]
+    return dates[0] if len(dates) == 1 else f"{dates[0]}_{dates[-1]}"
+
+def profiled(stage):
+    """Decorate a lambda_handler so it can be profiled per profile_mode"""
+    # Unprofiled, the wrapper costs one dict lookup and one environment read
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            mode = profile_mode(stage, event)
+            if not mode:
+                return handler(event, context)
+
+            bucket = get_multiple_parameters(['/mtg/s3/buckets/primary_bucket'])['/mtg/s3/buckets/primary_bucket']
+            profiler = StageProfiler(stage, date_label(event), bucket, mode).start()
+            try:
+                return handler(event, context)
+            finally:
+                profiler.finish()
+        return wrapper
+    return decorator
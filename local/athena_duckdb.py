@@ -0,0 +1,186 @@
+"""
+DuckDB stand-in for the Athena client calls the pipeline makes through athena_runner.
+
+Statements run synchronously in DuckDB against the local S3 stand-in over httpfs, after a
+light translation of the Athena dialect the pipeline uses:
+    ALTER TABLE ... SET LOCATION / ADD PARTITION    update the table's file list
+    UNLOAD (...) TO '...' WITH (...)                 COPY (...) TO ... (FORMAT PARQUET)
+    DATE_ADD('unit', n, DATE '...'), date('...')    interval arithmetic, date literals
+    OPTIMIZE, VACUUM, SET TBLPROPERTIES             accepted as no-ops
+SELECT results are also written as CSV to the output location, as Athena does.
+DataScannedInBytes is the bytes the S3 stand-in served while the statement ran.
+"""
+import re
+import time
+import uuid
+
+# Iceberg table schemas, created as native DuckDB tables
+ICEBERG_TABLES = {
+    'mtg_prices_iceberg': 'card_key INTEGER, usd DECIMAL(10, 2), usd_foil DECIMAL(10, 2), pull_date DATE'
+}
+
+NO_OP_PATTERN = re.compile(r'^\s*(OPTIMIZE|VACUUM|ALTER\s+TABLE\s+\S+\s+SET\s+TBLPROPERTIES)\b', re.IGNORECASE)
+SET_LOCATION_PATTERN = re.compile(r"^\s*ALTER\s+TABLE\s+(\S+)\s+SET\s+LOCATION\s+'([^']+)'", re.IGNORECASE)
+ADD_PARTITION_PATTERN = re.compile(
+    r"^\s*ALTER\s+TABLE\s+(\S+)\s+ADD\s+(?:IF\s+NOT\s+EXISTS\s+)?PARTITION\s*\(.*?\)\s*LOCATION\s+'([^']+)'",
+    re.IGNORECASE | re.DOTALL
+)
+UNLOAD_PATTERN = re.compile(r"^\s*UNLOAD\s*\((.*)\)\s*TO\s*'([^']+)'\s*WITH\s*\((.*)\)\s*$", re.IGNORECASE | re.DOTALL)
+DATE_ADD_PATTERN = re.compile(r"DATE_ADD\(\s*'(\w+)'\s*,\s*(-?\d+)\s*,\s*(DATE\s*'[^']+')\s*\)", re.IGNORECASE)
+SELECT_PATTERN = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+DATE_CALL_PATTERN = re.compile(r"\bdate\(\s*'([^']+)'\s*\)", re.IGNORECASE)
+
+class _ResultsPaginator:
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, QueryExecutionId, **kwargs):
+        yield self._client.get_query_results(QueryExecutionId=QueryExecutionId)
+
+class DuckDBAthena:
+    """
+    Implements start_query_execution, get_query_execution, batch_get_query_execution,
+    get_query_results and the get_query_results paginator.
+
+        athena = DuckDBAthena(endpoint='127.0.0.1:5000', bytes_served=server.bytes_out)
+    """
+    def __init__(self, endpoint, region='us-west-2', bytes_served=lambda: 0):
+        import duckdb
+
+        self.bytes_served = bytes_served
+        self.connection = duckdb.connect()
+        for statement in [
+            "INSTALL httpfs",
+            "LOAD httpfs",
+            f"SET s3_endpoint = '{endpoint}'",
+            f"SET s3_region = '{region}'",
+            "SET s3_use_ssl = false",
+            "SET s3_url_style = 'path'",
+            "SET s3_access_key_id = 'testing'",
+            "SET s3_secret_access_key = 'testing'"
+        ]:
+            self.connection.execute(statement)
+        for table, columns in ICEBERG_TABLES.items():
+            self.connection.execute(f"CREATE TABLE {table} ({columns})")
+
+        # External table name -> list of registered S3 locations
+        self.locations = {}
+        self.executions = {}
+
+    def register_location(self, table, location, replace=False):
+        locations = [] if replace else self.locations.get(table, [])
+        if location not in locations:
+            locations.append(location)
+        self.locations[table] = locations
+
+        files = ", ".join(f"'{location.rstrip('/')}/*.parquet'" for location in locations)
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW {table} AS
+            SELECT * FROM read_parquet([{files}], hive_partitioning = true, hive_types_autocast = false, union_by_name = true)
+        """)
+
+    def translate(self, query):
+        query = query.strip().rstrip(';')
+        query = DATE_ADD_PATTERN.sub(lambda match: f"({match.group(3)} + INTERVAL ({match.group(2)}) {match.group(1)})", query)
+        return DATE_CALL_PATTERN.sub(lambda match: f"DATE '{match.group(1)}'", query)
+
+    def execute(self, query, query_execution_id, output_location):
+        """Run one statement. Returns (columns, rows) for statements with a result set."""
+        query = self.translate(query)
+
+        if NO_OP_PATTERN.match(query):
+            return None
+
+        match = SET_LOCATION_PATTERN.match(query)
+        if match:
+            self.register_location(match.group(1), match.group(2), replace=True)
+            return None
+
+        match = ADD_PARTITION_PATTERN.match(query)
+        if match:
+            self.register_location(match.group(1), match.group(2))
+            return None
+
+        match = UNLOAD_PATTERN.match(query)
+        if match:
+            select, location, options = match.groups()
+            partitioned_by = re.search(r"partitioned_by\s*=\s*ARRAY\[([^\]]*)\]", options, re.IGNORECASE)
+            compression = re.search(r"compression\s*=\s*'(\w+)'", options, re.IGNORECASE)
+            copy_options = ["FORMAT PARQUET", f"COMPRESSION {compression.group(1) if compression else 'SNAPPY'}"]
+            if partitioned_by:
+                copy_options.append(f"PARTITION_BY ({partitioned_by.group(1).replace(chr(39), '')})")
+                target = location.rstrip('/')
+            else:
+                target = f"{location.rstrip('/')}/{query_execution_id}.parquet"
+            self.connection.execute(f"COPY ({select}) TO '{target}' ({', '.join(copy_options)})")
+            return None
+
+        if not SELECT_PATTERN.match(query):
+            self.connection.execute(query)
+            return None
+
+        # Materialize once, then return the rows and leave the CSV in the output location as Athena does
+        self.connection.execute(f"CREATE OR REPLACE TEMP TABLE athena_result AS {query}")
+        cursor = self.connection.execute("SELECT * FROM athena_result")
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        self.connection.execute(
+            f"COPY athena_result TO '{output_location.rstrip('/')}/{query_execution_id}.csv' (HEADER, DELIMITER ',')"
+        )
+        return columns, rows
+
+    def start_query_execution(self, QueryString, QueryExecutionContext=None, ResultConfiguration=None, **kwargs):
+        query_execution_id = str(uuid.uuid4())
+        output_location = (ResultConfiguration or {}).get('OutputLocation', 's3://athena-output/')
+        bytes_before = self.bytes_served()
+        start = time.perf_counter()
+
+        execution = {
+            'QueryExecutionId': query_execution_id,
+            'Query': QueryString,
+            'ResultConfiguration': {'OutputLocation': f"{output_location.rstrip('/')}/{query_execution_id}.csv"},
+            'Status': {'State': 'SUCCEEDED'}
+        }
+        result = None
+        try:
+            result = self.execute(QueryString, query_execution_id, output_location)
+        except Exception as e:
+            execution['Status'] = {'State': 'FAILED', 'StateChangeReason': str(e)}
+
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        execution['Statistics'] = {
+            'EngineExecutionTimeInMillis': elapsed_ms,
+            'TotalExecutionTimeInMillis': elapsed_ms,
+            'QueryPlanningTimeInMillis': 0,
+            'DataScannedInBytes': self.bytes_served() - bytes_before
+        }
+        self.executions[query_execution_id] = (execution, result)
+        return {'QueryExecutionId': query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': self.executions[QueryExecutionId][0]}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        return {
+            'QueryExecutions': [self.executions[query_execution_id][0] for query_execution_id in QueryExecutionIds],
+            'UnprocessedQueryExecutionIds': []
+        }
+
+    def get_query_results(self, QueryExecutionId, **kwargs):
+        execution, result = self.executions[QueryExecutionId]
+        columns, rows = result or ([], [])
+
+        def to_row(values):
+            return {'Data': [{} if value is None else {'VarCharValue': str(value)} for value in values]}
+
+        return {
+            'ResultSet': {
+                'Rows': [to_row(columns)] + [to_row(row) for row in rows],
+                'ResultSetMetadata': {'ColumnInfo': [{'Name': column} for column in columns]}
+            }
+        }
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'get_query_results':
+            raise NotImplementedError(operation_name)
+        return _ResultsPaginator(self)
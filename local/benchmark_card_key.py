@@ -0,0 +1,166 @@
+"""
+Compare daily prices Parquet keyed by the Scryfall UUID id with the same data keyed by
+the integer card_key, over a year of synthetic days.
+
+    python local/benchmark_card_key.py --cards 90000 --days 365
+
+Each day is written twice as a year=/month=/day= partition: once with the 36 character
+id, as json_to_parquet wrote it before card_key, and once with card_key. Both use the
+'storage' layout (rows in card_key order, Snappy, about 1MB row groups) so the key column
+is the only difference. A static table holds id, card_key, name, set and rarity.
+
+It reports the bytes on disk, the key column's share of them, and the best-of-N DuckDB
+time to join the prices against the static table for the latest day, the whole year by
+set, and one card's history looked up by name. Both layouts must give the same answers.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE]
+
+from benchmark_price_history import day_prices, synthetic_ids
+
+MB = 1024 * 1024
+LAYOUTS = ['id', 'card_key']
+RARITIES = ['common', 'uncommon', 'rare', 'mythic']
+
+def static_table(ids, rng):
+    import pyarrow as pa
+    sets = [f"s{number:03d}" for number in range(400)]
+    return pa.table({
+        'id': ids,
+        'card_key': pa.array(range(len(ids)), pa.int32()),
+        'name': [f"card {key}" for key in range(len(ids))],
+        'set': [sets[value] for value in rng.integers(0, len(sets), len(ids))],
+        'rarity': [RARITIES[value] for value in rng.integers(0, len(RARITIES), len(ids))]
+    })
+
+def write_day(root, layout, date, keys, usd, usd_foil):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({
+        layout: keys,
+        'usd': pa.array(usd, pa.float64(), from_pandas=True),
+        'usd_foil': pa.array(usd_foil, pa.float64(), from_pandas=True),
+        'pull_date': [date.strftime('%Y-%m-%d')] * len(usd)
+    })
+    partition = os.path.join(root, layout, f"year={date:%Y}", f"month={date:%m}", f"day={date:%d}")
+    os.makedirs(partition, exist_ok=True)
+    # About 1MB row groups, like the storage writer profile's parquet.block.size
+    row_group_size = max(1, int(table.num_rows * MB / table.nbytes))
+    pq.write_table(table, os.path.join(partition, 'part-00000.parquet'),
+                   compression='snappy', row_group_size=row_group_size)
+
+def disk_bytes(path):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
+
+def column_bytes(connection, path, column):
+    return connection.sql(f"""
+        SELECT sum(total_compressed_size)
+        FROM parquet_metadata('{path}/**/*.parquet')
+        WHERE path_in_schema = '{column}'
+    """).fetchone()[0]
+
+def join_queries(path, key, last_date, card_name):
+    prices = f"read_parquet('{path}/**/*.parquet', hive_partitioning = true)"
+    return {
+        'latest day': f"""
+            SELECT s.rarity, count(*), round(sum(p.usd), 2)
+            FROM {prices} AS p JOIN static AS s ON p.{key} = s.{key}
+            WHERE p.year = '{last_date:%Y}' AND p.month = '{last_date:%m}' AND p.day = '{last_date:%d}'
+            GROUP BY s.rarity ORDER BY s.rarity""",
+        'year by set': f"""
+            SELECT s.set, count(*), round(avg(p.usd), 6), count(p.usd_foil)
+            FROM {prices} AS p JOIN static AS s ON p.{key} = s.{key}
+            GROUP BY s.set ORDER BY s.set""",
+        'one card': f"""
+            SELECT p.pull_date, p.usd, p.usd_foil
+            FROM {prices} AS p JOIN static AS s ON p.{key} = s.{key}
+            WHERE s.name = '{card_name}'
+            ORDER BY p.pull_date"""
+    }
+
+def best_seconds(connection, query, repeats):
+    best, rows = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rows = connection.sql(query).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark id against card_key keyed price Parquet')
+    parser.add_argument('--cards', type=int, default=90_000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--start-date', default='2024-06-01')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help='Keep the Parquet here instead of a temporary directory')
+    args = parser.parse_args()
+
+    import duckdb
+    import numpy as np
+
+    rng = np.random.default_rng(args.seed)
+    ids = synthetic_ids(args.cards, rng)
+    base = np.exp(rng.normal(-0.5, 1.4, args.cards))
+    static = static_table(ids, rng)
+    first_day = datetime.strptime(args.start_date, '%Y-%m-%d')
+    last_day = first_day + timedelta(days=args.days - 1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='mtg-card-key-')
+    try:
+        start = time.perf_counter()
+        keys = {'id': static.column('id'), 'card_key': static.column('card_key')}
+        for offset in range(args.days):
+            usd, usd_foil = day_prices(base, rng)
+            for layout in LAYOUTS:
+                write_day(work_dir, layout, first_day + timedelta(days=offset), keys[layout], usd, usd_foil)
+        print(f"Wrote {args.cards} cards x {args.days} days per layout in {time.perf_counter() - start:.1f}s")
+
+        connection = duckdb.connect()
+        connection.register('static', static)
+        card_name = static.column('name')[int(rng.integers(0, args.cards))].as_py()
+
+        sizes = {}
+        timings = {}
+        answers = {}
+        for layout in LAYOUTS:
+            path = os.path.join(work_dir, layout)
+            sizes[layout] = (disk_bytes(path), column_bytes(connection, path, layout))
+            for name, query in join_queries(path, layout, last_day, card_name).items():
+                timings[(layout, name)], answers[(layout, name)] = best_seconds(connection, query, args.repeats)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\nDaily prices Parquet, {args.cards} cards x {args.days} days ({args.cards * args.days:,} rows)")
+    print(f"{'key':<10}{'MB on disk':>12}{'key column MB':>15}")
+    for layout in LAYOUTS:
+        print(f"{layout:<10}{sizes[layout][0] / MB:>12.1f}{sizes[layout][1] / MB:>15.1f}")
+    print(f"card_key is {1 - sizes['card_key'][0] / sizes['id'][0]:.1%} smaller on disk")
+
+    print(f"\nJoin against the static table, DuckDB, best of {args.repeats}")
+    print(f"{'query':<14}{'id s':>9}{'card_key s':>12}{'speedup':>9}")
+    for name in join_queries('', '', last_day, card_name):
+        by_id, by_key = timings[('id', name)], timings[('card_key', name)]
+        print(f"{name:<14}{by_id:>9.2f}{by_key:>12.2f}{by_id / by_key:>8.1f}x")
+
+    differing = [name for name in join_queries('', '', last_day, card_name)
+                 if answers[('id', name)] != answers[('card_key', name)]]
+    if differing:
+        print(f"Results differ between layouts for {differing}")
+        sys.exit(1)
+    print("Both layouts give identical results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Measure the Lambdas' init duration and per-invocation setup latency off AWS.
+
+    python local/benchmark_cold_start.py --runs 5 --invocations 5
+
+Each run is a fresh Python process, like a Lambda cold start, talking to the moto stand-in
+(harness.py). It times
+    init       importing the handler module, which is what Lambda's INIT phase runs
+    first      the first invocation's setup: get_multiple_parameters for the handler's
+               configuration, then one S3 call through the module's own client
+    warm       the same setup on each later invocation in that process
+and counts the boto3 clients created at import and the SSM calls per invocation. The
+botocore import goes to init when the module imports boto3 and to the first invocation
+otherwise, as it would on Lambda. To
+compare against an older checkout of the handlers, e.g. before mtg_runtime.py existed:
+    git worktree add /tmp/mtg-before <commit>
+    python local/benchmark_cold_start.py --compare /tmp/mtg-before/aws/lambda
+Times are medians over the runs. Only handlers present in every compared directory run.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE]
+
+LAMBDA_DIR = os.path.join(REPO_ROOT, 'aws', 'lambda')
+HANDLERS = ['data_pull', 'confirm_parquet_created', 'athena_add_partitions_all', 'query_athena',
+            'final_processing', 'movers', 'card_search', 'price_history', 'price_cube']
+PARAMETERS = ['/mtg/s3/buckets/primary_bucket', '/mtg/s3/buckets/output_bucket',
+              '/mtg/s3/paths/final_output_key', '/mtg/sns/status_topic_arn']
+
+def child(lambda_dir, handler, invocations):
+    """Import one handler in this fresh process, run its setup, print the measurements as JSON"""
+    import time
+    start = time.perf_counter()
+    import botocore.client
+    import botocore.session
+    botocore_seconds = time.perf_counter() - start
+
+    calls = {'clients': 0, 'ssm': 0}
+    create_client = botocore.session.Session.create_client
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def counted_create_client(self, *args, **kwargs):
+        calls['clients'] += 1
+        return create_client(self, *args, **kwargs)
+
+    def counted_api_call(self, operation_name, api_params):
+        if self.meta.service_model.service_name == 'ssm':
+            calls['ssm'] += 1
+        return make_api_call(self, operation_name, api_params)
+
+    botocore.session.Session.create_client = counted_create_client
+    botocore.client.BaseClient._make_api_call = counted_api_call
+
+    sys.path.insert(0, lambda_dir)
+    start = time.perf_counter()
+    module = __import__(handler)
+    init_seconds = time.perf_counter() - start
+    clients_at_import = calls['clients']
+    # botocore was imported above to count calls; charge it to the phase that would import it
+    boto3_at_import = 'boto3' in sys.modules
+    if boto3_at_import:
+        init_seconds += botocore_seconds
+
+    s3 = getattr(module, 's3', None) or getattr(module, 's3_client', None)
+    runs = []
+    for _ in range(invocations):
+        ssm_before = calls['ssm']
+        start = time.perf_counter()
+        params = module.get_multiple_parameters(PARAMETERS)
+        if s3 is not None:
+            s3.list_objects_v2(Bucket=params['/mtg/s3/buckets/primary_bucket'], MaxKeys=1)
+        seconds = time.perf_counter() - start
+        if not runs and not boto3_at_import:
+            seconds += botocore_seconds
+        runs.append({'seconds': seconds, 'ssm_calls': calls['ssm'] - ssm_before})
+
+    print(json.dumps({'init': init_seconds, 'clients_at_import': clients_at_import, 'invocations': runs}))
+
+def run_child(lambda_dir, handler, invocations):
+    result = subprocess.run(
+        [sys.executable, __file__, '--child', lambda_dir, handler, str(invocations)],
+        capture_output=True, text=True, env=os.environ
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{handler} from {lambda_dir} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Lambda init and per-invocation setup latency')
+    parser.add_argument('--lambda-dir', default=LAMBDA_DIR)
+    parser.add_argument('--compare', action='append', default=[], metavar='LAMBDA_DIR',
+                        help='Another directory of handlers to measure the same way')
+    parser.add_argument('--handlers', nargs='+', default=HANDLERS)
+    parser.add_argument('--runs', type=int, default=5, help='Cold processes per handler')
+    parser.add_argument('--invocations', type=int, default=5, help='Invocations per process')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        lambda_dir, handler, invocations = args.child
+        child(lambda_dir, handler, int(invocations))
+        return
+
+    from harness import configure_environment, provision, start_aws_stand_in
+
+    _, endpoint_url = start_aws_stand_in()
+    configure_environment(endpoint_url)
+    provision()
+
+    lambda_dirs = [os.path.abspath(args.lambda_dir)] + [os.path.abspath(path) for path in args.compare]
+    handlers = [handler for handler in args.handlers
+                if all(os.path.exists(os.path.join(path, f"{handler}.py")) for path in lambda_dirs)]
+
+    results = []
+    for handler in handlers:
+        for lambda_dir in lambda_dirs:
+            try:
+                runs = [run_child(lambda_dir, handler, args.invocations) for _ in range(args.runs)]
+            except RuntimeError as e:
+                # An older checkout may not import under this Python; report it and go on
+                results.append({'handler': handler, 'lambda_dir': lambda_dir,
+                                'error': str(e).strip().splitlines()[-1]})
+                continue
+            warm = [invocation for run in runs for invocation in run['invocations'][1:]]
+            results.append({
+                'handler': handler,
+                'lambda_dir': lambda_dir,
+                'init': statistics.median(run['init'] for run in runs),
+                'clients_at_import': max(run['clients_at_import'] for run in runs),
+                'first': statistics.median(run['invocations'][0]['seconds'] for run in runs),
+                'first_ssm_calls': max(run['invocations'][0]['ssm_calls'] for run in runs),
+                'warm': statistics.median(invocation['seconds'] for invocation in warm) if warm else None,
+                'warm_ssm_calls': max((invocation['ssm_calls'] for invocation in warm), default=None)
+            })
+
+    print(f"\nLambda cold start, median of {args.runs} processes, {args.invocations} invocations each")
+    for index, lambda_dir in enumerate(lambda_dirs):
+        print(f"  [{index}] {lambda_dir}")
+    print(f"{'handler':<28}{'dir':>4}{'init ms':>10}{'clients':>9}{'first ms':>10}{'warm ms':>9}{'SSM first/warm':>16}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['handler']:<28}{lambda_dirs.index(result['lambda_dir']):>4}  failed: {result['error']}")
+            continue
+        warm = f"{result['warm'] * 1000:>9.1f}" if result['warm'] is not None else f"{'-':>9}"
+        print(f"{result['handler']:<28}{lambda_dirs.index(result['lambda_dir']):>4}{result['init'] * 1000:>10.1f}"
+              f"{result['clients_at_import']:>9}{result['first'] * 1000:>10.1f}{warm}"
+              f"{result['first_ssm_calls']:>11}/{result['warm_ssm_calls']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare data_pull's buffered and streaming downloads for peak memory and wall time.
+
+    python local/benchmark_data_pull.py --scale 500k --repeats 3
+
+A synthetic bulk file is served by the Scryfall stand-in (scryfall_stand_in.py) and
+uploaded to the moto S3 stand-in. Each run happens in a fresh child process, so its peak
+RSS covers only the download:
+    buffered   make_scryfall_request reads the whole body, then put_object
+    stream     download_to_s3, PART_SIZE parts with MAX_CONCURRENCY in flight
+Streaming can also be run with other part sizes and concurrency, e.g.
+    --stream-configs 8:2 16:4 32:8
+For each mode it reports the best wall time and throughput and the largest peak RSS above
+the child's baseline after imports. The streaming peak depends on the part size and
+concurrency (the part buffers plus botocore's copies of the parts being sent) but not on
+the file size; the buffered one grows with the file.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(REPO_ROOT, 'aws', 'lambda')]
+
+from synthetic_scryfall import SCALE_FACTORS, write_bulk_file
+
+MB = 1024 * 1024
+
+def child(mode, url, bucket, key, part_mb, concurrency):
+    """Run one download in this process and print its measurements as JSON"""
+    import time
+    import data_pull
+    from harness import PeakMemory
+
+    headers = {'User-Agent': 'MTGPriceTracker/1.0 (benchmark)', 'Accept': 'application/json'}
+    # Build the client before the baseline so it isn't counted as download memory
+    data_pull.s3.list_buckets()
+
+    # Sampled rather than ru_maxrss, which a child inherits from the process that forked it
+    with PeakMemory(interval=0.01) as memory:
+        baseline = memory.peak
+        start = time.perf_counter()
+        if mode == 'buffered':
+            response = data_pull.make_scryfall_request(url, headers)
+            data_pull.s3.put_object(Bucket=bucket, Key=key, Body=response.data)
+            total_bytes = len(response.data)
+        else:
+            total_bytes, _ = data_pull.download_to_s3(url, headers, bucket, key,
+                                                      part_size=part_mb * MB, max_concurrency=concurrency)
+        seconds = time.perf_counter() - start
+
+    print(json.dumps({'bytes': total_bytes, 'seconds': seconds, 'peak_above_baseline': memory.peak - baseline}))
+
+def run_child(mode, url, key, part_mb, concurrency):
+    from harness import PRIMARY_BUCKET
+
+    result = subprocess.run(
+        [sys.executable, __file__, '--child', mode, url, PRIMARY_BUCKET, key, str(part_mb), str(concurrency)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} download failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark data_pull buffered vs streaming downloads')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='90k')
+    parser.add_argument('--date', default='2025-06-01')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--stream-configs', nargs='+', default=None, metavar='PART_MB:CONCURRENCY',
+                        help='Streaming settings to compare; defaults to PART_SIZE:MAX_CONCURRENCY')
+    parser.add_argument('--child', nargs=6, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, url, bucket, key, part_mb, concurrency = args.child
+        child(mode, url, bucket, key, int(part_mb), int(concurrency))
+        return
+
+    import data_pull
+    from harness import configure_environment, provision, start_aws_stand_in
+    from scryfall_stand_in import ScryfallStandIn
+
+    _, endpoint_url = start_aws_stand_in()
+    configure_environment(endpoint_url)
+    provision()
+
+    stream_configs = args.stream_configs or [f"{data_pull.PART_SIZE // MB}:{data_pull.MAX_CONCURRENCY}"]
+    modes = [('buffered', 0, 0)] + [
+        (f"stream {config}", int(config.split(':')[0]), int(config.split(':')[1])) for config in stream_configs
+    ]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        bulk_path = os.path.join(work_dir, 'default_cards.json')
+        size, cards = write_bulk_file(bulk_path, SCALE_FACTORS[args.scale], args.date, args.seed)
+        print(f"Serving {cards} cards ({size / MB:.1f}MB)")
+
+        with ScryfallStandIn(bulk_path) as stand_in:
+            file_url = stand_in.bulk_data()['data'][0]['download_uri']
+            results = {}
+            for name, part_mb, concurrency in modes:
+                mode = 'buffered' if name == 'buffered' else 'stream'
+                runs = [run_child(mode, file_url, f"benchmark/{mode}_{run}.json", part_mb, concurrency)
+                        for run in range(args.repeats)]
+                if any(run['bytes'] != size for run in runs):
+                    raise RuntimeError(f"{name} uploaded {[run['bytes'] for run in runs]} bytes, expected {size}")
+                results[name] = {
+                    'seconds': min(run['seconds'] for run in runs),
+                    'peak_above_baseline': max(run['peak_above_baseline'] for run in runs)
+                }
+
+    print(f"\ndata_pull download of {size / MB:.1f}MB, best of {args.repeats}")
+    print(f"{'mode':<16}{'seconds':>10}{'MB/s':>10}{'peak RSS MB':>14}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['seconds']:>10.2f}{size / MB / result['seconds']:>10.1f}"
+              f"{result['peak_above_baseline'] / MB:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark final_processing's price-mover transform at the synthetic scale factors.
+
+    python local/benchmark_final_processing.py --scales 90k 500k 2m --repeats 3
+
+Each scale gets a synthetic query_athena result: every card with its static fields and a
+price on today and 1, 2 and 4 weeks ago (8% of card-days unpriced), rows shuffled. For each
+scale it reports the best-of-N time for
+    csv        process_csv on the CSV text, parse included, as the Lambda runs it
+    frame      process_frame on an already parsed frame
+    legacy     the per-card groupby loop process_csv used before it was vectorized
+The legacy loop takes minutes at 90k, so by default it only runs up to --legacy-max-cards,
+and there the published CSV columns must match it byte for byte. The loop's ratios are
+rounded as Python floats, the rounding the published diffs use (mtg_runtime.round_ratios).
+Budgets such as
+    --budget 90k=2 --budget 2m=40
+fail the run when the csv time at that scale goes over, so regressions are caught.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+import uuid
+from io import StringIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(REPO_ROOT, 'aws', 'lambda')]
+
+from synthetic_scryfall import CARDS_PER_SET, RARITIES, SCALE_FACTORS, SET_TYPES, SYLLABLES
+
+RUN_DATE = '2025-06-01'
+PRICED_SHARE = 0.92
+
+def synthetic_rows(cards, run_date, seed):
+    """A query_athena result for `cards` cards as a DataFrame, in arbitrary row order"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    words = np.array([a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES])
+    ids = [str(uuid.UUID(int=int(value), version=4)) for value in rng.integers(0, 2 ** 63, cards)]
+    set_index = np.arange(cards) // CARDS_PER_SET
+    set_count = int(set_index.max()) + 1
+    set_names = np.char.add(np.char.add(np.char.capitalize(rng.choice(words, set_count)), ' '),
+                            np.char.capitalize(rng.choice(words, set_count)))
+    released = pd.Timestamp(run_date) - pd.to_timedelta(rng.integers(0, 365 * 9, set_count), unit='D')
+    base = np.exp(rng.normal(-0.5, 1.4, cards)) * rng.choice([0.3, 0.6, 2, 5], cards)
+
+    static = pd.DataFrame({
+        'id': ids,
+        'tcgplayer_id': np.where(rng.random(cards) < 0.9, rng.integers(10_000, 600_000, cards), np.nan),
+        'name': np.char.add(np.char.add(np.char.capitalize(rng.choice(words, cards)), ' '),
+                            np.char.capitalize(rng.choice(words, cards))),
+        'set_name': set_names[set_index],
+        'set_type': np.array(SET_TYPES)[rng.integers(0, len(SET_TYPES), set_count)][set_index],
+        'rarity': rng.choice(RARITIES, cards),
+        'released_at': released.strftime('%Y-%m-%d')[set_index]
+    })
+
+    days = []
+    for weeks in [0, 1, 2, 4]:
+        pull_date = (pd.Timestamp(run_date) - pd.DateOffset(weeks=weeks)).strftime('%Y-%m-%d')
+        priced = rng.random(cards) < PRICED_SHARE
+        usd = np.maximum(np.round(base * np.exp(rng.normal(0, 0.08, cards)), 2), 0.01)
+        days.append(static[priced].assign(usd=usd[priced], pull_date=pull_date))
+
+    rows = pd.concat(days, ignore_index=True)
+    return rows.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def legacy_process(df, run_date):
+    """process_csv's transform before it was vectorized, kept as the reference output"""
+    import pandas as pd
+
+    df['pull_date'] = pd.to_datetime(df['pull_date'])
+    df['released_at'] = pd.to_datetime(df['released_at'])
+    today = pd.to_datetime(run_date).normalize()
+    one_week_ago = today - pd.DateOffset(weeks=1)
+    two_weeks_ago = today - pd.DateOffset(weeks=2)
+    four_weeks_ago = today - pd.DateOffset(weeks=4)
+
+    results = []
+    for id_, group in df.groupby('id'):
+        row = {
+            'id': id_,
+            'tcgplayer_id': f'https://www.tcgplayer.com/product/{int(float(group["tcgplayer_id"].iloc[0]))}'
+                            if not math.isnan(group['tcgplayer_id'].iloc[0]) else None,
+            'name': group['name'].iloc[0],
+            'set_name': group['set_name'].iloc[0],
+            'set_type': group['set_type'].iloc[0],
+            'released_at': group['released_at'].iloc[0].date()
+        }
+        today_price_data = group.loc[group['pull_date'] == today, ['usd', 'pull_date']].values
+        one_week_ago_price = group.loc[group['pull_date'] == one_week_ago, 'usd'].values
+        two_weeks_ago_price = group.loc[group['pull_date'] == two_weeks_ago, 'usd'].values
+        four_weeks_ago_price = group.loc[group['pull_date'] == four_weeks_ago, 'usd'].values
+
+        if len(today_price_data) > 0:
+            row['today_price'] = today_price_data[0][0]
+            row['today_price_date'] = today_price_data[0][1].date()
+        else:
+            row['today_price'] = None
+            row['today_price_date'] = None
+        row['1wk_ago_price'] = one_week_ago_price[0] if len(one_week_ago_price) > 0 else None
+        row['2wk_ago_price'] = two_weeks_ago_price[0] if len(two_weeks_ago_price) > 0 else None
+        row['4wk_ago_price'] = four_weeks_ago_price[0] if len(four_weeks_ago_price) > 0 else None
+
+        for period in ['1wk', '2wk', '4wk']:
+            if row[f'{period}_ago_price'] and row['today_price']:
+                # float() for Python's rounding; on the numpy scalars round() rounds as numpy does
+                row[f'{period}_diff'] = round(float(row['today_price']) / float(row[f'{period}_ago_price']), 4)
+            else:
+                row[f'{period}_diff'] = None
+
+        if row['today_price'] is not None and row['today_price'] >= 1:
+            results.append(row)
+
+    return pd.DataFrame(results).sort_values(by='4wk_diff', ascending=False).reset_index(drop=True)
+
+def best_of(repeats, run):
+    best, result = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def published_csv(df):
+    import final_processing
+    return df.to_csv(columns=final_processing.OUTPUT_COLUMNS, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the final_processing transform')
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALE_FACTORS), default=['90k', '500k', '2m'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--legacy-max-cards', type=int, default=90_000,
+                        help='Run the legacy loop (once) only at scales up to this many cards')
+    parser.add_argument('--budget', action='append', default=[], metavar='SCALE=SECONDS',
+                        help='Fail if the csv time at SCALE goes over, e.g. 2m=40')
+    args = parser.parse_args()
+
+    import pandas as pd
+    import final_processing
+
+    budgets = {scale: float(limit) for scale, limit in (budget.split('=', 1) for budget in args.budget)}
+    results = {}
+    for scale in args.scales:
+        cards = SCALE_FACTORS[scale]
+        rows = synthetic_rows(cards, RUN_DATE, args.seed)
+        csv_text = rows.to_csv(index=False)
+
+        csv_seconds, output = best_of(args.repeats, lambda: final_processing.process_csv(StringIO(csv_text), RUN_DATE))
+        frame = pd.read_csv(StringIO(csv_text))
+        frame_seconds, _ = best_of(args.repeats, lambda: final_processing.process_frame(frame.copy(), RUN_DATE))
+
+        legacy_seconds, identical = None, None
+        if cards <= args.legacy_max_cards:
+            legacy_seconds, legacy_output = best_of(1, lambda: legacy_process(pd.read_csv(StringIO(csv_text)), RUN_DATE))
+            identical = published_csv(output) == published_csv(legacy_output)
+
+        results[scale] = {'rows': len(rows), 'cards_out': len(output), 'csv': csv_seconds, 'frame': frame_seconds,
+                          'legacy': legacy_seconds, 'identical': identical}
+        print(f"{scale}: {results[scale]}")
+
+    print(f"\nfinal_processing transform, best of {args.repeats}")
+    print(f"{'scale':<8}{'rows':>10}{'cards out':>11}{'csv s':>9}{'frame s':>9}{'legacy s':>10}{'speedup':>9}  output")
+    failed = False
+    for scale, result in results.items():
+        legacy = f"{result['legacy']:>10.1f}{result['legacy'] / result['csv']:>8.0f}x" if result['legacy'] else f"{'-':>10}{'-':>9}"
+        match = {None: 'not compared', True: 'identical', False: 'DIFFERS'}[result['identical']]
+        print(f"{scale:<8}{result['rows']:>10}{result['cards_out']:>11}{result['csv']:>9.2f}{result['frame']:>9.2f}{legacy}  {match}")
+        if result['identical'] is False:
+            failed = True
+        if scale in budgets and result['csv'] > budgets[scale]:
+            print(f"Over budget: {scale} csv {result['csv']:.2f}s, budget {budgets[scale]}s")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
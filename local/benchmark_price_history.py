@@ -0,0 +1,179 @@
+"""
+Benchmark price_history's daily update and its card lookups against the moto stand-in.
+
+    python local/benchmark_price_history.py --cards 90000 --history-days 365 --updates 14
+
+An index is seeded directly with --history-days of synthetic prices per card, as a
+rebuild would leave it. Then --updates days are written as mtg_parquet and
+mtg_static_parquet partitions and merged with update_index, one run per day, with a few
+new cards each day. For each update it reports the wall time, the bytes written to the
+stand-in and the bucket files rewritten: a normal day only rewrites the tail and
+directory, and every COMPACT_AFTER_DAYS days the tail is folded into the buckets.
+
+Lookups then go through PriceHistoryIndex over HTTP to the stand-in: the first one loads
+the directory and tail, and --lookups random cards after it are timed one by one
+(p50/p95/p99). Sampled histories must match the prices that were written.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(REPO_ROOT, 'aws', 'lambda')]
+
+MB = 1024 * 1024
+NEW_CARDS_PER_DAY = 40
+
+def synthetic_ids(count, rng):
+    return [str(uuid.UUID(int=int(value), version=4)) for value in rng.integers(0, 2 ** 63, count)]
+
+def day_prices(base, rng):
+    """One day's (usd, usd_foil) per card, in cents-rounded float32, about 5% of foils missing"""
+    import numpy as np
+    usd = np.maximum(np.round(base * np.exp(rng.normal(0, 0.05, len(base))), 2), 0.01).astype('float32')
+    usd_foil = np.where(rng.random(len(base)) < 0.95, np.round(usd * 1.8, 2), np.nan).astype('float32')
+    return usd, usd_foil
+
+def seed_index(bucket, ids, base, first_day, history_days, rng):
+    """Publish a generation holding history_days of prices for every card. Returns the records, a row per card."""
+    import numpy as np
+    import price_history
+    from mtg_runtime import get_dates
+
+    dtype = price_history.record_dtype()
+    start_day = (first_day.date() - price_history.EPOCH).days
+    records = np.empty((len(ids), history_days), dtype=dtype)
+    records['day'] = np.arange(start_day, start_day + history_days)
+    for offset in range(history_days):
+        records['usd'][:, offset], records['usd_foil'][:, offset] = day_prices(base, rng)
+
+    histories = [{} for _ in range(price_history.NUM_BUCKETS)]
+    for row, card_id in enumerate(ids):
+        histories[price_history.bucket_for(card_id)][card_id] = records[row]
+
+    dates_dict = get_dates({'date': (first_day + timedelta(days=history_days - 1)).strftime('%Y-%m-%d')})
+    generation = price_history.new_generation(dates_dict)
+    bases = {}
+    for bucket_number, bucket_histories in enumerate(histories):
+        for card_id, offset, count in price_history.write_bucket(bucket, generation, bucket_number, bucket_histories):
+            bases[card_id] = (bucket_number, offset, count)
+    price_history.publish_generation(bucket, generation, None, None, price_history.empty_manifest(),
+                                     [generation] * price_history.NUM_BUCKETS, bases, np.empty(0, dtype='U36'),
+                                     np.empty(0, dtype=dtype), [], dates_dict)
+    return records
+
+def write_partitions(bucket, dates_dict, ids, usd, usd_foil):
+    """The day's mtg_parquet and mtg_static_parquet partitions, card_key being the position in ids"""
+    import boto3
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    partition = f"year={dates_dict['year']}/month={dates_dict['month']}/day={dates_dict['day']}"
+    keys = pa.array(range(len(ids)), pa.int32())
+    tables = {
+        'mtg_parquet': pa.table({'card_key': keys, 'usd': pa.array(usd, pa.float64(), from_pandas=True),
+                                 'usd_foil': pa.array(usd_foil, pa.float64(), from_pandas=True),
+                                 'pull_date': [dates_dict['formatted_date']] * len(ids)}),
+        'mtg_static_parquet': pa.table({'id': ids, 'card_key': keys})
+    }
+    s3 = boto3.client('s3')
+    for prefix, table in tables.items():
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+        s3.put_object(Bucket=bucket, Key=f"{prefix}/{partition}/part-00000.parquet", Body=buffer.getvalue())
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the price history index')
+    parser.add_argument('--cards', type=int, default=90_000)
+    parser.add_argument('--history-days', type=int, default=365)
+    parser.add_argument('--updates', type=int, default=14)
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--start-date', default='2024-06-01')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import numpy as np
+    from harness import PRIMARY_BUCKET, configure_environment, provision, start_aws_stand_in
+
+    counter, endpoint_url = start_aws_stand_in()
+    configure_environment(endpoint_url)
+    provision()
+
+    import price_history
+    from mtg_runtime import get_dates
+
+    rng = np.random.default_rng(args.seed)
+    first_day = datetime.strptime(args.start_date, '%Y-%m-%d')
+    ids = synthetic_ids(args.cards, rng)
+    base = np.exp(rng.normal(-0.5, 1.4, args.cards))
+
+    start = time.perf_counter()
+    seeded = seed_index(PRIMARY_BUCKET, ids, base, first_day, args.history_days, rng)
+    print(f"Seeded {args.cards} cards x {args.history_days} days in {time.perf_counter() - start:.1f}s")
+
+    # (day, usd, usd_foil) per update, indexed by card_key
+    written = []
+    updates = []
+    for offset in range(args.updates):
+        dates_dict = get_dates({'date': (first_day + timedelta(days=args.history_days + offset)).strftime('%Y-%m-%d')})
+        new_ids = synthetic_ids(NEW_CARDS_PER_DAY, rng)
+        ids += new_ids
+        base = np.concatenate([base, np.exp(rng.normal(-0.5, 1.4, NEW_CARDS_PER_DAY))])
+        usd, usd_foil = day_prices(base, rng)
+        write_partitions(PRIMARY_BUCKET, dates_dict, ids, usd, usd_foil)
+
+        day = (datetime.strptime(dates_dict['formatted_date'], '%Y-%m-%d').date() - price_history.EPOCH).days
+        written.append((day, usd, usd_foil))
+
+        bytes_before, _ = counter.snapshot()
+        start = time.perf_counter()
+        _, cards, buckets_written = price_history.update_index(PRIMARY_BUCKET, dates_dict)
+        seconds = time.perf_counter() - start
+        updates.append({'date': dates_dict['formatted_date'], 'seconds': seconds, 'cards': cards,
+                        'written': counter.snapshot()[0] - bytes_before, 'buckets': buckets_written})
+
+    index = price_history.PriceHistoryIndex(PRIMARY_BUCKET)
+    start = time.perf_counter()
+    index.get_card_history(ids[0])
+    first_lookup = time.perf_counter() - start
+
+    lookups = []
+    mismatches = 0
+    for row in rng.integers(0, len(ids), args.lookups):
+        start = time.perf_counter()
+        history = index.get_card_history(ids[row])
+        lookups.append(time.perf_counter() - start)
+        # Seeded cards' history, then every update that priced the card
+        expected = [tuple(record) for record in seeded[row]] if row < len(seeded) else []
+        expected += [(day, usd[row], usd_foil[row]) for day, usd, usd_foil in written if row < len(usd)]
+        want = [(int(day), round(float(price), 2), None if np.isnan(foil) else round(float(foil), 2))
+                for day, price, foil in expected]
+        got = [((datetime.strptime(record['pull_date'], '%Y-%m-%d').date() - price_history.EPOCH).days,
+                record['usd'], record['usd_foil']) for record in history]
+        mismatches += want != got
+
+    print(f"\nDaily updates, {price_history.NUM_BUCKETS} buckets, compaction every {price_history.COMPACT_AFTER_DAYS} days")
+    print(f"{'date':<12}{'cards':>9}{'seconds':>9}{'MB written':>12}{'buckets':>9}")
+    for update in updates:
+        print(f"{update['date']:<12}{update['cards']:>9}{update['seconds']:>9.2f}"
+              f"{update['written'] / MB:>12.1f}{update['buckets']:>9}")
+
+    print(f"\nLookups over HTTP: first {first_lookup * 1000:.0f}ms (loads directory and tail), then "
+          f"p50 {percentile(lookups, 0.5) * 1000:.1f}ms, p95 {percentile(lookups, 0.95) * 1000:.1f}ms, "
+          f"p99 {percentile(lookups, 0.99) * 1000:.1f}ms over {len(lookups)} cards")
+    if mismatches:
+        print(f"{mismatches} of {len(lookups)} sampled histories differ from the prices written")
+        sys.exit(1)
+    print(f"All {len(lookups)} sampled histories match the prices written")
+
+if __name__ == "__main__":
+    main()
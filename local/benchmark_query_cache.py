@@ -0,0 +1,95 @@
+"""
+Compare query_athena cold, warm and uncached on the local pipeline.
+
+    python local/benchmark_query_cache.py --scale 90k --days 29 --start-date 2025-05-04
+
+The days are first run through athena_add_partitions_all with the harness (so Spark and
+the DuckDB stand-in are needed, as for harness.py). Then, on the last day, each mode runs
+--repeats times:
+    uncached   slice_cache: false, the single 4-date query
+    cold       refresh_slices: true, a slice query per lookback day
+    warm       only today's slice missing, as on a normal morning after
+               athena_add_partitions_all has dropped it
+For each mode it reports the best wall time, Athena queries and bytes scanned, engine time,
+and the bytes copied into the handoff. The final_processing output must be identical in all
+three modes.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from harness import PRIMARY_BUCKET, run_pipeline
+from synthetic_scryfall import SCALE_FACTORS
+
+MODES = {
+    'uncached': {'slice_cache': False},
+    'cold': {'refresh_slices': True},
+    'warm': {}
+}
+
+def run_mode(date, mode, sink):
+    import final_processing
+    import query_athena
+    from mtg_runtime import clear_prefix
+
+    if mode == 'warm':
+        clear_prefix(PRIMARY_BUCKET, query_athena.slice_prefix(date))
+
+    emitted = len(sink.records)
+    start = time.perf_counter()
+    response = query_athena.lambda_handler(dict(MODES[mode], date=date), None)
+    seconds = time.perf_counter() - start
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"query_athena {mode} failed: {response['body']}")
+
+    metrics = sink.metrics('query_athena', since=emitted)
+    prefix = f"mtg_temp_daily/{date.replace('-', '')}_daily_out_raw/"
+    output = final_processing.process_parquet(PRIMARY_BUCKET, prefix, date)
+    return {
+        'seconds': seconds,
+        'queries': metrics.get('AthenaQueries', 0),
+        'scanned_bytes': metrics.get('AthenaDataScannedInBytes', 0),
+        'engine_ms': metrics.get('AthenaEngineExecutionTimeInMillis', 0),
+        'copied_bytes': metrics.get('BytesCopied', 0)
+    }, output
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the query_athena slice cache')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='90k')
+    parser.add_argument('--days', type=int, default=29, help='Days to load; 29 covers the 4 week lookback')
+    parser.add_argument('--start-date', default='2025-05-04')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_pipeline(args.scale, args.days, args.start_date, args.seed,
+                 stages=['data_pull', 'json_to_parquet', 'athena_add_partitions_all'])
+
+    import stage_metrics
+    sink = stage_metrics.MemorySink()
+    stage_metrics.set_sink(sink)
+
+    date = (datetime.strptime(args.start_date, '%Y-%m-%d') + timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+    results = {}
+    outputs = {}
+    for mode in MODES:
+        runs = [run_mode(date, mode, sink) for _ in range(args.repeats)]
+        results[mode] = min((run for run, _ in runs), key=lambda run: run['seconds'])
+        outputs[mode] = runs[-1][1]
+
+    print(f"\nquery_athena on {date}, {args.scale} cards, best of {args.repeats}")
+    print(f"{'mode':<10}{'seconds':>10}{'queries':>9}{'scanned MB':>12}{'engine ms':>11}{'copied MB':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<10}{result['seconds']:>10.2f}{result['queries']:>9}{result['scanned_bytes'] / (1024 * 1024):>12.2f}"
+              f"{result['engine_ms']:>11}{result['copied_bytes'] / (1024 * 1024):>11.2f}")
+
+    baseline = outputs['uncached']
+    mismatched = [mode for mode, output in outputs.items() if not output.equals(baseline)]
+    if mismatched:
+        print(f"Output differs from uncached for: {', '.join(mismatched)}")
+        sys.exit(1)
+    print("final_processing output identical in every mode")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Run the daily pipeline end to end off AWS and report per-stage cost.
+
+    python local/harness.py --scale 90k --days 29 --start-date 2025-05-04
+
+For each day, a synthetic Scryfall bulk file (synthetic_scryfall.py) is generated and
+published by a local Scryfall stand-in (scryfall_stand_in.py), and the stages run in order:
+    data_pull → json_to_parquet → confirm_parquet_created → athena_add_partitions_all
+    → movers → card_search → query_athena → final_processing
+S3, SSM and SNS are served by an in-process moto server, json_to_parquet runs on local
+Spark through s3a, and Athena SQL runs in DuckDB (athena_duckdb.py). Every stage reports
+wall time, peak RSS of this process and its children (the Spark JVM included), and the
+bytes it moved through the S3 stand-in, alongside the metrics the stage itself emitted
+(stage_metrics.py), which are captured in memory rather than printed. Budgets such as
+    --budget query_athena.AthenaDataScannedInBytes=50000000 --budget final_processing.seconds=5
+fail the run when any day goes over.
+
+Needs moto[server], duckdb, pyspark (with Java), pyarrow, pandas, numpy and psutil.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(REPO_ROOT, 'aws', 'lambda'), os.path.join(REPO_ROOT, 'aws', 'emr_serverless')]
+
+from scryfall_stand_in import ScryfallStandIn
+from synthetic_scryfall import SCALE_FACTORS, write_bulk_file
+
+REGION = 'us-west-2'
+PRIMARY_BUCKET = 'mtg-local-primary'
+OUTPUT_BUCKET = 'mtg-local-output'
+FINAL_OUTPUT_KEY = 'mtg_final/daily_prices.csv'
+
+# Must match the Hadoop version pyspark ships with
+HADOOP_AWS_PACKAGE = 'org.apache.hadoop:hadoop-aws:3.3.4'
+
+STAGES = ['data_pull', 'json_to_parquet', 'confirm_parquet_created', 'athena_add_partitions_all',
+          'movers', 'card_search', 'query_athena', 'final_processing']
+
+class ByteCounter:
+    """WSGI middleware counting request and response body bytes through the stand-in"""
+    def __init__(self, app):
+        self.app = app
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.bytes_in += int(environ.get('CONTENT_LENGTH') or 0)
+        for chunk in self.app(environ, start_response):
+            with self._lock:
+                self.bytes_out += len(chunk)
+            yield chunk
+
+    def snapshot(self):
+        with self._lock:
+            return self.bytes_in, self.bytes_out
+
+class PeakMemory:
+    """Samples RSS of this process and its children on a background thread"""
+    def __init__(self, interval=0.05):
+        import psutil
+
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _rss(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except Exception:
+                pass
+        return total
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_aws_stand_in():
+    """Start a moto server behind a ByteCounter. Returns (counter, endpoint_url)."""
+    from moto.server import DomainDispatcherApplication, create_backend_app
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    counter = ByteCounter(DomainDispatcherApplication(create_backend_app))
+    server = make_server('127.0.0.1', free_port(), counter, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return counter, f"http://127.0.0.1:{server.port}"
+
+def configure_environment(endpoint_url):
+    """Point boto3, pyarrow and Spark at the stand-in. Must run before any client exists."""
+    os.environ.update({
+        'AWS_ENDPOINT_URL': endpoint_url,
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_DEFAULT_REGION': REGION,
+        'AWS_REGION': REGION
+    })
+    spark_conf = {
+        'spark.master': 'local[*]',
+        'spark.hadoop.fs.s3.impl': 'org.apache.hadoop.fs.s3a.S3AFileSystem',
+        'spark.hadoop.fs.s3a.endpoint': endpoint_url,
+        'spark.hadoop.fs.s3a.path.style.access': 'true',
+        'spark.hadoop.fs.s3a.connection.ssl.enabled': 'false',
+        'spark.hadoop.fs.s3a.access.key': 'testing',
+        'spark.hadoop.fs.s3a.secret.key': 'testing',
+        'spark.hadoop.fs.s3a.aws.credentials.provider': 'org.apache.hadoop.fs.s3a.SimpleAWSCredentialsProvider'
+    }
+    # --conf values become JVM system properties, so every SparkSession json_to_parquet
+    # builds in this process picks them up
+    os.environ['PYSPARK_SUBMIT_ARGS'] = ' '.join(
+        [f"--packages {HADOOP_AWS_PACKAGE}"] + [f"--conf {name}={value}" for name, value in spark_conf.items()]
+        + ['pyspark-shell']
+    )
+
+def provision():
+    """Buckets, SSM parameters and the SNS topic the stages expect"""
+    import boto3
+
+    s3 = boto3.client('s3')
+    for bucket in [PRIMARY_BUCKET, OUTPUT_BUCKET]:
+        s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+
+    topic_arn = boto3.client('sns').create_topic(Name='mtg-local-status')['TopicArn']
+    ssm = boto3.client('ssm')
+    for name, value in {
+        '/mtg/s3/buckets/primary_bucket': PRIMARY_BUCKET,
+        '/mtg/s3/buckets/output_bucket': OUTPUT_BUCKET,
+        '/mtg/s3/paths/final_output_key': FINAL_OUTPUT_KEY,
+        '/mtg/sns/status_topic_arn': topic_arn
+    }.items():
+        ssm.put_parameter(Name=name, Value=value, Type='String', Overwrite=True)
+
+def check_handler(stage, response):
+    if isinstance(response, dict) and response.get('statusCode', 200) >= 400:
+        raise RuntimeError(f"{stage} failed: {json.dumps(response, default=str)[:2000]}")
+    return response
+
+def run_day(date, cards, seed, work_dir, stages):
+    """[(stage, callable)] for one day's requested stages, in pipeline order"""
+    import athena_add_partitions_all
+    import card_search
+    import confirm_parquet_created
+    import data_pull
+    import final_processing
+    import movers
+    import query_athena
+
+    event = {'date': date}
+
+    def pull():
+        # The day's file is published by a local Scryfall stand-in, and data_pull downloads,
+        # uploads and transcodes it as in production, filed under the simulated date
+        bulk_path = os.path.join(work_dir, f"all_cards_{date.replace('-', '')}.json")
+        write_bulk_file(bulk_path, cards, date, seed)
+        try:
+            with ScryfallStandIn(bulk_path, f"{date}T09:00:00.000+00:00") as stand_in:
+                data_pull.BULK_DATA_URL = stand_in.bulk_data_url
+                return check_handler('data_pull', data_pull.lambda_handler(dict(event, download=True), None))
+        finally:
+            os.remove(bulk_path)
+
+    def spark_job():
+        # Imported here so the other stages run without pyspark installed
+        import json_to_parquet
+        sys.argv = ['json_to_parquet.py', '--date', date]
+        json_to_parquet.main()
+
+    handlers = {
+        'data_pull': pull,
+        'json_to_parquet': spark_job,
+        'confirm_parquet_created': lambda: check_handler('confirm_parquet_created', confirm_parquet_created.lambda_handler(event, None)),
+        'athena_add_partitions_all': lambda: check_handler('athena_add_partitions_all', athena_add_partitions_all.lambda_handler(event, None)),
+        'movers': lambda: check_handler('movers', movers.lambda_handler(event, None)),
+        'card_search': lambda: check_handler('card_search', card_search.lambda_handler(event, None)),
+        'query_athena': lambda: check_handler('query_athena', query_athena.lambda_handler(event, None)),
+        'final_processing': lambda: check_handler('final_processing', final_processing.lambda_handler(event, None))
+    }
+    return [(stage, handlers[stage]) for stage in STAGES if stage in stages]
+
+def measure(stage, run, counter):
+    bytes_in_before, bytes_out_before = counter.snapshot()
+    start = time.perf_counter()
+    with PeakMemory() as memory:
+        run()
+    elapsed = time.perf_counter() - start
+    bytes_in_after, bytes_out_after = counter.snapshot()
+    return {
+        'stage': stage,
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(memory.peak / (1024 * 1024), 1),
+        'bytes_written': bytes_in_after - bytes_in_before,
+        'bytes_read': bytes_out_after - bytes_out_before
+    }
+
+def check_budgets(records, budgets):
+    """
+    budgets maps 'stage.metric' to the largest allowed value, where metric is a harness
+    measurement (seconds, peak_rss_mb, bytes_read, bytes_written) or an emitted metric.
+    Returns a message per record over budget.
+    """
+    violations = []
+    for budget, limit in budgets.items():
+        stage, metric = budget.split('.', 1)
+        for record in records:
+            value = record.get(metric, record['metrics'].get(metric))
+            if record['stage'] == stage and value is not None and value > limit:
+                violations.append(f"{budget} = {value} on {record['date']}, budget {limit}")
+    return violations
+
+def run_pipeline(scale, days, start_date, seed=42, stages=STAGES, report_path=None, budgets=None):
+    """
+    Run `days` consecutive days through the pipeline. Returns (per-stage records, budget
+    violations).
+    """
+    from datetime import datetime, timedelta
+
+    counter, endpoint_url = start_aws_stand_in()
+    configure_environment(endpoint_url)
+    provision()
+
+    # Stages emit their metrics into memory so each record can carry them
+    import stage_metrics
+    sink = stage_metrics.MemorySink()
+    stage_metrics.set_sink(sink)
+
+    # Athena calls go to DuckDB; everything else reaches the moto server through boto3
+    import mtg_runtime
+    from athena_duckdb import DuckDBAthena
+    mtg_runtime._clients[('athena', ())] = DuckDBAthena(
+        endpoint=endpoint_url.split('//', 1)[1],
+        region=REGION,
+        bytes_served=lambda: counter.snapshot()[1]
+    )
+
+    cards = SCALE_FACTORS[scale]
+    first_day = datetime.strptime(start_date, '%Y-%m-%d')
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for offset in range(days):
+            date = (first_day + timedelta(days=offset)).strftime('%Y-%m-%d')
+            for stage, run in run_day(date, cards, seed, work_dir, stages):
+                emitted = len(sink.records)
+                record = dict(measure(stage, run, counter), date=date)
+                record['metrics'] = sink.metrics(stage, since=emitted)
+                records.append(record)
+                print(json.dumps(record))
+
+    print_summary(records)
+    violations = check_budgets(records, budgets or {})
+    for violation in violations:
+        print(f"Over budget: {violation}")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump({'scale': scale, 'days': days, 'start_date': start_date, 'records': records,
+                       'budgets': budgets or {}, 'violations': violations}, f, indent=2)
+    return records, violations
+
+def print_summary(records):
+    print(f"\n{'stage':<28}{'runs':>6}{'mean s':>10}{'max s':>10}{'peak MB':>10}{'read MB':>10}{'written MB':>12}")
+    for stage in STAGES:
+        stage_records = [record for record in records if record['stage'] == stage]
+        if not stage_records:
+            continue
+        seconds = [record['seconds'] for record in stage_records]
+        print(f"{stage:<28}{len(stage_records):>6}{sum(seconds) / len(seconds):>10.2f}{max(seconds):>10.2f}"
+              f"{max(record['peak_rss_mb'] for record in stage_records):>10.0f}"
+              f"{sum(record['bytes_read'] for record in stage_records) / (1024 * 1024):>10.1f}"
+              f"{sum(record['bytes_written'] for record in stage_records) / (1024 * 1024):>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the MTG pipeline locally against stand-ins')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='90k')
+    parser.add_argument('--days', type=int, default=29, help='Consecutive days to run; 29 covers the 4 week lookback')
+    parser.add_argument('--start-date', default='2025-05-04')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--report', help='Write the per-stage records to this JSON file')
+    parser.add_argument('--budget', action='append', default=[], metavar='STAGE.METRIC=MAX',
+                        help='Fail if any day goes over, e.g. query_athena.AthenaDataScannedInBytes=5e7')
+    args = parser.parse_args()
+
+    budgets = {}
+    for budget in args.budget:
+        name, limit = budget.split('=', 1)
+        budgets[name] = float(limit)
+
+    _, violations = run_pipeline(args.scale, args.days, args.start_date, args.seed, args.stages, args.report, budgets)
+    if violations:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
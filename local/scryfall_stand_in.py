@@ -0,0 +1,168 @@
+"""
+A local stand-in for Scryfall's bulk-data API, serving a bulk file from disk.
+
+    GET /bulk-data              the listing; its default_cards entry points at the file
+    GET /default_cards.json     the file, honouring `Range: bytes=N-` with a 206
+
+data_pull reaches it once its BULK_DATA_URL is pointed at `stand_in.bulk_data_url`.
+Faults can be queued to exercise the retry and resume paths; each one applies to the
+next request for its path:
+    stand_in.fail(429)              answer with that status and an empty body
+    stand_in.drop_after(5_000_000)  close the connection after that many body bytes
+Setting `stand_in.ignore_range` answers every file request with the whole file, as a
+server without Range support would. Every request is recorded in `stand_in.requests` as
+(path, Range header, status).
+"""
+import http.server
+import json
+import os
+import threading
+
+BULK_DATA_PATH = '/bulk-data'
+FILE_PATH = '/default_cards.json'
+SEND_BYTES = 1024 * 1024
+
+class ScryfallStandIn:
+    def __init__(self, path=None, updated_at='2025-01-01T09:00:00.000+00:00'):
+        self.path = path
+        self.updated_at = updated_at
+        self.faults = []
+        self.requests = []
+        self.ignore_range = False
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve(self, path, updated_at):
+        """Publish a new file, as Scryfall does each day"""
+        self.path = path
+        self.updated_at = updated_at
+
+    def fail(self, status, path=FILE_PATH):
+        with self._lock:
+            self.faults.append({'path': path, 'status': status})
+
+    def drop_after(self, body_bytes, path=FILE_PATH):
+        with self._lock:
+            self.faults.append({'path': path, 'drop_after': body_bytes})
+
+    def next_fault(self, path):
+        with self._lock:
+            for fault in self.faults:
+                if fault['path'] == path:
+                    self.faults.remove(fault)
+                    return fault
+        return None
+
+    def record(self, path, range_header, status):
+        with self._lock:
+            self.requests.append((path, range_header, status))
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def bulk_data_url(self):
+        return self.url + BULK_DATA_PATH
+
+    def bulk_data(self):
+        return {
+            'object': 'list',
+            'has_more': False,
+            'data': [{
+                'object': 'bulk_data',
+                'type': 'default_cards',
+                'updated_at': self.updated_at,
+                'size': os.path.getsize(self.path),
+                'download_uri': self.url + FILE_PATH,
+                'content_type': 'application/json',
+                'content_encoding': 'gzip'
+            }]
+        }
+
+    def start(self):
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep-alive, like the real API, so dropped connections reach urllib3's pool
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                fault = stand_in.next_fault(self.path)
+                if fault and 'status' in fault:
+                    stand_in.record(self.path, range_header, fault['status'])
+                    self.send_response(fault['status'])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if self.path == BULK_DATA_PATH:
+                    body = json.dumps(stand_in.bulk_data()).encode('utf-8')
+                    stand_in.record(self.path, range_header, 200)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                if self.path != FILE_PATH:
+                    stand_in.record(self.path, range_header, 404)
+                    self.send_error(404)
+                    return
+
+                size = os.path.getsize(stand_in.path)
+                start = 0
+                if (range_header and not stand_in.ignore_range
+                        and range_header.startswith('bytes=') and range_header.endswith('-')):
+                    start = int(range_header[len('bytes='):-1])
+                if start >= size and size:
+                    stand_in.record(self.path, range_header, 416)
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{size}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                status = 206 if start else 200
+                stand_in.record(self.path, range_header, status)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(size - start))
+                if start:
+                    self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+                self.end_headers()
+
+                limit = fault['drop_after'] if fault else None
+                sent = 0
+                with open(stand_in.path, 'rb') as f:
+                    f.seek(start)
+                    while True:
+                        chunk = f.read(SEND_BYTES if limit is None else min(SEND_BYTES, limit - sent))
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                if limit is not None:
+                    # Short of Content-Length, so the client sees the connection drop mid-body
+                    self.wfile.flush()
+                    self.close_connection = True
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,181 @@
+"""
+Deterministic synthetic Scryfall default_cards bulk files.
+
+Every card is derived from (seed, card index) and every price from (seed, card index, day),
+so any day of any scale factor can be regenerated on its own and always yields the same
+bytes. Cards carry the fields json_to_parquet projects plus enough of the rest of a real
+Scryfall card object (type line, oracle text, legalities, image and purchase URIs) that
+file size and parse cost per card are in the same range as the real file.
+
+    python local/synthetic_scryfall.py --scale 90k --date 2025-06-01 --output /tmp/all_cards.json
+"""
+import argparse
+import json
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+
+SCALE_FACTORS = {
+    '90k': 90_000,
+    '500k': 500_000,
+    '2m': 2_000_000
+}
+
+# Day the synthetic catalog is anchored to; day indexes count from here
+EPOCH = datetime(2025, 1, 1)
+
+CARDS_PER_SET = 300
+SET_TYPES = ['expansion'] * 6 + ['core', 'masters', 'commander', 'draft_innovation', 'funny', 'promo']
+RARITIES = ['common'] * 10 + ['uncommon'] * 6 + ['rare'] * 3 + ['mythic']
+LANGS = ['en'] * 12 + ['ja', 'de', 'fr', 'it', 'es', 'pt', 'ko', 'ru', 'zhs']
+FORMATS = ['standard', 'future', 'historic', 'timeless', 'gladiator', 'pioneer', 'explorer', 'modern',
+           'legacy', 'pauper', 'vintage', 'penny', 'commander', 'oathbreaker', 'standardbrawl', 'brawl',
+           'alchemy', 'paupercommander', 'duel', 'oldschool', 'premodern', 'predh']
+SYLLABLES = ['ka', 'zor', 'el', 'mir', 'then', 'va', 'dra', 'sul', 'qua', 'rin', 'to', 'gath', 'or', 'lys', 'ne', 'bro']
+TYPES = ['Creature — Elf Druid', 'Instant', 'Sorcery', 'Artifact', 'Enchantment — Aura', 'Land',
+         'Legendary Creature — Human Wizard', 'Planeswalker — Jace', 'Creature — Dragon']
+
+# Share of cards that only appear partway through a run, and of cards whose static fields
+# change on a given day, so the static change set and movers see realistic churn
+LATE_CARD_SHARE = 0.02
+DAILY_STATIC_CHURN = 0.002
+
+def card_rng(seed, index):
+    return random.Random(seed * 1_000_003 + index)
+
+def day_rng(seed, index, day):
+    return random.Random((seed * 1_000_003 + index) * 10_007 + day)
+
+def word(rng, syllables=3):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+def set_info(seed, set_index):
+    rng = random.Random(seed * 7919 + set_index)
+    code = ''.join(chr(ord('a') + (set_index // 26 ** power) % 26) for power in range(3))
+    return {
+        'set': code,
+        'set_name': f"{word(rng)} {word(rng, 2)}",
+        'set_type': rng.choice(SET_TYPES),
+        'released_at': (EPOCH - timedelta(days=rng.randint(0, 365 * 12))).strftime('%Y-%m-%d')
+    }
+
+def first_day(seed, index, cards):
+    """Day index a card first appears on; most cards exist from the start"""
+    if index < cards * (1 - LATE_CARD_SHARE):
+        return -10_000
+    return card_rng(seed, index).randint(0, 120)
+
+def make_card(seed, index, day, sets):
+    rng = card_rng(seed, index)
+    card_set = sets[index // CARDS_PER_SET]
+    card_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    oracle_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    name = f"{word(rng)} {word(rng, 2)}"
+    rarity = rng.choice(RARITIES)
+    tcgplayer_id = rng.randint(10_000, 600_000) if rng.random() < 0.9 else None
+    base_usd = math.exp(rng.gauss(-0.5, 1.4)) * {'common': 0.3, 'uncommon': 0.6, 'rare': 2, 'mythic': 5}[rarity]
+    has_foil = rng.random() < 0.6
+    trend = rng.gauss(0, 0.003)
+
+    daily = day_rng(seed, index, day)
+    # A small share of cards get a static change on any given day
+    if daily.random() < DAILY_STATIC_CHURN:
+        tcgplayer_id = daily.randint(10_000, 600_000)
+
+    usd = base_usd * math.exp(trend * day + daily.gauss(0, 0.04))
+    usd_foil = usd * rng.uniform(1.2, 4) * math.exp(daily.gauss(0, 0.05)) if has_foil else None
+    priced = daily.random() < 0.92
+
+    return {
+        'object': 'card',
+        'id': card_id,
+        'oracle_id': oracle_id,
+        'multiverse_ids': [rng.randint(1, 700_000)],
+        'mtgo_id': rng.randint(1, 130_000) if rng.random() < 0.5 else None,
+        'mtgo_foil_id': rng.randint(1, 130_000) if rng.random() < 0.3 else None,
+        'tcgplayer_id': tcgplayer_id,
+        'cardmarket_id': rng.randint(1, 800_000) if rng.random() < 0.85 else None,
+        'name': name,
+        'lang': rng.choice(LANGS),
+        'released_at': card_set['released_at'],
+        'uri': f"https://api.scryfall.com/cards/{card_id}",
+        'scryfall_uri': f"https://scryfall.com/card/{card_set['set']}/{index % CARDS_PER_SET}",
+        'layout': 'normal',
+        'highres_image': True,
+        'image_status': 'highres_scan',
+        'image_uris': {
+            size: f"https://cards.scryfall.io/{size}/front/{card_id[0]}/{card_id[1]}/{card_id}.jpg"
+            for size in ['small', 'normal', 'large', 'png', 'art_crop', 'border_crop']
+        },
+        'mana_cost': '{' + str(rng.randint(1, 6)) + '}{G}',
+        'cmc': float(rng.randint(1, 7)),
+        'type_line': rng.choice(TYPES),
+        'oracle_text': ' '.join(word(rng, 2).lower() for _ in range(rng.randint(8, 40))),
+        'colors': [rng.choice('WUBRG')],
+        'color_identity': [rng.choice('WUBRG')],
+        'keywords': [],
+        'legalities': {fmt: rng.choice(['legal', 'not_legal']) for fmt in FORMATS},
+        'games': ['paper', 'mtgo'],
+        'reserved': False,
+        'foil': has_foil,
+        'nonfoil': True,
+        'finishes': ['nonfoil', 'foil'] if has_foil else ['nonfoil'],
+        'set_id': str(uuid.UUID(int=random.Random(seed * 7919 + index // CARDS_PER_SET).getrandbits(128), version=4)),
+        'set': card_set['set'],
+        'set_name': card_set['set_name'],
+        'set_type': card_set['set_type'],
+        'collector_number': str(index % CARDS_PER_SET + 1),
+        'rarity': rarity,
+        'artist': f"{word(rng, 2)} {word(rng, 2)}",
+        'border_color': 'black',
+        'frame': '2015',
+        'prices': {
+            'usd': f"{usd:.2f}" if priced else None,
+            'usd_foil': f"{usd_foil:.2f}" if priced and usd_foil else None,
+            'usd_etched': None,
+            'eur': f"{usd * 0.92:.2f}" if priced else None,
+            'eur_foil': None,
+            'tix': f"{usd * 0.1:.2f}" if priced else None
+        },
+        'purchase_uris': {
+            'tcgplayer': f"https://www.tcgplayer.com/product/{tcgplayer_id}",
+            'cardmarket': f"https://www.cardmarket.com/en/Magic/Products/Search?searchString={name.replace(' ', '+')}",
+            'cardhoarder': f"https://www.cardhoarder.com/cards/{index}"
+        }
+    }
+
+def write_bulk_file(path, cards, date, seed=42):
+    """
+    Write the day's default_cards JSON array to path, one card per line like Scryfall's
+    file. Returns (bytes written, cards written).
+    """
+    day = (datetime.strptime(date, '%Y-%m-%d') - EPOCH).days
+    sets = [set_info(seed, set_index) for set_index in range(cards // CARDS_PER_SET + 1)]
+
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for index in range(cards):
+            if first_day(seed, index, cards) > day:
+                continue
+            f.write((',\n' if written else '') + json.dumps(make_card(seed, index, day, sets), ensure_ascii=False))
+            written += 1
+        f.write('\n]\n')
+        size = f.tell()
+
+    return size, written
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Scryfall default_cards bulk file')
+    parser.add_argument('--scale', choices=sorted(SCALE_FACTORS), default='90k')
+    parser.add_argument('--date', required=True, help='Day to generate, YYYY-MM-DD')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    size, written = write_bulk_file(args.output, SCALE_FACTORS[args.scale], args.date, args.seed)
+    print(f"Wrote {written} cards ({size / (1024 * 1024):.1f}MB) to {args.output}")
+
+if __name__ == "__main__":
+    main()
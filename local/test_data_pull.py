@@ -0,0 +1,250 @@
+"""
+data_pull's download engine against a local Scryfall stand-in that drops connections and
+answers 429, with S3 mocked by moto.
+
+    python -m pytest local/test_data_pull.py
+
+Needs pytest, moto, boto3 and urllib3.
+"""
+import hashlib
+import json
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(os.path.dirname(HERE), 'aws', 'lambda')]
+
+from moto import mock_aws
+from scryfall_stand_in import FILE_PATH, ScryfallStandIn
+from synthetic_scryfall import write_bulk_file
+
+BUCKET = 'mtg-test-primary'
+MB = 1024 * 1024
+# S3's smallest non-final part, so a few MB of data makes several parts
+PART_SIZE = 5 * MB
+UPDATED_AT = '2025-06-01T09:00:00.000+00:00'
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('AWS_ENDPOINT_URL', raising=False)
+
+    import mtg_runtime
+    import stage_metrics
+    mtg_runtime._clients.clear()
+    mtg_runtime._parameter_cache.clear()
+    stage_metrics.set_sink(stage_metrics.MemorySink())
+
+    with mock_aws():
+        client = mtg_runtime.get_client('s3')
+        client.create_bucket(Bucket=BUCKET)
+        mtg_runtime.get_client('ssm').put_parameter(Name='/mtg/s3/buckets/primary_bucket', Value=BUCKET, Type='String')
+        yield client
+    mtg_runtime._clients.clear()
+    mtg_runtime._parameter_cache.clear()
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    import data_pull
+    sleeps = []
+    monkeypatch.setattr(data_pull.time, 'sleep', sleeps.append)
+    return sleeps
+
+@pytest.fixture
+def payload(tmp_path):
+    data = os.urandom(3 * PART_SIZE + 12345)
+    path = tmp_path / 'default_cards.json'
+    path.write_bytes(data)
+    return path, data
+
+@pytest.fixture
+def stand_in(payload):
+    with ScryfallStandIn(str(payload[0]), UPDATED_AT) as server:
+        yield server
+
+def download(stand_in, key, expected_size, **kwargs):
+    import data_pull
+    return data_pull.download_to_s3(stand_in.url + FILE_PATH, {}, BUCKET, key, expected_size=expected_size,
+                                    updated_at=stand_in.updated_at, part_size=PART_SIZE, **kwargs)
+
+def file_requests(stand_in):
+    return [(range_header, status) for path, range_header, status in stand_in.requests if path == FILE_PATH]
+
+def uploads_in_progress(s3):
+    return s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads', [])
+
+def object_bytes(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+def test_streams_whole_file(s3, stand_in, payload):
+    _, data = payload
+    total_bytes, content_hash = download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert total_bytes == len(data)
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+    assert file_requests(stand_in) == [(None, 200)]
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET, Prefix='mtg_temp_json/_progress/')
+
+def test_resumes_dropped_connection_with_range(s3, stand_in, payload):
+    _, data = payload
+    stand_in.drop_after(int(2.5 * PART_SIZE))
+    total_bytes, content_hash = download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    # Only the two whole parts were committed; the half part is fetched again
+    assert file_requests(stand_in) == [(None, 200), (f"bytes={2 * PART_SIZE}-", 206)]
+    assert total_bytes == len(data)
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+
+def test_resumes_repeated_drops(s3, stand_in, payload):
+    _, data = payload
+    for _ in range(3):
+        stand_in.drop_after(PART_SIZE + 100)
+    download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert [range_header for range_header, _ in file_requests(stand_in)] == [
+        None, f"bytes={PART_SIZE}-", f"bytes={2 * PART_SIZE}-", f"bytes={3 * PART_SIZE}-"
+    ]
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+
+def test_retries_rate_limits(s3, stand_in, payload, no_sleep):
+    _, data = payload
+    stand_in.fail(429)
+    stand_in.fail(429)
+    _, content_hash = download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert file_requests(stand_in) == [(None, 429), (None, 429), (None, 200)]
+    # Exponential backoff between attempts
+    assert no_sleep == [1, 2]
+    assert content_hash == hashlib.sha256(data).hexdigest()
+
+def test_rate_limit_on_resume(s3, stand_in, payload, no_sleep):
+    _, data = payload
+    stand_in.drop_after(PART_SIZE + 100)
+    stand_in.fail(429)
+    download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert file_requests(stand_in) == [(None, 200), (f"bytes={PART_SIZE}-", 429), (f"bytes={PART_SIZE}-", 206)]
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+
+def test_gives_up_after_max_resumes_and_keeps_progress(s3, stand_in, payload):
+    _, data = payload
+    for _ in range(2):
+        stand_in.drop_after(PART_SIZE + 100)
+    with pytest.raises(Exception, match='dropped 2 times'):
+        download(stand_in, 'mtg_temp_json/a.json', len(data), max_resumes=1)
+
+    progress = json.loads(object_bytes(s3, 'mtg_temp_json/_progress/a.json.progress.json'))
+    assert [part['PartNumber'] for part in progress['parts']] == [1, 2]
+    assert len(uploads_in_progress(s3)) == 1
+
+def test_next_invocation_continues_saved_progress(s3, stand_in, payload):
+    _, data = payload
+    stand_in.drop_after(2 * PART_SIZE + 100)
+    with pytest.raises(Exception):
+        download(stand_in, 'mtg_temp_json/a.json', len(data), max_resumes=0)
+
+    # A retried invocation starts with no in-memory state at all
+    total_bytes, content_hash = download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert file_requests(stand_in)[-1] == (f"bytes={2 * PART_SIZE}-", 206)
+    assert total_bytes == len(data)
+    # Parts from the earlier invocation were never hashed here, so the object is hashed instead
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+    assert uploads_in_progress(s3) == []
+
+def test_new_snapshot_aborts_stale_upload(s3, stand_in, payload):
+    _, data = payload
+    stand_in.drop_after(PART_SIZE + 100)
+    with pytest.raises(Exception):
+        download(stand_in, 'mtg_temp_json/a.json', len(data), max_resumes=0)
+    stale_upload = uploads_in_progress(s3)[0]['UploadId']
+
+    stand_in.serve(stand_in.path, '2025-06-02T09:00:00.000+00:00')
+    download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    # The old upload is gone and the new snapshot was fetched from the start
+    assert stale_upload and uploads_in_progress(s3) == []
+    assert file_requests(stand_in)[-1] == (None, 200)
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+
+def test_restarts_when_range_is_ignored(s3, stand_in, payload):
+    _, data = payload
+    stand_in.ignore_range = True
+    stand_in.drop_after(PART_SIZE + 100)
+    _, content_hash = download(stand_in, 'mtg_temp_json/a.json', len(data))
+
+    assert file_requests(stand_in) == [(None, 200), (f"bytes={PART_SIZE}-", 200)]
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert object_bytes(s3, 'mtg_temp_json/a.json') == data
+
+def test_size_mismatch_aborts_upload(s3, stand_in, payload):
+    _, data = payload
+    with pytest.raises(Exception, match='Size mismatch'):
+        download(stand_in, 'mtg_temp_json/a.json', len(data) + 1)
+
+    assert uploads_in_progress(s3) == []
+    assert 'Contents' not in s3.list_objects_v2(Bucket=BUCKET, Prefix='mtg_temp_json/')
+
+def test_handler_skips_unchanged_snapshots(s3, tmp_path, monkeypatch, no_sleep):
+    import data_pull
+    import mtg_runtime
+
+    bulk_path = str(tmp_path / 'bulk.json')
+    _, cards = write_bulk_file(bulk_path, 50, '2025-06-01')
+    with ScryfallStandIn(bulk_path, UPDATED_AT) as server:
+        monkeypatch.setattr(data_pull, 'BULK_DATA_URL', server.bulk_data_url)
+
+        first = data_pull.lambda_handler({}, None)
+        manifest = json.loads(object_bytes(s3, data_pull.MANIFEST_KEY))
+        with open(bulk_path, 'rb') as f:
+            assert manifest['content_hash'] == hashlib.sha256(f.read()).hexdigest()
+        assert first['new_data'] is True
+        assert manifest['records'] == cards
+        assert manifest['status'] == 'pending'
+
+        # Not yet loaded downstream, so a retried pipeline processes the snapshot again
+        downloads = len(file_requests(server))
+        assert data_pull.lambda_handler({}, None)['new_data'] is True
+        assert len(file_requests(server)) == downloads + 1
+
+        # Once athena_add_partitions_all commits it, same updated_at and size: no download at all
+        assert mtg_runtime.commit_snapshot(BUCKET, [manifest['pull_date']])
+        downloads = len(file_requests(server))
+        assert data_pull.lambda_handler({}, None)['new_data'] is False
+        assert len(file_requests(server)) == downloads
+
+        # Republished with identical bytes, fetched buffered: downloaded, but no new data
+        server.serve(bulk_path, '2025-06-02T09:00:00.000+00:00')
+        republished = data_pull.lambda_handler({'upload_mode': 'buffered'}, None)
+        assert len(file_requests(server)) == downloads + 1
+        assert republished['new_data'] is False
+        assert json.loads(object_bytes(s3, data_pull.MANIFEST_KEY))['status'] == 'committed'
+
+def test_dated_download_files_under_event_date(s3, tmp_path, monkeypatch, no_sleep):
+    import data_pull
+
+    bulk_path = str(tmp_path / 'bulk.json')
+    _, cards = write_bulk_file(bulk_path, 50, '2025-06-03')
+    with ScryfallStandIn(bulk_path, UPDATED_AT) as server:
+        monkeypatch.setattr(data_pull, 'BULK_DATA_URL', server.bulk_data_url)
+
+        # Without download a dated event replays the retained raw file, which isn't there
+        with pytest.raises(s3.exceptions.NoSuchKey):
+            data_pull.lambda_handler({'date': '2025-06-03'}, None)
+        assert file_requests(server) == []
+
+        response = data_pull.lambda_handler({'date': '2025-06-03', 'download': True}, None)
+        assert response['new_data'] is True
+        assert len(file_requests(server)) == 1
+
+    with open(bulk_path, 'rb') as f:
+        assert object_bytes(s3, 'mtg_temp_json/all_cards_20250603.json') == f.read()
+    manifest = json.loads(object_bytes(s3, data_pull.MANIFEST_KEY))
+    assert (manifest['pull_date'], manifest['records']) == ('2025-06-03', cards)
@@ -20,7 +20,7 @@ $$
         ,s.SET_NAME
         ,s.ID
         ,'https://www.tcgplayer.com/product/' || s.TCGPLAYER_ID AS tcgplayer_url
-        ,COUNT(p.ID) AS price_records_count
+        ,COUNT(p.CARD_KEY) AS price_records_count
         ,ROUND(AVG(p.USD), 2) AS avg_price
         ,ROUND(MIN(p.USD), 2) AS avg_price
         ,ROUND(MAX(p.USD), 2) AS avg_price
@@ -28,7 +28,7 @@ $$
         ,ROUND(MIN(p.USD_FOIL), 2) AS avg_price
         ,ROUND(MAX(p.USD_FOIL), 2) AS avg_price
     FROM MTG_COST.PUBLIC.MTG_STATIC s
-    LEFT JOIN MTG_COST.PUBLIC.MTG_PRICES p ON s.ID = p.ID
+    LEFT JOIN MTG_COST.PUBLIC.MTG_PRICES p ON s.CARD_KEY = p.CARD_KEY
     WHERE (card_name IS NULL OR card_name = '' OR LOWER(s.NAME) LIKE '%' || LOWER(card_name) || '%')
       AND (set_search IS NULL OR set_search = '' OR LOWER(s.SET_NAME) LIKE '%' || LOWER(set_search) || '%')
     GROUP BY s.NAME, s.SET_NAME, s.ID, s.TCGPLAYER_ID
@@ -36,4 +36,5 @@ $$
     LIMIT 10000
 $$;
 
--- SELECT * FROM TABLE(MTG_COST.PUBLIC.GET_CARD_ID('squall', 'final')) LIMIT 100;
\ No newline at end of file
+-- SELECT * FROM TABLE(MTG_COST.PUBLIC.GET_CARD_ID('squall', 'final')) LIMIT 100;
+-- For interactive search, aws/lambda/card_search.py serves the same rows from a daily S3 index without a warehouse query.
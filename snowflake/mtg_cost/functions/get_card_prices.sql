@@ -14,8 +14,8 @@ SELECT
     ,price.usd_foil
     ,price.pull_date
 FROM "MTG_COST"."PUBLIC"."MTG_PRICES" AS price
-LEFT JOIN "MTG_COST"."PUBLIC"."MTG_STATIC" AS static ON price.id = static.id
-WHERE price.id = card_id
+LEFT JOIN "MTG_COST"."PUBLIC"."MTG_STATIC" AS static ON price.card_key = static.card_key
+WHERE static.id = card_id
 ORDER BY price.pull_date
 $$;
 
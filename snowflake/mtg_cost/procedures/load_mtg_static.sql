@@ -1,42 +1,69 @@
 CREATE OR REPLACE PROCEDURE MTG_COST.PUBLIC.LOAD_MTG_STATIC(
     load_date DATE DEFAULT CURRENT_DATE()
+    ,full_load BOOLEAN DEFAULT FALSE
 )
 RETURNS STRING
 LANGUAGE SQL
 AS
 $$
 DECLARE
-    current_date_str STRING;
+    since_date DATE;
+    days_to_load INTEGER;
     file_path STRING;
+    loaded_paths STRING DEFAULT '';
     result_msg STRING;
-    rows_merged INTEGER;
+    rows_staged INTEGER;
     rows_inserted INTEGER;
     rows_updated INTEGER;
     rows_skipped INTEGER;
 BEGIN
-    -- Get date in YYYYMMDD format (using parameter or current date)
-    current_date_str := TO_CHAR(load_date, 'YYYYMMDD');
-    
-    -- Build dynamic file path
-    file_path := '@s3_mtg_static_stage/year=' || YEAR(load_date) || 
-                '/month=' || LPAD(MONTH(load_date), 2, '0') || 
-                '/day=' || LPAD(DAY(load_date), 2, '0') || 
-                '/';
-
     -- Step 1: Create temporary staging table
     CREATE OR REPLACE TEMPORARY TABLE temp_mtg_static_weekly LIKE MTG_COST.PUBLIC.MTG_STATIC;
-    
-    -- Step 2: Load new data into staging table using dynamic path
-    EXECUTE IMMEDIATE 'COPY INTO temp_mtg_static_weekly FROM ' || file_path || 
-                    ' PATTERN = ''.*\.parquet$'' ' ||
-                    ' FILE_FORMAT = (TYPE = ''PARQUET'') MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE';
 
-    -- Step 3: Merge from staging table with date-based logic
+    -- Step 2: Stage the rows to merge. json_to_parquet writes a change set per day holding
+    -- only inserted and changed cards, so load every day's change set since the newest
+    -- PULL_DATE already in MTG_STATIC. full_load stages the whole snapshot for load_date instead.
+    IF (full_load) THEN
+        file_path := '@s3_mtg_static_stage/year=' || YEAR(load_date) ||
+                    '/month=' || LPAD(MONTH(load_date), 2, '0') ||
+                    '/day=' || LPAD(DAY(load_date), 2, '0') ||
+                    '/';
+        EXECUTE IMMEDIATE 'COPY INTO temp_mtg_static_weekly FROM ' || file_path ||
+                        ' PATTERN = ''.*\.parquet$'' ' ||
+                        ' FILE_FORMAT = (TYPE = ''PARQUET'') MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE';
+        loaded_paths := file_path;
+    ELSE
+        since_date := (SELECT COALESCE(MAX(PULL_DATE), DATEADD(day, -1, :load_date)) FROM MTG_COST.PUBLIC.MTG_STATIC);
+        -- A rerun for a day already loaded reloads just that day
+        since_date := LEAST(since_date, DATEADD(day, -1, load_date));
+        days_to_load := DATEDIFF(day, since_date, load_date);
+
+        FOR i IN 1 TO days_to_load DO
+            LET change_date DATE := DATEADD(day, i, since_date);
+            file_path := '@s3_mtg_static_changes_stage/year=' || YEAR(change_date) ||
+                        '/month=' || LPAD(MONTH(change_date), 2, '0') ||
+                        '/day=' || LPAD(DAY(change_date), 2, '0') ||
+                        '/';
+            EXECUTE IMMEDIATE 'COPY INTO temp_mtg_static_weekly FROM ' || file_path ||
+                            ' PATTERN = ''.*\.parquet$'' ' ||
+                            ' FILE_FORMAT = (TYPE = ''PARQUET'') MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE';
+            loaded_paths := loaded_paths || file_path || ' ';
+        END FOR;
+    END IF;
+
+    rows_staged := (SELECT COUNT(DISTINCT ID) FROM temp_mtg_static_weekly);
+
+    -- Step 3: Merge the newest staged row per card with date-based logic
     MERGE INTO MTG_COST.PUBLIC.MTG_STATIC AS target
-    USING temp_mtg_static_weekly AS source
+    USING (
+        SELECT *
+        FROM temp_mtg_static_weekly
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY ID ORDER BY PULL_DATE DESC) = 1
+    ) AS source
     ON target.ID = source.ID
     WHEN MATCHED AND source.PULL_DATE > target.PULL_DATE THEN
     UPDATE SET
+        CARD_KEY = source.CARD_KEY,
         ORACLE_ID = source.ORACLE_ID,
         MTGO_ID = source.MTGO_ID,
         MTGO_FOIL_ID = source.MTGO_FOIL_ID,
@@ -51,43 +78,36 @@ BEGIN
         RARITY = source.RARITY,
         PULL_DATE = source.PULL_DATE
     WHEN NOT MATCHED THEN
-        INSERT (ID, ORACLE_ID, MTGO_ID, MTGO_FOIL_ID, TCGPLAYER_ID, CARDMARKET_ID, 
+        INSERT (ID, CARD_KEY, ORACLE_ID, MTGO_ID, MTGO_FOIL_ID, TCGPLAYER_ID, CARDMARKET_ID,
             NAME, LANG, RELEASED_AT, SET_NAME, SET_ABBR, SET_TYPE, RARITY, PULL_DATE)
-        VALUES (source.ID, source.ORACLE_ID, source.MTGO_ID, source.MTGO_FOIL_ID, 
-            source.TCGPLAYER_ID, source.CARDMARKET_ID, source.NAME, source.LANG, 
-            source.RELEASED_AT, source.SET_NAME, source.SET_ABBR, source.SET_TYPE, 
+        VALUES (source.ID, source.CARD_KEY, source.ORACLE_ID, source.MTGO_ID, source.MTGO_FOIL_ID,
+            source.TCGPLAYER_ID, source.CARDMARKET_ID, source.NAME, source.LANG,
+            source.RELEASED_AT, source.SET_NAME, source.SET_ABBR, source.SET_TYPE,
             source.RARITY, source.PULL_DATE);
-    
-    -- Get detailed merge results
-    rows_inserted := (SELECT COUNT(*) FROM temp_mtg_static_weekly t WHERE NOT EXISTS 
-                      (SELECT 1 FROM MTG_COST.PUBLIC.MTG_STATIC m WHERE m.ID = t.ID));
-    
-    rows_updated := (SELECT COUNT(*) FROM temp_mtg_static_weekly t 
-                     WHERE EXISTS (SELECT 1 FROM MTG_COST.PUBLIC.MTG_STATIC m 
-                                  WHERE m.ID = t.ID AND t.PULL_DATE > m.PULL_DATE));
-    
-    rows_skipped := (SELECT COUNT(*) FROM temp_mtg_static_weekly t 
-                     WHERE EXISTS (SELECT 1 FROM MTG_COST.PUBLIC.MTG_STATIC m 
-                                  WHERE m.ID = t.ID AND t.PULL_DATE <= m.PULL_DATE));
-    
-    rows_merged := rows_inserted + rows_updated;
-    
+
+    -- Merge statistics come from the MERGE itself rather than re-querying MTG_STATIC
+    SELECT "number of rows inserted", "number of rows updated"
+    INTO :rows_inserted, :rows_updated
+    FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+
+    rows_skipped := rows_staged - rows_inserted - rows_updated;
+
     -- Step 4: Clean up
     DROP TABLE temp_mtg_static_weekly;
-    
+
     -- Return success message with details
-    result_msg := 'MTG Static data load completed successfully. File: ' || file_path || 
-                  '. Rows inserted: ' || rows_inserted || ', Rows updated: ' || rows_updated || 
-                  ', Rows skipped (older data): ' || rows_skipped || 
-                  ', Total processed: ' || rows_merged;
-    
+    result_msg := 'MTG Static data load completed successfully. Files: ' || loaded_paths ||
+                  '. Rows inserted: ' || rows_inserted || ', Rows updated: ' || rows_updated ||
+                  ', Rows skipped (older data): ' || rows_skipped ||
+                  ', Total processed: ' || (rows_inserted + rows_updated);
+
     RETURN result_msg;
-    
+
 EXCEPTION
     WHEN OTHER THEN
         -- Clean up in case of error
         DROP TABLE IF EXISTS temp_mtg_static_weekly;
-        RETURN 'Error occurred during MTG Static data load. File: ' || file_path || 
+        RETURN 'Error occurred during MTG Static data load. Files: ' || loaded_paths ||
                '. Error: ' || SQLERRM;
 END;
 $$;
\ No newline at end of file
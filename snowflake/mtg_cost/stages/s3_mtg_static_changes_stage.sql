@@ -0,0 +1,7 @@
+CREATE OR REPLACE STAGE s3_mtg_static_changes_stage
+	URL = 's3://${MTG_PRIMARY_BUCKET}/mtg_static_changes/'
+	CREDENTIALS = (
+	AWS_KEY_ID = '{{AWS_ACCESS_KEY_ID}}' 
+	AWS_SECRET_KEY = '{{AWS_SECRET_ACCESS_KEY}}'
+	)
+	FILE_FORMAT = (TYPE = 'PARQUET');
\ No newline at end of file
@@ -1,5 +1,5 @@
-CREATE OR REPLACE TABLE MTG_COST.PUBLIC.MTG_PRICES cluster by (ID) (
-	 ID VARCHAR(36)
+CREATE OR REPLACE TABLE MTG_COST.PUBLIC.MTG_PRICES cluster by (CARD_KEY) (
+	 CARD_KEY NUMBER(10,0)
 	,USD NUMBER(8,2)
 	,USD_FOIL NUMBER(8,2)
 	,PULL_DATE DATE
@@ -1,5 +1,6 @@
 CREATE OR REPLACE TABLE MTG_COST.PUBLIC.MTG_STATIC (
 	,ID VARCHAR(36)
+	,CARD_KEY NUMBER(10,0)
 	,ORACLE_ID VARCHAR(36)
 	,MTGO_ID NUMBER(10,0)
 	,MTGO_FOIL_ID NUMBER(10,0)
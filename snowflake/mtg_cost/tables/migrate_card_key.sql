@@ -0,0 +1,29 @@
+-- One-time move of MTG_PRICES from the UUID ID to the integer CARD_KEY.
+-- Run after json_to_parquet has written at least one static partition with card_key.
+
+ALTER TABLE MTG_COST.PUBLIC.MTG_STATIC ADD COLUMN CARD_KEY NUMBER(10,0);
+
+UPDATE MTG_COST.PUBLIC.MTG_STATIC AS static
+SET CARD_KEY = keyed.CARD_KEY
+FROM (
+    -- A card's key never changes, so take it from the newest partition holding the card.
+    -- Partitions from before card_key existed read it as NULL and are skipped.
+    SELECT $1:id::VARCHAR AS ID, $1:card_key::NUMBER(10,0) AS CARD_KEY
+    FROM @s3_mtg_static_stage (PATTERN => '.*[.]parquet')
+    WHERE $1:card_key IS NOT NULL
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY ID ORDER BY METADATA$FILENAME DESC) = 1
+) AS keyed
+WHERE static.ID = keyed.ID;
+
+ALTER TABLE MTG_COST.PUBLIC.MTG_PRICES ADD COLUMN CARD_KEY NUMBER(10,0);
+
+UPDATE MTG_COST.PUBLIC.MTG_PRICES AS prices
+SET CARD_KEY = static.CARD_KEY
+FROM MTG_COST.PUBLIC.MTG_STATIC AS static
+WHERE prices.ID = static.ID;
+
+-- Must return 0 before dropping ID
+SELECT COUNT(*) AS unkeyed_rows FROM MTG_COST.PUBLIC.MTG_PRICES WHERE CARD_KEY IS NULL;
+
+ALTER TABLE MTG_COST.PUBLIC.MTG_PRICES DROP COLUMN ID;
+ALTER TABLE MTG_COST.PUBLIC.MTG_PRICES CLUSTER BY (CARD_KEY);
@@ -5,7 +5,7 @@ SELECT
 ,AVG(prices.usd_foil) AS avg_usd
 ,static.set_name
 FROM mtg_static AS static
-LEFT JOIN mtg_prices AS prices ON static.id = prices.id
+LEFT JOIN mtg_prices AS prices ON static.card_key = prices.card_key
 WHERE 1=1
     -- AND static.rarity IN ('mythic', 'rare')
     AND static.set_type IN ('expansion')
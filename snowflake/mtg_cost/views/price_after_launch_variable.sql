@@ -6,7 +6,7 @@ SELECT
 ,static.set_name
 ,static.rarity
 FROM mtg_static AS static
-LEFT JOIN mtg_prices AS prices ON static.id = prices.id
+LEFT JOIN mtg_prices AS prices ON static.card_key = prices.card_key
 WHERE 1=1
     AND static.set_name IN (
          'Tarkir: Dragonstorm'